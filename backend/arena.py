@@ -0,0 +1,210 @@
+import math
+from array import array
+from collections.abc import Sequence as SequenceABC
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from geoapify import PlaceResult, intern_categories
+
+
+class PlaceArena:
+    """
+    column store for a large number of places
+
+    coordinates, distances and ratings live in typed arrays, category strings
+    and category lists are stored once in lookup tables and referenced by
+    index, and the rarely set contact fields only take space for the places
+    that have them. PlaceResult objects and feature dicts are built on demand,
+    so a cache entry or batch result holds a handful of arrays instead of one
+    object (plus its strings and dicts) per place.
+    """
+
+    def __init__(self, places: Iterable[PlaceResult] = ()):
+        self.lats = array('d')
+        self.lons = array('d')
+        self.distances = array('q')
+        self.ratings = array('d')        # nan when the place has no rating
+        self.category_ids = array('I')
+        self.subcategory_ids = array('I')
+        self.category_set_ids = array('i')  # -1 when the place has no categories list
+
+        self.ids = []
+        self.names = []
+        self.addresses = []
+        self.extras = {}                 # index -> (phone, website, opening_hours, description)
+
+        self._strings = []
+        self._string_ids = {}
+        self._category_sets = []
+        self._category_set_ids = {}
+
+        self.extend(places)
+
+    def append(self, place: PlaceResult) -> None:
+        self.lats.append(place.lat)
+        self.lons.append(place.lon)
+        self.distances.append(int(place.distance))
+        self.ratings.append(math.nan if place.rating is None else place.rating)
+        self.category_ids.append(self._string_id(place.category))
+        self.subcategory_ids.append(self._string_id(place.subcategory))
+        self.category_set_ids.append(-1 if place.categories is None else self._category_set_id(place.categories))
+
+        self.ids.append(place.id)
+        self.names.append(place.name)
+        self.addresses.append(place.address)
+        if place.phone or place.website or place.opening_hours or place.description:
+            self.extras[len(self.ids) - 1] = (place.phone, place.website, place.opening_hours, place.description)
+
+    def extend(self, places: Iterable[PlaceResult]) -> None:
+        for place in places:
+            self.append(place)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def lat_array(self) -> np.ndarray:
+        """latitudes as a numpy view, no copy"""
+        return np.frombuffer(self.lats, dtype=np.float64) if self.lats else np.empty(0)
+
+    def lon_array(self) -> np.ndarray:
+        return np.frombuffer(self.lons, dtype=np.float64) if self.lons else np.empty(0)
+
+    def place(self, index: int, distance: Optional[int] = None) -> PlaceResult:
+        """the place at index as a new PlaceResult, optionally with a different distance"""
+        rating = self.ratings[index]
+        phone, website, opening_hours, description = self.extras.get(index, (None, None, None, None))
+        category_set = self.category_set_ids[index]
+        return PlaceResult(
+            id=self.ids[index],
+            name=self.names[index],
+            category=self._strings[self.category_ids[index]],
+            subcategory=self._strings[self.subcategory_ids[index]],
+            lat=self.lats[index],
+            lon=self.lons[index],
+            address=self.addresses[index],
+            distance=self.distances[index] if distance is None else distance,
+            rating=None if math.isnan(rating) else rating,
+            phone=phone,
+            website=website,
+            opening_hours=opening_hours,
+            description=description,
+            categories=None if category_set < 0 else list(self._category_sets[category_set])
+        )
+
+    def to_places(self, indices: Optional[Sequence[int]] = None,
+                  distances: Optional[Sequence[int]] = None) -> List[PlaceResult]:
+        """PlaceResults for indices (every place by default), distances replace the stored ones"""
+        if indices is None:
+            indices = range(len(self))
+        if distances is None:
+            return [self.place(i) for i in indices]
+        return [self.place(i, distance) for i, distance in zip(indices, distances)]
+
+    def features(self, marker_color: Callable[[str], str], marker_icon: Callable[[str], str]) -> Iterator[Dict]:
+        """
+        GeoJSON features in the same shape as CityExplorer._place_to_feature,
+        with the marker lookups done once per distinct category
+        """
+        markers = {}
+        for i in range(len(self)):
+            yield self.feature(i, marker_color, marker_icon, markers)
+
+    def feature(self, index: int, marker_color: Callable[[str], str], marker_icon: Callable[[str], str],
+                markers: Optional[Dict] = None) -> Dict:
+        """the place at index as a feature dict, markers memoizes marker lookups by category across calls"""
+        category_id = self.category_ids[index]
+        marker = markers.get(category_id) if markers is not None else None
+        if marker is None:
+            category = self._strings[category_id]
+            marker = (marker_color(category), marker_icon(category))
+            if markers is not None:
+                markers[category_id] = marker
+        color, icon = marker
+
+        rating = self.ratings[index]
+        phone, website, opening_hours, description = self.extras.get(index, (None, None, None, None))
+        return {
+            "type": "Feature",
+            "geometry": {
+                "type": "Point",
+                "coordinates": [self.lons[index], self.lats[index]]
+            },
+            "properties": {
+                "id": self.ids[index],
+                "name": self.names[index],
+                "category": self._strings[category_id],
+                "subcategory": self._strings[self.subcategory_ids[index]],
+                "address": self.addresses[index],
+                "distance": self.distances[index],
+                "rating": None if math.isnan(rating) else rating,
+                "phone": phone,
+                "website": website,
+                "opening_hours": opening_hours,
+                "description": description,
+                "marker_color": color,
+                "marker_icon": icon,
+                "marker_size": "medium"
+            }
+        }
+
+    def _string_id(self, value: str) -> int:
+        string_id = self._string_ids.get(value)
+        if string_id is None:
+            string_id = len(self._strings)
+            self._strings.append(value)
+            self._string_ids[value] = string_id
+        return string_id
+
+    def _category_set_id(self, categories: List[str]) -> int:
+        key = tuple(categories)
+        set_id = self._category_set_ids.get(key)
+        if set_id is None:
+            set_id = len(self._category_sets)
+            self._category_sets.append(tuple(intern_categories(categories)))
+            self._category_set_ids[key] = set_id
+        return set_id
+
+
+class FeatureList(SequenceABC):
+    """
+    the features list of a FeatureCollection with the places kept in an arena
+
+    head features (the event marker) are plain dicts, the places only become
+    feature dicts when the list is iterated or indexed, so a shared or cached
+    collection holds arrays and the dicts are built while it is serialized
+    (wire.dumps writes any sequence as a JSON array) and then dropped
+    """
+
+    def __init__(self, head: List[Dict], arena: PlaceArena, marker_color: Callable[[str], str],
+                 marker_icon: Callable[[str], str]):
+        self.head = head
+        self.arena = arena
+        self.marker_color = marker_color
+        self.marker_icon = marker_icon
+
+    def __len__(self) -> int:
+        return len(self.head) + len(self.arena)
+
+    def __iter__(self) -> Iterator[Dict]:
+        yield from self.head
+        yield from self.arena.features(self.marker_color, self.marker_icon)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        if index < len(self.head):
+            return self.head[index]
+        return self.arena.feature(index - len(self.head), self.marker_color, self.marker_icon)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, SequenceABC) or isinstance(other, str):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def __repr__(self) -> str:
+        return f"FeatureList({len(self.head)} head + {len(self.arena)} places)"
@@ -0,0 +1,439 @@
+"""
+ASGI entry point, an async serving mode next to the Flask app
+
+    uvicorn asgi:app --workers 4
+
+/events, /places, /event-with-places and /event-map-data are handled here
+with non-blocking upstream calls, so a request waiting on Ticketmaster or
+Geoapify holds no thread and one process can keep thousands of upstream
+waits open. they share ticketmaster's configuration, caches and rate
+limiters. every other path, and the paged and streamed variants of these
+ones, is passed to the Flask app on a worker thread, so the whole API is
+served either way. requests get the same latency budget, cap on Geoapify
+requests in flight, CORS and Server-Timing headers as under Flask. needs
+httpx for the upstream calls.
+"""
+import io
+import os
+import sys
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+import requests
+
+import metrics
+import ticketmaster as tm
+import upstream
+import wire
+from singleflight import AsyncSingleFlight
+
+
+# threads for the Flask fallback, the async clients' pool size is ticketmaster.ASYNC_POOL_SIZE
+WSGI_THREADS = int(os.getenv("WSGI_THREADS", "16"))
+
+wsgi_executor = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix="wsgi")
+
+# identical requests arriving together share one upstream computation
+places_flight = AsyncSingleFlight()
+events_flight = AsyncSingleFlight()
+
+_ticketmaster_http = None
+
+
+class Request:
+    """the parts of a request the handlers read"""
+
+    def __init__(self, scope: Dict):
+        self.path = scope['path']
+        self.args = Args(scope.get('query_string', b''))
+        self.headers = {}
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').lower()
+            value = value.decode('latin-1')
+            self.headers[name] = f"{self.headers[name]}, {value}" if name in self.headers else value
+
+
+class Args:
+    """query string values, read like flask's request.args"""
+
+    def __init__(self, query_string: bytes):
+        self._values = parse_qs(query_string.decode('utf-8', 'replace'), keep_blank_values=True)
+
+    def get(self, name: str, default=None, type=None):
+        values = self._values.get(name)
+        if not values:
+            return default
+        if type is None:
+            return values[0]
+        try:
+            return type(values[0])
+        except ValueError:
+            return default
+
+    def getlist(self, name: str) -> List[str]:
+        return list(self._values.get(name, []))
+
+
+class Response:
+    def __init__(self, body: bytes, status: int = 200, mimetype: str = 'application/json',
+                 headers: Optional[Dict[str, str]] = None):
+        self.body = body
+        self.status = status
+        self.headers = {'Content-Type': mimetype, 'Content-Length': str(len(body))}
+        self.headers.update(headers or {})
+
+    async def send(self, send) -> None:
+        await send({
+            'type': 'http.response.start',
+            'status': self.status,
+            'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in self.headers.items()]
+        })
+        await send({'type': 'http.response.body', 'body': self.body})
+
+
+def json_response(data, status: int = 200) -> Response:
+    return Response(wire.dumps(data), status)
+
+
+def respond(request: Request, data) -> Response:
+    """map payload in the negotiated format and compression, like ticketmaster.respond"""
+    fmt = wire.negotiate_format(request.args.get('format'), request.headers.get('accept', ''))
+    with metrics.stage('serialize'):
+        body, encoding = wire.compress(wire.encode(data, fmt), request.headers.get('accept-encoding', ''))
+
+    headers = {'Vary': 'Accept, Accept-Encoding'}
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return Response(body, mimetype=wire.MIMETYPES[fmt], headers=headers)
+
+
+def allow_origin(request: Request, response: Response) -> None:
+    """the CORS headers flask_cors adds under Flask, for an origin in tm.CORS_ORIGINS"""
+    origin = request.headers.get('origin')
+    if not origin or ('*' not in tm.CORS_ORIGINS and origin not in tm.CORS_ORIGINS):
+        return
+    response.headers['Access-Control-Allow-Origin'] = origin
+    vary = response.headers.get('Vary')
+    response.headers['Vary'] = f"{vary}, Origin" if vary else 'Origin'
+
+
+def rate_limited(error: upstream.RateLimited) -> Response:
+    headers = {}
+    if error.retry_after is not None:
+        headers['Retry-After'] = str(max(1, int(error.retry_after + 0.999)))
+    body = {"error": "Too many requests to Ticketmaster, try again shortly", "details": str(error)}
+    return Response(wire.dumps(body), 503, headers=headers)
+
+
+def deadline_exceeded(error: upstream.DeadlineExceeded) -> Response:
+    return json_response({"error": "Ticketmaster did not answer in time", "details": str(error)}, 504)
+
+
+def wants_stream(request: Request) -> bool:
+    # streamed responses are left to flask, it decides what the parameters mean
+    return bool(request.args.get('stream')) or 'application/x-ndjson' in request.headers.get('accept', '')
+
+
+def ticketmaster_http() -> upstream.AsyncUpstreamClient:
+    global _ticketmaster_http
+    if _ticketmaster_http is None:
+        _ticketmaster_http = upstream.AsyncUpstreamClient.like(tm.ticketmaster_client, pool_size=tm.ASYNC_POOL_SIZE)
+    return _ticketmaster_http
+
+
+async def fetch_discovery(city: str, size: int, page: int = 0) -> dict:
+    """raw Discovery API response for one page of a city's events"""
+    with metrics.stage('fetch'):
+        response = await ticketmaster_http().get(tm.TICKETMASTER_URL, params=tm.discovery_params(city, size, page))
+        upstream.raise_for_status(response)
+        return wire.loads(response.content)
+
+
+async def fetch_city_events(city: str, size: int = 20) -> list:
+    data = await fetch_discovery(city, size)
+    with metrics.stage('parse'):
+        events = tm.transform_events(data)
+    tm.event_index.add(city, events)
+    return events
+
+
+async def get_city_events(city: str, size: int = 20) -> list:
+    """events for a city, served from the shared event cache when possible"""
+    key = (city.strip().lower(), size)
+    return await tm.event_cache.get_async(
+        city, size, lambda: events_flight.do(key, lambda: fetch_city_events(city, size))
+    )
+
+
+async def get_places_geojson(event_location: dict, search_types: list, radius: int, limit: int) -> dict:
+    key = tm.places_key(event_location, search_types, radius, limit)
+    return await places_flight.do(key, lambda: tm.city_explorer.get_geojson_data_async(
+        event_location=event_location,
+        search_types=search_types,
+        radius=radius,
+        limit_per_category=limit
+    ), reuse=tm.reusable_places)
+
+
+async def get_events(request: Request) -> Optional[Response]:
+    args = request.args
+    city = args.get('city', '').strip()
+    size = args.get('size', 20, type=int)
+
+    if not city:
+        return json_response({"error": "Missing 'city' parameter"}, 400)
+    if args.get('cursor') or args.get('paged'):
+        return None
+
+    try:
+        events = await get_city_events(city, size)
+    except upstream.RateLimited as e:
+        return rate_limited(e)
+    except upstream.DeadlineExceeded as e:
+        return deadline_exceeded(e)
+    except requests.RequestException as e:
+        return json_response({"error": "Failed to connect to Ticketmaster", "details": str(e)}, 500)
+    return json_response(events)
+
+
+async def get_places(request: Request) -> Optional[Response]:
+    if wants_stream(request):
+        return None
+    args = request.args
+    try:
+        lat = args.get('lat', type=float)
+        lng = args.get('lng', type=float)
+        search_types = args.getlist('types') or ['restaurants', 'bars', 'entertainment']
+        radius = args.get('radius', 1000, type=int)
+        limit = args.get('limit', 10, type=int)
+
+        if not lat or not lng:
+            return json_response({"error": "Missing lat/lng parameters"}, 400)
+
+        event_location = {
+            'name': args.get('event_name', 'Event Location'),
+            'lat': lat,
+            'lon': lng,
+            'address': args.get('address', '')
+        }
+        return respond(request, await get_places_geojson(event_location, search_types, radius, limit))
+
+    except Exception as e:
+        return json_response({"error": "Failed to fetch places", "details": str(e)}, 500)
+
+
+async def get_event_with_places(request: Request) -> Optional[Response]:
+    if wants_stream(request):
+        return None
+    args = request.args
+    try:
+        event_name = args.get('event_name', 'Event')
+        lat = args.get('lat', type=float)
+        lng = args.get('lng', type=float)
+        address = args.get('address', '')
+        search_types = args.getlist('types') or ['restaurants', 'bars', 'entertainment', 'attractions']
+        radius = args.get('radius', 1500, type=int)
+        limit = args.get('limit', 15, type=int)
+
+        if not lat or not lng:
+            return json_response({"error": "Missing lat/lng parameters"}, 400)
+
+        event_location = {'name': event_name, 'lat': lat, 'lon': lng, 'address': address}
+        event = {
+            "id": args.get('event_id'),
+            "name": event_name,
+            "lat": lat,
+            "lng": lng,
+            "address": address,
+            "venue": args.get('venue', ''),
+            "datetime": args.get('datetime', ''),
+            "url": args.get('url', '')
+        }
+        geojson_data = await get_places_geojson(event_location, search_types, radius, limit)
+
+        return respond(request, {
+            "event": event,
+            "places_data": geojson_data,
+            "search_params": {"types": search_types, "radius": radius, "limit_per_category": limit}
+        })
+
+    except Exception as e:
+        return json_response({"error": "Failed to fetch event with places", "details": str(e)}, 500)
+
+
+async def get_event_map_data(request: Request) -> Optional[Response]:
+    args = request.args
+    try:
+        event_id = args.get('event_id')
+        city = args.get('city', '').strip()
+        size = args.get('size', 20, type=int)
+        search_types = args.getlist('types') or ['restaurants', 'bars', 'entertainment', 'attractions']
+        radius = args.get('radius', 1500, type=int)
+        limit = args.get('limit', 15, type=int)
+
+        if not city:
+            return json_response({"error": "Missing city parameter"}, 400)
+
+        try:
+            events = await get_city_events(city, size)
+        except upstream.RateLimited as e:
+            return rate_limited(e)
+        except upstream.DeadlineExceeded as e:
+            return deadline_exceeded(e)
+        except requests.RequestException as e:
+            return json_response({"error": "Failed to connect to Ticketmaster", "details": str(e)}, 500)
+
+        if not events:
+            return json_response({"error": "No events found"}, 404)
+
+        index = next((i for i, e in enumerate(events) if e['id'] == event_id), 0) if event_id else 0
+        selected_event = events[index]
+
+        # warming stays on ticketmaster's background pool at background priority
+        tm.prefetch_places(events[index + 1:index + 1 + tm.PREFETCH_EVENTS], search_types, radius, limit)
+
+        geojson_data = await get_places_geojson(tm.event_location_for(selected_event), search_types, radius, limit)
+
+        return respond(request, {
+            "event": selected_event,
+            "map_data": geojson_data,
+            "all_events": events
+        })
+
+    except Exception as e:
+        return json_response({"error": "Failed to fetch event map data", "details": str(e)}, 500)
+
+
+ROUTES = {
+    '/events': get_events,
+    '/places': get_places,
+    '/event-with-places': get_event_with_places,
+    '/event-map-data': get_event_map_data
+}
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    handler = ROUTES.get(scope['path']) if scope['method'] == 'GET' else None
+    if handler is not None:
+        started = time.perf_counter()
+        request = Request(scope)
+        metrics.start_request()
+        with upstream.deadline(tm.latency_budget(request.args.get('budget', type=float))):
+            response = await handler(request)
+        if response is not None:
+            allow_origin(request, response)
+            elapsed = time.perf_counter() - started
+            metrics.request_seconds.observe(elapsed, endpoint=scope['path'], status=str(response.status))
+            metrics.response_bytes.observe(len(response.body), endpoint=scope['path'])
+            if tm.SERVER_TIMING or request.args.get('timing') == '1':
+                response.headers['Server-Timing'] = metrics.server_timing(metrics.request_stages(), elapsed)
+            await response.send(send)
+            return
+
+    body = await read_body(receive)
+    await call_wsgi(scope, body, send)
+
+
+async def lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def close() -> None:
+    """close the async upstream clients of this event loop"""
+    global _ticketmaster_http
+    if _ticketmaster_http is not None:
+        await _ticketmaster_http.aclose()
+        _ticketmaster_http = None
+    if tm.city_explorer.async_http is not None:
+        await tm.city_explorer.async_http.aclose()
+        tm.city_explorer.async_http = None
+
+
+async def read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+async def call_wsgi(scope: Dict, body: bytes, send) -> None:
+    """
+    run the Flask app for one request on a worker thread, passing its output
+    on chunk by chunk so streamed responses still stream
+    """
+    loop = asyncio.get_running_loop()
+
+    def emit(message: Dict) -> None:
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    def run() -> None:
+        def start_response(status: str, headers: List[Tuple[str, str]], exc_info=None):
+            emit({
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+            })
+            return lambda data: emit({'type': 'http.response.body', 'body': data, 'more_body': True})
+
+        result = tm.app(wsgi_environ(scope, body), start_response)
+        try:
+            for chunk in result:
+                if chunk:
+                    emit({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        emit({'type': 'http.response.body', 'body': b''})
+
+    await loop.run_in_executor(wsgi_executor, run)
+
+
+def wsgi_environ(scope: Dict, body: bytes) -> Dict:
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+
+    for name, value in scope.get('headers', []):
+        key = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = 'HTTP_' + key
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
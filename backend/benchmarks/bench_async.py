@@ -0,0 +1,67 @@
+"""
+load comparison of the sync (Flask, fixed thread pool) and async (ASGI) serving modes
+
+run from the backend directory:
+
+    python benchmarks/bench_async.py --requests 2000 --concurrency 500 --delay 0.2
+
+each mode runs as its own server process with both upstream URLs pointed at a
+local stub that answers every call after --delay seconds, and rate limits off.
+every request asks /places around a different point so none is a cache hit.
+the sync server handles requests on --threads threads like a gunicorn gthread
+worker, the async one is uvicorn serving asgi:app (needs uvicorn and httpx).
+the load generator and the stub are plain asyncio so neither is the bottleneck.
+"""
+import os
+import sys
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest import StubUpstream, drive, free_port, start_server
+from suite import CENTER
+
+
+def unique_points(requests: int) -> list:
+    # a different point every time, far enough apart that no cache entry covers the next one
+    paths = []
+    for i in range(requests):
+        lat = CENTER[0] + (i % 100) * 0.05
+        lon = CENTER[1] + (i // 100) * 0.05
+        paths.append(('places', f"/places?lat={lat:.5f}&lng={lon:.5f}&types=restaurants&types=bars"
+                                f"&radius=500&limit=10"))
+    return paths
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=500)
+    parser.add_argument('--delay', type=float, default=0.2, help="stub upstream latency in seconds")
+    parser.add_argument('--threads', type=int, default=32, help="request threads of the sync server")
+    parser.add_argument('--modes', default='sync,async')
+    args = parser.parse_args(argv)
+
+    stub = StubUpstream(args.delay)
+    print(f"{'mode':<6} {'req':>6} {'err':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for mode in args.modes.split(','):
+        port = free_port()
+        try:
+            server = start_server(mode, port, stub.port, args.threads)
+        except RuntimeError as e:
+            print(f"{mode:<6} skipped: {e}")
+            continue
+        try:
+            result = asyncio.run(drive(port, unique_points(args.requests), args.concurrency))
+        finally:
+            server.terminate()
+            server.wait()
+        errors = result['requests'] - result['statuses'].get('200', 0)
+        print(f"{mode:<6} {result['requests']:>6} {errors:>5} {result['rps']:>8.0f} "
+              f"{result['p50_ms']:>8.0f} {result['p95_ms']:>8.0f} {result['p99_ms']:>8.0f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
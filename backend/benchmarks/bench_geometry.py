@@ -0,0 +1,61 @@
+"""
+per-object vs vectorized distance + ranking for place results
+
+run from the backend directory: python benchmarks/bench_geometry.py
+"""
+import os
+import sys
+import random
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import geoapify as geo
+import geometry
+
+CENTER = (40.7505, -73.9934)
+
+
+def make_places(count: int, seed: int = 1) -> list:
+    rng = random.Random(seed)
+    return [
+        geo.PlaceResult(
+            id=str(i), name=str(i), category='catering.restaurant', subcategory='catering.restaurant',
+            lat=CENTER[0] + rng.uniform(-0.01, 0.01), lon=CENTER[1] + rng.uniform(-0.01, 0.01),
+            address='', distance=0, rating=rng.choice([None, 3.5, 4.0, 4.5])
+        )
+        for i in range(count)
+    ]
+
+
+def per_object(places: list) -> list:
+    # the old path, one scalar distance per PlaceResult then a python sort
+    for place in places:
+        place.distance = int(geometry.haversine_m(CENTER[0], CENTER[1], place.lat, place.lon))
+    return sorted(places, key=lambda x: x.distance)
+
+
+def vectorized(places: list) -> list:
+    return geometry.nearest_first(places, CENTER[0], CENTER[1], [p.lat for p in places], [p.lon for p in places])
+
+
+def run(sizes=(10, 100, 1000, 10000), repeat: int = 5) -> dict:
+    results = {}
+    for size in sizes:
+        places = make_places(size)
+        number = max(1, 20000 // size)
+        # both paths only rewrite distance, so the same objects can be reused between runs
+        old = min(timeit.repeat(lambda: per_object(places), number=number, repeat=repeat))
+        new = min(timeit.repeat(lambda: vectorized(places), number=number, repeat=repeat))
+        results[size] = {
+            "per_object_us": old / number * 1e6,
+            "vectorized_us": new / number * 1e6,
+            "speedup": old / new
+        }
+    return results
+
+
+if __name__ == '__main__':
+    print(f"{'places':>8} {'per-object us':>14} {'vectorized us':>14} {'speedup':>8}")
+    for size, result in run().items():
+        print(f"{size:>8} {result['per_object_us']:>14.1f} {result['vectorized_us']:>14.1f} {result['speedup']:>7.2f}x")
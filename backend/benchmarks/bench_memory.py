@@ -0,0 +1,94 @@
+"""
+memory held by 100k parsed places: plain dataclass (before), slotted
+PlaceResult with interned categories, and a PlaceArena
+
+run from the backend directory: python benchmarks/bench_memory.py
+"""
+import os
+import sys
+import random
+import tracemalloc
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import geoapify as geo
+from arena import PlaceArena
+
+CATEGORIES = [
+    ['catering', 'catering.restaurant'], ['catering', 'catering.bar'], ['catering', 'catering.cafe'],
+    ['entertainment', 'entertainment.cinema'], ['commercial', 'commercial.clothing']
+]
+
+
+# PlaceResult as it was before, with a per instance __dict__
+@dataclass
+class DictPlaceResult:
+    id: str
+    name: str
+    category: str
+    subcategory: str
+    lat: float
+    lon: float
+    address: str
+    distance: int
+    rating: Optional[float] = None
+    phone: Optional[str] = None
+    website: Optional[str] = None
+    opening_hours: Optional[Dict] = None
+    description: Optional[str] = None
+    categories: Optional[List[str]] = None
+
+
+def raw_features(count: int, seed: int = 1) -> list:
+    # what json parsing hands us: fresh strings for every place, nothing shared
+    rng = random.Random(seed)
+    features = []
+    for i in range(count):
+        categories = [''.join(c) for c in rng.choice(CATEGORIES)]
+        features.append({
+            'id': f"place_{i}", 'name': f"Place {i}", 'categories': categories,
+            'lat': 40.75 + rng.uniform(-0.1, 0.1), 'lon': -73.99 + rng.uniform(-0.1, 0.1),
+            'address': f"{i} Main St, New York", 'distance': rng.randint(0, 2000),
+            'rating': rng.choice([None, 4.0, 4.5]),
+            'opening_hours': rng.choice([None, None, None, 'Mo-Fr 09:00-17:00'])
+        })
+    return features
+
+
+def build(cls, features: list, intern: bool) -> list:
+    places = []
+    for f in features:
+        categories = geo.intern_categories(f['categories']) if intern else f['categories']
+        places.append(cls(
+            id=f['id'], name=f['name'], category=categories[0], subcategory=categories[1],
+            lat=f['lat'], lon=f['lon'], address=f['address'], distance=f['distance'],
+            rating=f['rating'], opening_hours=f['opening_hours'], categories=categories
+        ))
+    return places
+
+
+def measure(make) -> int:
+    tracemalloc.start()
+    held = make()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del held
+    return size
+
+
+def run(count: int = 100000) -> dict:
+    # the parsed json is built inside each measurement and dropped, only what the
+    # representation keeps alive is counted
+    return {
+        'dataclass (before)': measure(lambda: build(DictPlaceResult, raw_features(count), intern=False)),
+        'slotted + interned': measure(lambda: build(geo.PlaceResult, raw_features(count), intern=True)),
+        'arena': measure(lambda: PlaceArena(build(geo.PlaceResult, raw_features(count), intern=True))),
+    }
+
+
+if __name__ == '__main__':
+    count = 100000
+    for name, size in run(count).items():
+        print(f"{name:>20} {size / 1e6:>8.1f} MB {size / count:>7.0f} B/place")
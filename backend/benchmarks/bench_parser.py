@@ -0,0 +1,125 @@
+"""
+geoapify response parsing: response.json() plus the old per feature walk and
+marker lookups, against parse_places on the raw bytes
+
+the payload is rebuilt in geoapify's response shape from the recorded
+sample_text.txt dump. run from the backend directory: python benchmarks/bench_parser.py
+"""
+import os
+import sys
+import json
+import timeit
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+import geoapify as geo
+
+SAMPLE_PATH = os.path.join(BACKEND, 'sample_text.txt')
+
+OLD_COLORS = {
+    'catering.restaurant': 'green', 'catering.bar': 'purple', 'catering.pub': 'purple', 'catering.cafe': 'orange',
+    'catering.fast_food': 'lightgreen', 'entertainment': 'blue', 'tourism.attraction': 'red', 'commercial': 'gray'
+}
+OLD_ICONS = {
+    'catering.restaurant': 'cutlery', 'catering.bar': 'glass', 'catering.pub': 'beer', 'catering.cafe': 'coffee',
+    'catering.fast_food': 'cutlery', 'entertainment': 'music', 'tourism.attraction': 'camera',
+    'commercial': 'shopping-cart'
+}
+
+
+def recorded_payload(copies: int = 1) -> bytes:
+    """the sample dump's places as a raw geoapify places response"""
+    with open(SAMPLE_PATH, 'rb') as f:
+        raw = f.read()
+    encoding = 'utf-16' if raw[:2] in (b'\xff\xfe', b'\xfe\xff') else 'utf-8'
+    dump = json.loads(raw.decode(encoding))
+
+    features = []
+    for copy in range(copies):
+        for feature in dump['features']:
+            props = feature['properties']
+            if props.get('type') == 'event':
+                continue
+            features.append({
+                'type': 'Feature',
+                'geometry': feature['geometry'],
+                'properties': {
+                    'place_id': f"{props['id']}{copy}",
+                    'name': props['name'],
+                    'categories': [props['category'], props['subcategory']],
+                    'formatted': props['address'],
+                    'address_line1': props['name'],
+                    'address_line2': props['address'],
+                    'distance': props['distance'],
+                    'contact': {'phone': props['phone'], 'website': props['website']},
+                    'opening_hours': props['opening_hours'],
+                    'datasource': {'sourcename': 'openstreetmap', 'raw': {'osm_id': 1, 'amenity': 'restaurant'}}
+                }
+            })
+    return json.dumps({'type': 'FeatureCollection', 'features': features}).encode('utf-8')
+
+
+def old_marker(mapping: dict, category: str, default: str) -> str:
+    for key, value in mapping.items():
+        if key in category:
+            return value
+    return default
+
+
+def old_rating(props: dict):
+    for rating in [props.get('datasource', {}).get('raw', {}).get('rating'), props.get('rating'),
+                   props.get('datasource', {}).get('raw', {}).get('stars')]:
+        if rating is not None:
+            try:
+                return float(rating)
+            except (ValueError, TypeError):
+                continue
+    return None
+
+
+def before(body: bytes) -> list:
+    # response.json() goes through the stdlib decoder
+    response = json.loads(body.decode('utf-8'))
+    places = []
+    for feature in response.get('features', []):
+        props = feature.get('properties', {})
+        coords = feature.get('geometry', {}).get('coordinates', [])
+        if len(coords) < 2:
+            continue
+        categories = props.get('categories', ['unknown'])
+        main_category = categories[0] if categories else 'unknown'
+        places.append(geo.PlaceResult(
+            id=props.get('place_id', f"{coords[1]}_{coords[0]}"), name=props.get('name', 'Unknown'),
+            category=main_category, subcategory=categories[1] if len(categories) > 1 else main_category,
+            lat=coords[1], lon=coords[0], address=props.get('formatted', ''),
+            distance=int(props.get('distance', 0)), rating=old_rating(props),
+            phone=props.get('contact', {}).get('phone'), website=props.get('contact', {}).get('website'),
+            opening_hours=props.get('opening_hours'), description=props.get('description'), categories=categories
+        ))
+    places.sort(key=lambda x: x.distance)
+    return [(old_marker(OLD_COLORS, p.category, 'gray'), old_marker(OLD_ICONS, p.category, 'map-marker'))
+            for p in places]
+
+
+def after(body: bytes) -> list:
+    return [geo.marker_style(p.category) for p in geo.parse_places(body)]
+
+
+def run(copies=(1, 10), repeat: int = 5) -> dict:
+    results = {}
+    for count in copies:
+        body = recorded_payload(count)
+        assert before(body) == after(body)
+        number = max(1, 2000 // count)
+        old = min(timeit.repeat(lambda: before(body), number=number, repeat=repeat)) / number
+        new = min(timeit.repeat(lambda: after(body), number=number, repeat=repeat)) / number
+        results[body.count(b'"Feature"')] = {'before_us': old * 1e6, 'after_us': new * 1e6, 'speedup': old / new}
+    return results
+
+
+if __name__ == '__main__':
+    print(f"orjson: {'yes' if geo.wire.orjson else 'no'}")
+    print(f"{'features':>8} {'before us':>12} {'after us':>12} {'speedup':>8}")
+    for count, result in run().items():
+        print(f"{count:>8} {result['before_us']:>12.1f} {result['after_us']:>12.1f} {result['speedup']:>7.2f}x")
@@ -0,0 +1,49 @@
+"""
+payload size and encode time of a 100 feature /places response per wire format
+
+run from the backend directory: python benchmarks/bench_wire.py
+"""
+import os
+import sys
+import gzip
+import json
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import wire
+from test_wire import make_collection
+
+
+def jsonify_today(data) -> bytes:
+    # what flask's jsonify did before: stdlib encoder with sorted keys
+    return json.dumps(data, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+ENCODERS = {
+    'jsonify (before)': jsonify_today,
+    'json': lambda data: wire.encode(data, wire.JSON),
+    'columnar': lambda data: wire.encode(data, wire.COLUMNAR),
+    'binary': lambda data: wire.encode(data, wire.BINARY),
+}
+
+
+def run(count: int = 100, number: int = 200, repeat: int = 5) -> dict:
+    payload = make_collection(count)
+    results = {}
+    for name, encode in ENCODERS.items():
+        body = encode(payload)
+        seconds = min(timeit.repeat(lambda: encode(payload), number=number, repeat=repeat)) / number
+        results[name] = {
+            'bytes': len(body),
+            'gzip_bytes': len(gzip.compress(body, compresslevel=6)),
+            'encode_us': seconds * 1e6
+        }
+    return results
+
+
+if __name__ == '__main__':
+    print(f"orjson: {'yes' if wire.orjson else 'no'}, brotli: {'yes' if wire.brotli else 'no'}")
+    print(f"{'format':>18} {'bytes':>8} {'gzip':>8} {'encode us':>10}")
+    for name, result in run().items():
+        print(f"{name:>18} {result['bytes']:>8} {result['gzip_bytes']:>8} {result['encode_us']:>10.1f}")
@@ -0,0 +1,410 @@
+"""
+end to end load test against local stand-ins for Ticketmaster and Geoapify
+
+    python benchmarks/loadtest.py                            every scenario against the sync server
+    python benchmarks/loadtest.py -s flaky -s throttled      only some of them
+    python benchmarks/loadtest.py --mode async --requests 5000 --concurrency 200
+    python benchmarks/loadtest.py --save loadtest.json       keep this run's numbers
+    python benchmarks/loadtest.py --compare loadtest.json    exit 1 when throughput or p95 got worse
+
+run from the backend directory. each scenario starts a fresh server process,
+so caches start cold, with both upstream URLs pointed at a stub that answers
+from the fixtures (the recorded sample_text.txt places and a seeded 200 event
+Discovery response) after a latency drawn from the scenario's distribution,
+and fails or throttles the configured share of calls with a 500 or a 429 with
+Retry-After. the traffic is a weighted mix of /events, /places,
+/event-with-places and /event-map-data over a few cities and a Zipf skewed
+set of venues, so repeats hit the caches about as often as real traffic does.
+per scenario it reports throughput, p50/p95/p99 latency, the status codes
+seen and upstream amplification: upstream calls per request, per upstream.
+"""
+import os
+import sys
+import math
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import threading
+import subprocess
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_parser import recorded_payload
+from suite import synthetic_discovery_payload
+
+DEFAULT_THRESHOLD = 1.25
+
+# z for the 99th percentile of a standard normal
+_Z99 = 2.3263
+
+CITIES = ['Austin', 'New York', 'Chicago', 'Seattle']
+MIX = {'events': 0.3, 'places': 0.3, 'event-with-places': 0.2, 'event-map-data': 0.2}
+
+
+class Latency:
+    """
+    upstream response time distribution, from a spec string
+
+    "0.05" is a fixed 50ms, "uniform:0.02,0.2" uniform between the bounds and
+    "lognormal:0.08,0.5" lognormal with a 80ms median and a 500ms p99
+    """
+
+    def __init__(self, spec: str):
+        kind, _, args = spec.rpartition(':')
+        self.kind = kind or 'fixed'
+        self.values = [float(v) for v in args.split(',')]
+        self.spec = spec
+        if self.kind not in ('fixed', 'uniform', 'lognormal'):
+            raise ValueError(f"unknown latency distribution {self.kind!r}")
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == 'fixed':
+            return self.values[0]
+        if self.kind == 'uniform':
+            return rng.uniform(*self.values)
+        median, p99 = self.values
+        return rng.lognormvariate(math.log(median), math.log(p99 / median) / _Z99)
+
+
+@dataclass
+class Scenario:
+    name: str
+    latency: str
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+
+
+SCENARIOS = {
+    s.name: s for s in [
+        Scenario('baseline', 'lognormal:0.08,0.4'),
+        Scenario('slow', 'lognormal:0.3,3.0'),
+        Scenario('flaky', 'lognormal:0.08,0.4', error_rate=0.1),
+        Scenario('throttled', 'lognormal:0.08,0.4', throttle_rate=0.2)
+    ]
+}
+
+
+class StubUpstream:
+    """
+    Geoapify and Ticketmaster stand-in on its own event loop thread
+
+    every call waits a latency drawn from latency, then error_rate of them get
+    a 500 and throttle_rate a 429 with a Retry-After of retry_after seconds.
+    calls and faults are counted per upstream
+    """
+
+    def __init__(self, latency='0.05', error_rate: float = 0.0, throttle_rate: float = 0.0,
+                 retry_after: int = 1, seed: int = 5):
+        self.latency = latency if isinstance(latency, Latency) else Latency(str(latency))
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.calls = {'ticketmaster': 0, 'geoapify': 0}
+        self.faults = {'500': 0, '429': 0}
+
+        self.places = recorded_payload()
+        self.events = json.dumps(synthetic_discovery_payload(200)).encode('utf-8')
+        self.port = None
+        self._loop = None
+        self._server = None
+        self._ready = threading.Event()
+        threading.Thread(target=self._run, daemon=True).start()
+        self._ready.wait()
+
+    def stop(self) -> None:
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result()
+
+    def _run(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, '127.0.0.1', 0, backlog=4096)
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+        self._loop.close()
+
+    async def _shutdown(self) -> None:
+        # connections the server process left open are cut before the loop goes away
+        self._server.close()
+        handlers = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in handlers:
+            task.cancel()
+        await asyncio.gather(*handlers, return_exceptions=True)
+        self._loop.call_soon(self._loop.stop)
+
+    async def _handle(self, reader, writer) -> None:
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                upstream = 'ticketmaster' if head.split(b' ', 2)[1].startswith(b'/events') else 'geoapify'
+                self.calls[upstream] += 1
+                await asyncio.sleep(self.latency.sample(self.rng))
+
+                roll = self.rng.random()
+                if roll < self.error_rate:
+                    self.faults['500'] += 1
+                    status, headers, body = b'500 Internal Server Error', b'', b'{"error": "injected"}'
+                elif roll < self.error_rate + self.throttle_rate:
+                    self.faults['429'] += 1
+                    status, headers, body = b'429 Too Many Requests', \
+                        b'Retry-After: %d\r\n' % self.retry_after, b'{"error": "throttled"}'
+                else:
+                    status, headers = b'200 OK', b''
+                    body = self.events if upstream == 'ticketmaster' else self.places
+                writer.write(b'HTTP/1.1 ' + status + b'\r\nContent-Type: application/json\r\n' + headers +
+                             b'Content-Length: %d\r\n\r\n' % len(body) + body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            # cancelled means stop() is cutting the connection, not an error to report
+            pass
+        finally:
+            writer.close()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# a fixed pool of request threads in front of the Flask app, like a gunicorn gthread worker
+SYNC_SERVER = """
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import BaseWSGIServer
+from ticketmaster import app
+
+class PooledServer(BaseWSGIServer):
+    multithread = True
+    request_queue_size = 4096
+
+    def __init__(self, host, port, app, threads):
+        super().__init__(host, port, app)
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+PooledServer('127.0.0.1', int(sys.argv[1]), app, int(sys.argv[2])).serve_forever()
+"""
+
+
+def start_server(mode: str, port: int, stub_port: int, threads: int,
+                 env: Optional[Dict[str, str]] = None) -> subprocess.Popen:
+    """the backend in its own process, 'sync' (Flask) or 'async' (uvicorn asgi:app), talking to the stub"""
+    env = dict(
+        os.environ,
+        GEOAPIFY_URL=f"http://127.0.0.1:{stub_port}/places",
+        TICKETMASTER_URL=f"http://127.0.0.1:{stub_port}/events.json",
+        # the real limits would be what's measured, and a run would spend a day's quota
+        GEOAPIFY_RATE="0",
+        TICKETMASTER_RATE="0",
+        GEOAPIFY_MAX_IN_FLIGHT="10000",
+        UPSTREAM_POOL_SIZE=str(threads * 4),
+        ASYNC_POOL_SIZE="1000",
+        **(env or {})
+    )
+    if mode == 'sync':
+        command = [sys.executable, '-c', SYNC_SERVER, str(port), str(threads)]
+    else:
+        command = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--port', str(port),
+                   '--log-level', 'warning', '--backlog', '4096']
+    process = subprocess.Popen(command, cwd=BACKEND, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{mode} server exited with {process.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+async def get(port: int, path: str) -> int:
+    """status of one GET on a fresh connection, 0 when the connection failed"""
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    except OSError:
+        return 0
+    try:
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        response = await reader.read()
+        return int(response.split(b' ', 2)[1])
+    except (OSError, IndexError, ValueError):
+        return 0
+    finally:
+        writer.close()
+
+
+def percentiles(latencies: List[float]) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000 if latencies else 0.0
+    return {'p50_ms': pick(0.50), 'p95_ms': pick(0.95), 'p99_ms': pick(0.99)}
+
+
+async def drive(port: int, requests: List[Tuple[str, str]], concurrency: int) -> Dict:
+    """
+    send (endpoint, path) requests with at most concurrency in flight
+
+    returns the totals (requests, seconds, rps, percentiles, statuses) and
+    the same per endpoint under 'endpoints'
+    """
+    slots = asyncio.Semaphore(concurrency)
+    latencies = {}
+    statuses = {}
+
+    async def one(endpoint: str, path: str) -> None:
+        async with slots:
+            start = time.perf_counter()
+            status = await get(port, path)
+            latencies.setdefault(endpoint, []).append(time.perf_counter() - start)
+            statuses.setdefault(endpoint, {}).setdefault(str(status), 0)
+            statuses[endpoint][str(status)] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(endpoint, path) for endpoint, path in requests))
+    wall = time.perf_counter() - start
+
+    every = [latency for values in latencies.values() for latency in values]
+    totals = {}
+    for counts in statuses.values():
+        for status, count in counts.items():
+            totals[status] = totals.get(status, 0) + count
+    return dict(
+        requests=len(requests), seconds=wall, rps=len(requests) / wall, statuses=totals, **percentiles(every),
+        endpoints={
+            endpoint: dict(requests=len(values), statuses=statuses[endpoint], **percentiles(values))
+            for endpoint, values in sorted(latencies.items())
+        }
+    )
+
+
+def traffic(count: int, seed: int = 1) -> List[Tuple[str, str]]:
+    """count (endpoint, path) requests in MIX proportions, venues picked with a Zipf skew"""
+    rng = random.Random(seed)
+    events = synthetic_discovery_payload(200)['_embedded']['events']
+    popularity = [1 / (rank + 1) ** 1.1 for rank in range(len(events))]
+
+    requests = []
+    for endpoint in rng.choices(list(MIX), weights=list(MIX.values()), k=count):
+        event = rng.choices(events, weights=popularity)[0]
+        venue = event['_embedded']['venues'][0]
+        lat, lng = venue['location']['latitude'], venue['location']['longitude']
+        city = rng.choice(CITIES)
+        if endpoint == 'events':
+            query = {'city': city}
+        elif endpoint == 'places':
+            query = {'lat': lat, 'lng': lng, 'types': ['restaurants', 'bars']}
+        elif endpoint == 'event-with-places':
+            query = {'event_id': event['id'], 'event_name': event['name'], 'lat': lat, 'lng': lng,
+                     'venue': venue['name']}
+        else:
+            query = {'city': city, 'event_id': event['id']}
+        requests.append((endpoint, f"/{endpoint}?{urlencode(query, doseq=True)}"))
+    return requests
+
+
+def run_scenario(scenario: Scenario, mode: str, requests: int, concurrency: int, threads: int) -> Dict:
+    stub = StubUpstream(scenario.latency, scenario.error_rate, scenario.throttle_rate)
+    port = free_port()
+    try:
+        server = start_server(mode, port, stub.port, threads)
+        try:
+            result = asyncio.run(drive(port, traffic(requests), concurrency))
+        finally:
+            server.terminate()
+            server.wait()
+    finally:
+        stub.stop()
+
+    result['amplification'] = {name: calls / requests for name, calls in stub.calls.items()}
+    result['faults'] = dict(stub.faults)
+    return result
+
+
+def regressions(results: Dict, saved: Dict, threshold: float) -> List[str]:
+    """scenarios whose throughput fell or p95 rose by more than threshold times the saved run"""
+    slower = []
+    for name, result in results.items():
+        before = saved.get(name)
+        if before is None:
+            continue
+        if result['rps'] * threshold < before['rps'] or result['p95_ms'] > before['p95_ms'] * threshold:
+            slower.append(name)
+    return slower
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-s', '--scenario', action='append', choices=sorted(SCENARIOS),
+                        help="scenario to run, repeatable, every one by default")
+    parser.add_argument('--mode', choices=['sync', 'async'], default='sync')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--threads', type=int, default=32, help="request threads of the sync server")
+    parser.add_argument('--save', metavar='PATH', help="write the results as JSON")
+    parser.add_argument('--compare', metavar='PATH', help="fail on a regression against saved results")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    results = {}
+    print(f"{'scenario':<10} {'req/s':>7} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} "
+          f"{'tm/req':>7} {'geo/req':>7}  statuses")
+    for name in args.scenario or list(SCENARIOS):
+        try:
+            result = run_scenario(SCENARIOS[name], args.mode, args.requests, args.concurrency, args.threads)
+        except RuntimeError as e:
+            print(f"{name:<10} skipped: {e}")
+            continue
+        results[name] = result
+        statuses = ' '.join(f"{status}:{count}" for status, count in sorted(result['statuses'].items()))
+        print(f"{name:<10} {result['rps']:>7.0f} {result['p50_ms']:>7.0f} {result['p95_ms']:>7.0f} "
+              f"{result['p99_ms']:>7.0f} {result['amplification']['ticketmaster']:>7.2f} "
+              f"{result['amplification']['geoapify']:>7.2f}  {statuses}")
+        for endpoint, numbers in result['endpoints'].items():
+            print(f"  {endpoint:<18} {numbers['requests']:>5} req  p50 {numbers['p50_ms']:>6.0f}  "
+                  f"p95 {numbers['p95_ms']:>6.0f}  p99 {numbers['p99_ms']:>6.0f}")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+        print(f"results written to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            saved = json.load(f)
+        slower = regressions(results, saved, args.threshold)
+        for name in slower:
+            print(f"REGRESSION {name}: {results[name]['rps']:.0f} req/s, p95 {results[name]['p95_ms']:.0f}ms "
+                  f"vs {saved[name]['rps']:.0f} req/s, p95 {saved[name]['p95_ms']:.0f}ms")
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,252 @@
+"""
+hot path benchmark suite with stored baselines
+
+    python benchmarks/suite.py                  run and print every case
+    python benchmarks/suite.py --check          compare against baselines.json, exit 1 on a regression
+    python benchmarks/suite.py --update         record the current numbers as the new baselines
+    python benchmarks/suite.py -k parse         only cases whose name contains "parse"
+
+run from the backend directory. timings are divided by a fixed pure python
+calibration loop timed right after each case, so baselines recorded on one machine
+stay comparable on another. fixtures are the recorded sample_text.txt dump
+(rebuilt in geoapify's response shape) and seeded synthetic 10/100/1000
+feature geoapify responses and 200 and 5000 event discovery responses.
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import timeit
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import geoapify as geo
+import planner
+import ticketmaster
+import wire
+from eventindex import EventIndex
+from bench_parser import recorded_payload
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+DEFAULT_THRESHOLD = 1.25
+
+CENTER = (40.7505, -73.9934)
+CATEGORIES = [
+    ['catering', 'catering.restaurant'], ['catering', 'catering.bar'], ['catering', 'catering.pub'],
+    ['catering', 'catering.cafe'], ['catering', 'catering.fast_food'], ['entertainment', 'entertainment.cinema'],
+    ['tourism', 'tourism.attraction'], ['commercial', 'commercial.clothing'], ['leisure', 'leisure.park']
+]
+
+
+def synthetic_places_payload(count: int, seed: int = 7) -> bytes:
+    """a geoapify places response with count features around CENTER"""
+    rng = random.Random(seed)
+    features = []
+    for i in range(count):
+        lat = CENTER[0] + rng.uniform(-0.01, 0.01)
+        lon = CENTER[1] + rng.uniform(-0.01, 0.01)
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+            'properties': {
+                'place_id': f"{seed}_{i}",
+                'name': f"Place {i}",
+                'categories': rng.choice(CATEGORIES),
+                'formatted': f"{i} Example Ave, New York, NY",
+                'distance': rng.randint(0, 1500),
+                'contact': {'phone': '+1 212 555 0100'} if i % 4 == 0 else {},
+                'opening_hours': 'Mo-Su 10:00-22:00' if i % 3 == 0 else None,
+                'datasource': {'sourcename': 'openstreetmap', 'raw': {'stars': 4} if i % 5 == 0 else {}}
+            }
+        })
+    return json.dumps({'type': 'FeatureCollection', 'features': features}).encode('utf-8')
+
+
+def synthetic_discovery_payload(count: int, seed: int = 11) -> dict:
+    rng = random.Random(seed)
+    return {"_embedded": {"events": [
+        {
+            "id": f"evt{i}",
+            "name": f"Event {i}",
+            "url": f"https://example.com/{i}",
+            "dates": {"start": {"localDate": f"2025-08-{1 + i % 28:02d}"}},
+            "classifications": [{"segment": {"name": "Music"}, "genre": {"name": rng.choice(["Rock", "Jazz"])}}],
+            "_embedded": {"venues": [{
+                "name": f"Venue {i % 15}",
+                "address": {"line1": f"{i} Main St"},
+                "city": {"name": "New York"},
+                "location": {"latitude": str(CENTER[0] + rng.uniform(-0.05, 0.05)),
+                             "longitude": str(CENTER[1] + rng.uniform(-0.05, 0.05))}
+            }]}
+        }
+        for i in range(count)
+    ]}}
+
+
+class _RecordedResponse:
+    status_code = 200
+
+    def __init__(self, content: bytes):
+        self.content = content
+
+    def raise_for_status(self):
+        return None
+
+
+class RecordedClient:
+    """stands in for the geoapify UpstreamClient, answers every call with the same recorded body"""
+
+    def __init__(self, body: bytes):
+        self.body = body
+
+    def get(self, url, params=None, timeout=None, slots=None):
+        return _RecordedResponse(self.body)
+
+
+def calibration():
+    # fixed pure python work every result is divided by
+    total = 0
+    for i in range(20000):
+        total += i % 7
+    return total
+
+
+def build_cases() -> dict:
+    """name -> zero argument callable"""
+    explorer = geo.CityExplorer('bench', concurrent=False)
+    event_location = {'name': 'Venue', 'lat': CENTER[0], 'lon': CENTER[1], 'address': ''}
+
+    payloads = {'sample': recorded_payload()}
+    for count in (10, 100, 1000):
+        payloads[str(count)] = synthetic_places_payload(count)
+
+    cases = {}
+    for name, body in payloads.items():
+        cases[f"parse_api_response[{name}]"] = lambda body=body: explorer._parse_api_response(body, center=CENTER)
+
+    for name in ('sample', '100'):
+        recorded = geo.CityExplorer('bench', concurrent=False, http_client=RecordedClient(payloads[name]))
+        cases[f"get_geojson_data[{name}]"] = lambda recorded=recorded: recorded.get_geojson_data(
+            event_location, ['restaurants', 'bars', 'entertainment', 'attractions'], 1000, 25)
+
+    places = explorer._parse_api_response(payloads['1000'], center=CENTER)
+    cases["marker_style[1000]"] = lambda: [
+        (explorer._get_marker_color(p.category), explorer._get_marker_icon(p.category)) for p in places
+    ]
+    cases["place_to_feature[1000]"] = lambda: [explorer._place_to_feature(p) for p in places]
+    cases["calculate_bounds[1000]"] = lambda: [explorer._calculate_bounds(p.lat, p.lon, 1500) for p in places]
+
+    discovery = synthetic_discovery_payload(200)
+    cases["transform_events[200]"] = lambda: ticketmaster.transform_events(discovery)
+
+    index = EventIndex()
+    index.add('New York', ticketmaster.transform_events(synthetic_discovery_payload(5000)))
+    cases["event_index_search[5000]"] = lambda: index.search(
+        q='even', segments=['Music'], genres=['Jazz'], start='2025-08-05', end='2025-08-12', limit=20)
+    cases["event_index_near[5000]"] = lambda: index.search(near=CENTER, radius=1000, limit=20)
+
+    # 20 candidates for each of two stops before the event and three after it
+    candidates = iter(places[:100])
+    before = {t: [next(candidates) for _ in range(20)] for t in ('restaurants', 'attractions')}
+    after = {t: [next(candidates) for _ in range(20)] for t in ('bars', 'entertainment', 'cafes')}
+    evening = planner.parse_event_time('2025-08-01T20:00')
+    cases["plan_route[100]"] = lambda: planner.plan_route(CENTER, evening, 180, before, after)
+
+    geojson = geo.CityExplorer('bench', concurrent=False, http_client=RecordedClient(payloads['100'])) \
+        .get_geojson_data(event_location, ['restaurants', 'bars'], 1000, 50)
+
+    def flask_jsonify():
+        with ticketmaster.app.app_context():
+            return ticketmaster.jsonify(geojson).get_data()
+
+    cases["jsonify[100]"] = flask_jsonify
+    cases["wire_encode_json[100]"] = lambda: wire.encode(geojson)
+    cases["wire_encode_columnar[100]"] = lambda: wire.encode(geojson, wire.COLUMNAR)
+    return cases
+
+
+def measure(fn, repeat: int = 7, budget: float = 0.05) -> float:
+    """best seconds per call over repeat runs of about budget seconds each, the minimum is the least noisy"""
+    fn()
+    number = 1
+    while True:
+        elapsed = timeit.timeit(fn, number=number)
+        if elapsed >= budget / 5 or number >= 100000:
+            break
+        number *= 4
+    number = max(1, int(number * (budget / max(elapsed, 1e-9))))
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number
+
+
+def run(pattern: str = '', names=None) -> dict:
+    results = {}
+    for name, fn in build_cases().items():
+        if (pattern and pattern not in name) or (names is not None and name not in names):
+            continue
+        # calibrated next to each case so drifting machine load hits both alike
+        seconds = measure(fn)
+        unit = measure(calibration)
+        results[name] = {'us': seconds * 1e6, 'relative': seconds / unit}
+    return results
+
+
+def check(results: dict, baselines: dict, threshold: float) -> list:
+    """names of cases slower than threshold times their baseline"""
+    regressions = []
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        if baseline is not None and result['relative'] > baseline * threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--check', action='store_true', help="fail when a case regressed past the threshold")
+    parser.add_argument('--update', action='store_true', help="store these results as the baselines")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument('--retries', type=int, default=2, help="re-measure regressed cases this many times")
+    parser.add_argument('-k', dest='pattern', default='', help="only run cases containing this")
+    args = parser.parse_args(argv)
+
+    baselines = {}
+    if os.path.exists(BASELINES_PATH):
+        with open(BASELINES_PATH) as f:
+            baselines = json.load(f)
+
+    results = run(args.pattern)
+
+    print(f"{'case':<32} {'us':>12} {'relative':>10} {'baseline':>10}")
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        shown = f"{baseline:>10.2f}" if baseline is not None else f"{'-':>10}"
+        print(f"{name:<32} {result['us']:>12.1f} {result['relative']:>10.2f} {shown}")
+
+    if args.update:
+        baselines.update({name: float(f"{result['relative']:.4g}") for name, result in results.items()})
+        with open(BASELINES_PATH, 'w') as f:
+            json.dump(dict(sorted(baselines.items())), f, indent=2)
+            f.write('\n')
+        print(f"baselines written to {BASELINES_PATH}")
+
+    if args.check:
+        # a slow case is measured again before it counts, one noisy run shouldn't fail a release
+        regressions = check(results, baselines, args.threshold)
+        for _ in range(args.retries):
+            if not regressions:
+                break
+            for name, result in run(names=regressions).items():
+                if result['relative'] < results[name]['relative']:
+                    results[name] = result
+            regressions = check(results, baselines, args.threshold)
+        for name in regressions:
+            print(f"REGRESSION {name}: {results[name]['relative']:.2f} vs baseline {baselines[name]:.2f}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,557 @@
+import re
+import time
+import asyncio
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+
+import numpy as np
+
+import geometry
+from arena import PlaceArena
+
+
+class MemoryCache:
+    """
+    in-process key/value store with a per entry TTL and LRU eviction
+
+    this is the storage interface the higher level caches are built on:
+    get, peek, set, delete, keys(prefix), clear and stats
+    """
+
+    # entries are private to this process
+    shared = False
+
+    def __init__(self, max_entries: int = 1024, default_ttl: float = 300):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key: str, default: Any = None) -> Any:
+        # read without touching the LRU order or the hit/miss counters
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.time():
+            return default
+        return entry[1]
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.time() + (self.default_ttl if ttl is None else ttl)
+
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def keys(self, prefix: str = '') -> List[str]:
+        # live keys only, does not touch the LRU order
+        now = time.time()
+        with self._lock:
+            return [key for key, (expires_at, _) in self._entries.items()
+                    if key.startswith(prefix) and expires_at > now]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+
+class SQLiteCache:
+    """
+    on-disk key/value store with the MemoryCache interface
+
+    entries live in a SQLite table in WAL mode, so every worker process on the
+    host reads and writes the same cache and it survives restarts. nothing is
+    loaded up front, opening the file is all a new process has to do. values
+    are pickled. expired entries are dropped when read and whenever the table
+    grows past max_entries, after which the least recently read entries go.
+    several caches can share one file under different table names. the
+    hit/miss/eviction counters are per process.
+    """
+
+    shared = True
+
+    def __init__(self, path: str, max_entries: int = 10000, default_ttl: float = 300, table: str = 'cache'):
+        if not re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', table):
+            raise ValueError(f"invalid table name: {table}")
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        db = self._db()
+        with db:
+            db.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} "
+                "(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            db.execute(f"CREATE INDEX IF NOT EXISTS {table}_accessed ON {table} (accessed_at)")
+
+    def get(self, key: str, default: Any = None) -> Any:
+        db = self._db()
+        row = db.execute(f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self._count('misses')
+            return default
+
+        now = time.time()
+        if row[1] <= now:
+            with db:
+                db.execute(f"DELETE FROM {self.table} WHERE key = ? AND expires_at <= ?", (key, now))
+            self._count('expirations')
+            self._count('misses')
+            return default
+
+        with db:
+            db.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+        self._count('hits')
+        return pickle.loads(row[0])
+
+    def peek(self, key: str, default: Any = None) -> Any:
+        # read without touching the access time or the hit/miss counters
+        row = self._db().execute(
+            f"SELECT value FROM {self.table} WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return default if row is None else pickle.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        expires_at = now + (self.default_ttl if ttl is None else ttl)
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+        db = self._db()
+        with db:
+            db.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, blob, expires_at, now)
+            )
+            (count,) = db.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+            if count > self.max_entries:
+                expired = db.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (now,)).rowcount
+                self._count('expirations', expired)
+                excess = count - expired - self.max_entries
+                if excess > 0:
+                    db.execute(
+                        f"DELETE FROM {self.table} WHERE key IN "
+                        f"(SELECT key FROM {self.table} ORDER BY accessed_at LIMIT ?)", (excess,)
+                    )
+                    self._count('evictions', excess)
+
+    def delete(self, key: str) -> None:
+        db = self._db()
+        with db:
+            db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def keys(self, prefix: str = '') -> List[str]:
+        # live keys only, a primary key range scan rather than a full table scan
+        rows = self._db().execute(
+            f"SELECT key FROM {self.table} WHERE key >= ? AND key < ? AND expires_at > ?",
+            (prefix, prefix + '\U0010ffff', time.time())
+        )
+        return [key for (key,) in rows]
+
+    def clear(self) -> None:
+        db = self._db()
+        with db:
+            db.execute(f"DELETE FROM {self.table}")
+
+    def __len__(self) -> int:
+        return self._db().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "path": self.path
+        }
+
+    def close(self) -> None:
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+    def _db(self) -> sqlite3.Connection:
+        # one connection per thread, sqlite connections can't be shared between threads
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5.0)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _count(self, counter: str, amount: int = 1) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+
+class PlaceCache:
+    """
+    cache of parsed place results keyed by quantized location, category set and radius
+
+    entries are stored under places:<categories>:<tile>:<point>:<radius>:<limit> where
+    tile is a coarse geohash used to find nearby entries and point is a fine geohash
+    of the search center. a request whose circle lies inside the area an entry fully
+    covers is answered by filtering that entry, so a 500m search can be served from a
+    cached 1500m search around the same venue.
+    """
+
+    def __init__(self, store: Optional[MemoryCache] = None, ttl: float = 900,
+                 tile_precision: int = 5, point_precision: int = 8):
+        self.store = store if store is not None else MemoryCache(max_entries=2048, default_ttl=ttl)
+        self.ttl = ttl
+        self.tile_precision = tile_precision
+        self.point_precision = point_precision
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.containment_hits = 0
+        self.misses = 0
+
+        # places:<categories>:<tile>: -> keys stored under it, so a lookup only scans
+        # entries in nearby tiles instead of every key in the store. a shared store
+        # gets entries from other processes too, so there the store's own prefix
+        # lookup is used instead of a local index
+        self._tile_index = {}
+        self._indexed = 0
+        if not self.store.shared:
+            for key in self.store.keys('places:'):
+                self._index(key)
+
+    def lookup(self, lat: float, lon: float, categories: List[str], radius: int, limit: int) -> Optional[List]:
+        """cached places for the search, or None when it has to go upstream"""
+        category_key = self._category_key(categories)
+        exact_key = self._key(lat, lon, category_key, radius, limit)
+
+        entry = self.store.peek(exact_key)
+        if entry is not None:
+            if entry['lat'] == lat and entry['lon'] == lon:
+                places = entry['places'].to_places()
+            else:
+                places = self._filter_entry(entry, lat, lon, radius, limit)
+            if places is not None:
+                self.store.get(exact_key)
+                self._count('hits')
+                return places
+
+        # look for a larger cached circle around a nearby center that contains this one.
+        # candidates are peeked so only the entry that answers is promoted in the LRU
+        for tile in geometry.geohash_neighbors(lat, lon, self.tile_precision):
+            for key in self._tile_keys(f"places:{category_key}:{tile}:"):
+                if key == exact_key:
+                    continue
+                entry = self.store.peek(key)
+                if entry is None:
+                    self._unindex(key)
+                    continue
+                places = self._filter_entry(entry, lat, lon, radius, limit)
+                if places is not None:
+                    self.store.get(key)
+                    self._count('containment_hits')
+                    return places
+
+        self._count('misses')
+        return None
+
+    def store_places(self, lat: float, lon: float, categories: List[str], radius: int, limit: int,
+                     places: List) -> None:
+        coverage = geometry.covered_radius(lat, lon, radius, limit, places)
+
+        entry = {
+            'lat': lat,
+            'lon': lon,
+            'radius': radius,
+            'limit': limit,
+            'coverage': coverage,
+            # held as columns, PlaceResults are only rebuilt for the places a lookup returns
+            'places': PlaceArena(places)
+        }
+        key = self._key(lat, lon, self._category_key(categories), radius, limit)
+        self.store.set(key, entry, self.ttl)
+        self._index(key)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.containment_hits + self.misses
+        hits = self.hits + self.containment_hits
+        store_stats = self.store.stats()
+        return {
+            "entries": store_stats["entries"],
+            "hits": self.hits,
+            "containment_hits": self.containment_hits,
+            "misses": self.misses,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "evictions": store_stats["evictions"],
+            "expirations": store_stats["expirations"]
+        }
+
+    def _filter_entry(self, entry: Dict, lat: float, lon: float, radius: int, limit: int) -> Optional[List]:
+        offset = geometry.haversine_m(entry['lat'], entry['lon'], lat, lon)
+        if offset + radius > entry['coverage']:
+            return None
+
+        cached = entry['places']
+        if not len(cached):
+            return []
+
+        distances = geometry.haversine_many(lat, lon, cached.lat_array(), cached.lon_array())
+        inside = np.nonzero(distances <= radius)[0]
+        nearest = inside[np.argsort(distances[inside].astype(np.int64), kind='stable')][:limit]
+        return cached.to_places(nearest.tolist(), distances[nearest].astype(np.int64).tolist())
+
+    def _key(self, lat: float, lon: float, category_key: str, radius: int, limit: int) -> str:
+        tile = geometry.geohash_encode(lat, lon, self.tile_precision)
+        point = geometry.geohash_encode(lat, lon, self.point_precision)
+        return f"places:{category_key}:{tile}:{point}:{radius}:{limit}"
+
+    def _category_key(self, categories: List[str]) -> str:
+        return ','.join(sorted(set(categories)))
+
+    def _tile_prefix(self, key: str) -> str:
+        # places:<categories>:<tile>:<point>:<radius>:<limit> -> places:<categories>:<tile>:
+        return ':'.join(key.split(':')[:3]) + ':'
+
+    def _tile_keys(self, tile_prefix: str) -> List[str]:
+        if self.store.shared:
+            return self.store.keys(tile_prefix)
+        with self._lock:
+            return list(self._tile_index.get(tile_prefix, ()))
+
+    def _index(self, key: str) -> None:
+        if self.store.shared:
+            return
+        tile_prefix = self._tile_prefix(key)
+        with self._lock:
+            keys = self._tile_index.setdefault(tile_prefix, set())
+            if key not in keys:
+                keys.add(key)
+                self._indexed += 1
+            rebuild = self._indexed > 2 * self.store.max_entries
+
+        # evicted keys are only dropped when a lookup trips over them, so rebuild
+        # the index from the store once it has grown well past the store's size
+        if rebuild:
+            live = self.store.keys('places:')
+            with self._lock:
+                self._tile_index = {}
+                for live_key in live:
+                    self._tile_index.setdefault(self._tile_prefix(live_key), set()).add(live_key)
+                self._indexed = len(live)
+
+    def _unindex(self, key: str) -> None:
+        tile_prefix = self._tile_prefix(key)
+        with self._lock:
+            keys = self._tile_index.get(tile_prefix)
+            if keys is not None and key in keys:
+                keys.discard(key)
+                self._indexed -= 1
+                if not keys:
+                    del self._tile_index[tile_prefix]
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+
+class EventCache:
+    """
+    city + size keyed cache of event listings with stale-while-revalidate,
+    one part of a paged listing also keys on its page (a page number or a
+    label for a run of pages)
+
+    a listing younger than ttl is returned as is. between ttl and ttl + stale_ttl
+    the cached listing is returned at once and refreshed in the background, and a
+    failed refresh just keeps the old listing around. only a cold miss waits on
+    the upstream fetch. background refreshes run inside refresh_context().
+    """
+
+    def __init__(self, store: Optional[MemoryCache] = None, ttl: float = 300, stale_ttl: float = 3600,
+                 refresh_workers: int = 2, refresh_context: Callable = nullcontext):
+        self.store = store if store is not None else MemoryCache(max_entries=512, default_ttl=ttl + stale_ttl)
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.refresh_context = refresh_context
+
+        self._executor = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix="event-refresh")
+        self._refreshing = set()
+        self._tasks = set()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+    def get(self, city: str, size: int, fetch: Callable[[], List], page: Optional[Union[int, str]] = None) -> List:
+        """cached events for the city, calling fetch() on a miss or in the background once stale"""
+        key = self._key(city, size, page)
+        entry = self.store.get(key)
+
+        if entry is None:
+            self._count('misses')
+            events = fetch()
+            self._store(key, events)
+            return events
+
+        age = time.time() - entry['fetched_at']
+        if age < self.ttl:
+            self._count('hits')
+        else:
+            self._count('stale_hits')
+            self._refresh_in_background(key, fetch)
+        return entry['events']
+
+    async def get_async(self, city: str, size: int, fetch: Callable[[], Awaitable[List]]) -> List:
+        """get for coroutines, fetch is async and a stale listing is refreshed as a task on the running loop"""
+        key = self._key(city, size)
+        entry = self.store.get(key)
+
+        if entry is None:
+            self._count('misses')
+            events = await fetch()
+            self._store(key, events)
+            return events
+
+        age = time.time() - entry['fetched_at']
+        if age < self.ttl:
+            self._count('hits')
+        else:
+            self._count('stale_hits')
+            with self._lock:
+                refreshing = key in self._refreshing
+                self._refreshing.add(key)
+            if not refreshing:
+                task = asyncio.get_running_loop().create_task(self._refresh_async(key, fetch))
+                # the loop only keeps weak references to tasks
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        return entry['events']
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.stale_hits + self.misses
+        hits = self.hits + self.stale_hits
+        store_stats = self.store.stats()
+        return {
+            "entries": store_stats["entries"],
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+            "evictions": store_stats["evictions"],
+            "expirations": store_stats["expirations"]
+        }
+
+    def close(self) -> None:
+        """stop the background refresh workers"""
+        self._executor.shutdown(wait=True)
+
+    def _refresh_in_background(self, key: str, fetch: Callable[[], List]) -> None:
+        # at most one refresh per key at a time
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        self._executor.submit(self._refresh, key, fetch)
+
+    def _refresh(self, key: str, fetch: Callable[[], List]) -> None:
+        try:
+            with self.refresh_context():
+                events = fetch()
+            self._store(key, events)
+            self._count('refreshes')
+        except Exception as e:
+            print(f"Error refreshing {key}: {e}")
+            self._count('refresh_failures')
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    async def _refresh_async(self, key: str, fetch: Callable[[], Awaitable[List]]) -> None:
+        try:
+            with self.refresh_context():
+                events = await fetch()
+            self._store(key, events)
+            self._count('refreshes')
+        except Exception as e:
+            print(f"Error refreshing {key}: {e}")
+            self._count('refresh_failures')
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _store(self, key: str, events: List) -> None:
+        self.store.set(key, {'fetched_at': time.time(), 'events': events}, self.ttl + self.stale_ttl)
+
+    def _key(self, city: str, size: int, page: Optional[Union[int, str]] = None) -> str:
+        key = f"events:{city.strip().lower()}:{size}"
+        return key if page is None else f"{key}:page:{page}"
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
@@ -0,0 +1,154 @@
+import math
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+
+TILE_SIZE = 256
+MAX_MERCATOR_LAT = 85.05112878
+
+
+def project(lats: Sequence[float], lons: Sequence[float]):
+    """web mercator x, y in [0, 1] for every point, y grows southwards like map tiles"""
+    lats = np.clip(np.asarray(lats, dtype=np.float64), -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT)
+    lons = np.asarray(lons, dtype=np.float64)
+    x = lons / 360.0 + 0.5
+    sin = np.sin(np.radians(lats))
+    y = 0.5 - np.log((1 + sin) / (1 - sin)) / (4 * math.pi)
+    return x, y
+
+
+def unproject(x: np.ndarray, y: np.ndarray):
+    """inverse of project, (lats, lons)"""
+    lons = (x - 0.5) * 360.0
+    lats = np.degrees(2 * np.arctan(np.exp((0.5 - y) * 2 * math.pi)) - math.pi / 2)
+    return lats, lons
+
+
+class _Level:
+    """clusters at one zoom level, held as parallel arrays"""
+
+    def __init__(self, x, y, counts, first, breakdowns):
+        self.x = x
+        self.y = y
+        self.counts = counts
+        self.first = first            # index of one feature in each cluster
+        self.breakdowns = breakdowns  # category -> count for each cluster
+
+
+class ClusterPyramid:
+    """
+    grid clustering of point features for every zoom level, built once
+
+    past max_zoom every feature stands on its own, and each coarser level
+    merges the clusters of the level below that fall in the same grid
+    cell of cell_px screen pixels, so a cluster's counts and category
+    breakdown are sums of its children and its position is their weighted
+    centroid. a bbox query at any zoom then only touches that level's arrays,
+    and the number of clusters it returns is bounded by the viewport size in
+    cells, not by the number of places.
+    """
+
+    def __init__(self, features: List[Dict], min_zoom: int = 0, max_zoom: int = 17, cell_px: int = 60):
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.cell_px = cell_px
+
+        # the event marker always stays its own point
+        self.features = [f for f in features if f.get('properties', {}).get('type') != 'event']
+        self.pinned = [f for f in features if f.get('properties', {}).get('type') == 'event']
+
+        coords = [f['geometry']['coordinates'] for f in self.features]
+        x, y = project([c[1] for c in coords], [c[0] for c in coords])
+        categories = [f.get('properties', {}).get('category', 'unknown') for f in self.features]
+
+        # levels[zoom] are the clusters, owners[zoom][i] the cluster feature i is in
+        self.levels = {}
+        self.owners = {}
+        level = _Level(
+            x, y, np.ones(len(self.features), dtype=np.int64),
+            np.arange(len(self.features)),
+            [{category: 1} for category in categories]
+        )
+        owner = np.arange(len(self.features))
+        self.levels[max_zoom + 1] = level
+        self.owners[max_zoom + 1] = owner
+        for zoom in range(max_zoom, min_zoom - 1, -1):
+            level, groups = self._merge(level, zoom)
+            owner = groups[owner]
+            self.levels[zoom] = level
+            self.owners[zoom] = owner
+
+    def query(self, bbox: Sequence[float], zoom: int) -> List[Dict]:
+        """
+        GeoJSON features in bbox (west, south, east, north) at zoom: clusters
+        of more than one place as cluster points, single places as themselves
+        """
+        zoom = max(self.min_zoom, min(int(zoom), self.max_zoom + 1))
+        level = self.levels[zoom]
+        west, south, east, north = bbox
+        (x_min, x_max), (y_max, y_min) = project([south, north], [west, east])
+
+        inside = (level.x >= x_min) & (level.x <= x_max) & (level.y >= y_min) & (level.y <= y_max)
+        indices = np.nonzero(inside)[0]
+        lats, lons = unproject(level.x[indices], level.y[indices])
+
+        results = []
+        for i, lat, lon in zip(indices.tolist(), lats.tolist(), lons.tolist()):
+            if level.counts[i] == 1:
+                results.append(self.features[level.first[i]])
+                continue
+            results.append({
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [lon, lat]},
+                "properties": {
+                    "cluster": True,
+                    "cluster_id": f"{zoom}:{i}",
+                    "point_count": int(level.counts[i]),
+                    "categories": level.breakdowns[i],
+                    "expansion_zoom": self.expansion_zoom(zoom, i)
+                }
+            })
+
+        for feature in self.pinned:
+            lon, lat = feature['geometry']['coordinates'][:2]
+            if west <= lon <= east and south <= lat <= north:
+                results.append(feature)
+        return results
+
+    def expansion_zoom(self, zoom: int, index: int) -> Optional[int]:
+        """first zoom at which the cluster splits apart, None when it never does"""
+        count = self.levels[zoom].counts[index]
+        first = self.levels[zoom].first[index]
+        for finer in range(zoom + 1, self.max_zoom + 2):
+            if self.levels[finer].counts[self.owners[finer][first]] < count:
+                return finer
+        return None
+
+    def stats(self) -> Dict:
+        return {
+            "features": len(self.features),
+            "levels": {zoom: len(level.counts) for zoom, level in sorted(self.levels.items())}
+        }
+
+    def _merge(self, level: _Level, zoom: int):
+        """the next coarser level, and the cluster each of level's clusters went into"""
+        cells_per_side = TILE_SIZE * (2 ** zoom) / self.cell_px
+        col = np.floor(level.x * cells_per_side).astype(np.int64)
+        row = np.floor(level.y * cells_per_side).astype(np.int64)
+
+        keys = row * (int(cells_per_side) + 2) + col
+        unique, index, groups = np.unique(keys, return_index=True, return_inverse=True)
+        groups = np.asarray(groups).reshape(-1)
+
+        counts = np.bincount(groups, weights=level.counts, minlength=len(unique))
+        x = np.bincount(groups, weights=level.x * level.counts, minlength=len(unique)) / counts
+        y = np.bincount(groups, weights=level.y * level.counts, minlength=len(unique)) / counts
+
+        breakdowns = [{} for _ in range(len(unique))]
+        for child, group in enumerate(groups.tolist()):
+            breakdown = breakdowns[group]
+            for category, count in level.breakdowns[child].items():
+                breakdown[category] = breakdown.get(category, 0) + count
+
+        return _Level(x, y, counts.astype(np.int64), level.first[index], breakdowns), groups
@@ -0,0 +1,264 @@
+import re
+import math
+import heapq
+import bisect
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import geometry
+
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+# dates sort as strings, events without one go after every real date
+NO_DATE = 'TBD'
+
+_EMPTY = frozenset()
+
+
+def tokenize(text: str) -> List[str]:
+    """lowercase word tokens of a name or query"""
+    return _TOKEN.findall(text.lower())
+
+
+def _date_order(event: Dict) -> tuple:
+    return event['localdate'] == NO_DATE, event['localdate'], event['name'], event['id']
+
+
+def _deletions(token: str) -> Set[str]:
+    # every string one character shorter than token, the keys of the typo index
+    return {token[:i] + token[i + 1:] for i in range(len(token))}
+
+
+class EventIndex:
+    """
+    in memory index over the transformed events of every city listing fetched
+
+    events are kept by id with inverted indexes on segment, genre and the
+    listing city they came from, a sorted token list for prefix search and a
+    single deletion index for one typo fuzzy matching on the name, a sorted
+    (localdate, id) list for date ranges and a lat/lng grid of cell_size
+    degrees for proximity. a search intersects the candidate id sets of its
+    filters smallest first, so its cost follows the number of matches rather
+    than the number of events.
+
+    listings are added incrementally as they are fetched, an event seen again
+    replaces its previous version everywhere, and past max_events the events
+    seen longest ago are dropped.
+    """
+
+    def __init__(self, cell_size: float = 0.01, max_events: int = 50000):
+        self.cell_size = cell_size
+        self.max_events = max_events
+
+        self._events = OrderedDict()  # id -> event, least recently seen first
+        self._listings = {}           # city key -> {ids}
+        self._segments = {}           # lowercase segment -> {ids}
+        self._genres = {}             # lowercase genre -> {ids}
+        self._postings = {}           # name token -> {ids}
+        self._tokens = []             # sorted name tokens, for prefix lookups
+        self._typos = {}              # token or one deletion of it -> {tokens}
+        self._dates = []              # sorted (localdate, id)
+        self._cells = {}              # (row, col) -> {ids}
+        self._lock = threading.RLock()
+
+        self.searches = 0
+        self.evicted = 0
+
+    def add(self, city: str, events: Iterable[Dict]) -> None:
+        """index (or re-index) a city listing's events"""
+        key = self._city_key(city)
+        with self._lock:
+            listing = self._listings.setdefault(key, set())
+            for event in events:
+                self._unindex(event['id'])
+                self._index(event)
+                listing.add(event['id'])
+            while len(self._events) > self.max_events:
+                self._unindex(next(iter(self._events)))
+                self.evicted += 1
+
+    def has_city(self, city: str) -> bool:
+        with self._lock:
+            return bool(self._listings.get(self._city_key(city)))
+
+    def search(self, q: str = '', city: str = '', segments: Iterable[str] = (), genres: Iterable[str] = (),
+               start: str = '', end: str = '', near: Optional[Tuple[float, float]] = None, radius: float = 5000,
+               offset: int = 0, limit: int = 20, fuzzy: bool = True) -> Dict:
+        """
+        events matching every given filter, a page of them with the total
+
+        q matches names by token, the last token as a prefix and, with fuzzy,
+        a token with no exact or prefix match by one typo. segments and genres
+        match any of the given values case insensitively, start and end are
+        inclusive YYYY-MM-DD bounds. with near, only events within radius meters
+        are returned, nearest first with a distance in meters, otherwise they
+        come in date order
+        """
+        with self._lock:
+            self.searches += 1
+            candidates = []
+            if city:
+                candidates.append(self._listings.get(self._city_key(city), _EMPTY))
+            if segments:
+                candidates.append(self._union(self._segments, segments))
+            if genres:
+                candidates.append(self._union(self._genres, genres))
+            tokens = tokenize(q)
+            for i, token in enumerate(tokens):
+                candidates.append(self._name_matches(token, i == len(tokens) - 1, fuzzy))
+
+            # the range filters only become candidate sets when they are the most selective,
+            # otherwise the candidates are checked against them one by one
+            fewest = min(map(len, candidates), default=len(self._events))
+            if start or end:
+                low, high = self._date_span(start, end)
+                if high - low < fewest:
+                    candidates.append({event_id for _, event_id in self._dates[low:high]})
+                    fewest = high - low
+            if near is not None:
+                cells = self._cells_for(near[0], near[1], radius)
+                if sum(len(self._cells.get(cell, _EMPTY)) for cell in cells) < fewest:
+                    candidates.append(self._union(self._cells, cells))
+
+            if candidates:
+                candidates.sort(key=len)
+                ids = candidates[0].intersection(*candidates[1:])
+            else:
+                ids = self._events.keys()
+            events = [self._events[event_id] for event_id in ids]
+
+        if start or end:
+            events = [e for e in events if e['localdate'] != NO_DATE and
+                      (not start or e['localdate'] >= start) and (not end or e['localdate'] <= end)]
+
+        if near is not None:
+            lat, lng = near
+            lat_span = radius / geometry.METERS_PER_DEGREE
+            lng_span = radius / (geometry.METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+            matches = []
+            for event in events:
+                if abs(event['lat'] - lat) > lat_span or abs(event['lng'] - lng) > lng_span:
+                    continue
+                distance = geometry.haversine_m(lat, lng, event['lat'], event['lng'])
+                if distance <= radius:
+                    matches.append((distance, event['id'], event))
+            total = len(matches)
+            page = [dict(e, distance=int(d)) for d, _, e in heapq.nsmallest(offset + limit, matches)[offset:]]
+        else:
+            total = len(events)
+            page = heapq.nsmallest(offset + limit, events, key=_date_order)[offset:]
+
+        return {
+            "events": page,
+            "total": total,
+            "offset": offset,
+            "next_offset": offset + limit if offset + limit < total else None
+        }
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "events": len(self._events),
+                "cities": len(self._listings),
+                "tokens": len(self._tokens),
+                "cells": len(self._cells),
+                "searches": self.searches,
+                "evicted": self.evicted
+            }
+
+    def _index(self, event: Dict) -> None:
+        event_id = event['id']
+        self._events[event_id] = event
+
+        self._segments.setdefault(event.get('segment', 'Unknown').lower(), set()).add(event_id)
+        self._genres.setdefault(event.get('genre', 'Unknown').lower(), set()).add(event_id)
+        for token in set(tokenize(event.get('name', ''))):
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = set()
+                bisect.insort(self._tokens, token)
+                for variant in _deletions(token) | {token}:
+                    self._typos.setdefault(variant, set()).add(token)
+            postings.add(event_id)
+        bisect.insort(self._dates, (event.get('localdate', NO_DATE), event_id))
+        self._cells.setdefault(self._cell(event['lat'], event['lng']), set()).add(event_id)
+
+    def _unindex(self, event_id: str) -> None:
+        event = self._events.pop(event_id, None)
+        if event is None:
+            return
+
+        for listing in self._listings.values():
+            listing.discard(event_id)
+        self._discard(self._segments, event.get('segment', 'Unknown').lower(), event_id)
+        self._discard(self._genres, event.get('genre', 'Unknown').lower(), event_id)
+        for token in set(tokenize(event.get('name', ''))):
+            if self._discard(self._postings, token, event_id):
+                del self._tokens[bisect.bisect_left(self._tokens, token)]
+                for variant in _deletions(token) | {token}:
+                    self._discard(self._typos, variant, token)
+        entry = (event.get('localdate', NO_DATE), event_id)
+        position = bisect.bisect_left(self._dates, entry)
+        if position < len(self._dates) and self._dates[position] == entry:
+            del self._dates[position]
+        self._discard(self._cells, self._cell(event['lat'], event['lng']), event_id)
+
+    def _name_matches(self, token: str, prefix: bool, fuzzy: bool) -> Set[str]:
+        if prefix:
+            low = bisect.bisect_left(self._tokens, token)
+            high = low
+            while high < len(self._tokens) and self._tokens[high].startswith(token):
+                high += 1
+            matches = self._tokens[low:high]
+        else:
+            matches = [token] if token in self._postings else []
+        if not matches and fuzzy and len(token) >= 3:
+            # one insertion, deletion, substitution or swap away share a key in the typo index
+            matches = set()
+            for variant in _deletions(token) | {token}:
+                matches |= self._typos.get(variant, _EMPTY)
+        return self._union(self._postings, matches) if matches else _EMPTY
+
+    def _date_span(self, start: str, end: str) -> Tuple[int, int]:
+        # slice of _dates between start and end, NO_DATE sorts after every date so an open end stops short of it
+        low = bisect.bisect_left(self._dates, (start,)) if start else 0
+        high = bisect.bisect_right(self._dates, (end, chr(0x10ffff))) if end else \
+            bisect.bisect_left(self._dates, (NO_DATE,))
+        return low, max(low, high)
+
+    def _cells_for(self, lat: float, lng: float, radius: float) -> List[tuple]:
+        # grid cells the radius' bounding box touches
+        lat_span = radius / geometry.METERS_PER_DEGREE
+        lng_span = radius / (geometry.METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+        row_min, col_min = self._cell(lat - lat_span, lng - lng_span)
+        row_max, col_max = self._cell(lat + lat_span, lng + lng_span)
+        return [(row, col) for row in range(row_min, row_max + 1) for col in range(col_min, col_max + 1)]
+
+    def _union(self, index: Dict, keys: Iterable) -> Set[str]:
+        # the index's own set for a single key, callers never change what they get back
+        keys = [key.strip().lower() if isinstance(key, str) else key for key in keys]
+        if len(keys) == 1:
+            return index.get(keys[0], _EMPTY)
+        ids = set()
+        for key in keys:
+            ids |= index.get(key, _EMPTY)
+        return ids
+
+    def _discard(self, index: Dict, key, value) -> bool:
+        # removes value from index[key], dropping the key once empty, True when it was dropped
+        values = index.get(key)
+        if values is None:
+            return False
+        values.discard(value)
+        if not values:
+            del index[key]
+            return True
+        return False
+
+    def _cell(self, lat: float, lng: float) -> tuple:
+        return int(math.floor(lat / self.cell_size)), int(math.floor(lng / self.cell_size))
+
+    def _city_key(self, city: str) -> str:
+        return city.strip().lower()
@@ -1,11 +1,74 @@
+import os
+import sys
+import asyncio
 import requests
 import json
-from typing import List, Dict, Tuple, Optional, Union
+import threading
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Iterator, List, Dict, Tuple, Optional, Union
 from dataclasses import dataclass
 
+import geometry
+import metrics
+import upstream
+import wire
+
+
+# cap on geoapify requests in flight at once across the whole process
+MAX_IN_FLIGHT_REQUESTS = int(os.getenv("GEOAPIFY_MAX_IN_FLIGHT", "8"))
+_request_slots = threading.BoundedSemaphore(MAX_IN_FLIGHT_REQUESTS)
+
+# worker pool shared by every explorer, sized above the in flight cap so that
+# threads busy on cache hits or parsing never make the pool the real limit
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def set_max_in_flight_requests(limit: int) -> None:
+    """change the process wide cap on concurrent geoapify requests"""
+    global MAX_IN_FLIGHT_REQUESTS, _request_slots, _executor
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+
+    with _executor_lock:
+        MAX_IN_FLIGHT_REQUESTS = limit
+        _request_slots = threading.BoundedSemaphore(limit)
+
+        # queued work keeps running on the old pool, new work goes to a resized one
+        old_executor, _executor = _executor, None
+    if old_executor is not None:
+        old_executor.shutdown(wait=False)
+
+
+def _shared_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_IN_FLIGHT_REQUESTS * 2, thread_name_prefix="geoapify")
+        return _executor
+
+
+def _wait_timeout() -> Optional[float]:
+    # how long to wait on outstanding fetches, None without an upstream deadline
+    left = upstream.remaining()
+    return None if left is None else max(0.0, left)
+
+
+def _budget_left() -> bool:
+    left = upstream.remaining()
+    return left is None or left > 0
+
+
+def _discard_result(task: asyncio.Task) -> None:
+    # a fetch nobody waits for any more, only keeps its error from being reported as unretrieved
+    if not task.cancelled():
+        task.exception()
+
 
 # format for ticketmaster event
-@dataclass
+@dataclass(slots=True)
 class EventLocation:
     name: str
     lat: float
@@ -13,8 +76,8 @@ class EventLocation:
     address: str = ""
     venue_id: str = ""
 
-# format for geoapify place response
-@dataclass
+# format for geoapify place response, slotted since caches and stores hold a lot of them
+@dataclass(slots=True)
 class PlaceResult:
     id: str
     name: str
@@ -29,11 +92,152 @@ class PlaceResult:
     website: Optional[str] = None
     opening_hours: Optional[Dict] = None
     description: Optional[str] = None
+    categories: Optional[List[str]] = None
+
+# one coalesced upstream query covering several search types
+@dataclass
+class QueryGroup:
+    search_types: List[str]
+    categories: List[str]
+    limit: int
+    dense: bool = False
+
+
+# search types whose places are common enough to crowd everything else out of a shared call
+DENSE_SEARCH_TYPES = {'restaurants', 'cafes', 'all_dining'}
+
+# geoapify caps a single places request, and each type reserves extra room in its group
+MAX_GROUP_LIMIT = 200
+COALESCE_OVERSAMPLE = 2
+
+
+# category -> (marker color, marker icon), first matching key wins
+MARKER_STYLES = (
+    ('catering.restaurant', 'green', 'cutlery'),
+    ('catering.bar', 'purple', 'glass'),
+    ('catering.pub', 'purple', 'beer'),
+    ('catering.cafe', 'orange', 'coffee'),
+    ('catering.fast_food', 'lightgreen', 'cutlery'),
+    ('entertainment', 'blue', 'music'),
+    ('tourism.attraction', 'red', 'camera'),
+    ('commercial', 'gray', 'shopping-cart'),
+)
+DEFAULT_MARKER_STYLE = ('gray', 'map-marker')
+
+# resolved styles per category string, there are only a few dozen distinct ones
+_marker_styles = {}
+
+
+def marker_style(category: str) -> Tuple[str, str]:
+    style = _marker_styles.get(category)
+    if style is None:
+        style = next(((color, icon) for key, color, icon in MARKER_STYLES if key in category),
+                     DEFAULT_MARKER_STYLE)
+        _marker_styles[category] = style
+    return style
+
+
+def parse_places(body: Union[bytes, str, Dict], center: Optional[Tuple[float, float]] = None) -> List[PlaceResult]:
+    """
+    places from a geoapify response, raw bytes or already decoded
+
+    one pass over the features that only reads the fields PlaceResult keeps.
+    with a center the distances are measured from it instead of trusting the
+    upstream distance field, and places come back nearest first
+    """
+    data = wire.loads(body) if isinstance(body, (bytes, str)) else body
+    places = []
+    intern = sys.intern
+
+    for feature in data.get('features') or ():
+        coords = (feature.get('geometry') or {}).get('coordinates') or ()
+        if len(coords) < 2:
+            continue
+        props = feature.get('properties') or {}
+
+        categories = [intern(c) for c in props.get('categories') or ('unknown',)]
+        contact = props.get('contact') or {}
+        raw = (props.get('datasource') or {}).get('raw') or {}
+
+        # rating from the raw osm tags first, then geoapify's own field, then stars
+        rating = None
+        for source in (raw.get('rating'), props.get('rating'), raw.get('stars')):
+            if source is not None:
+                try:
+                    rating = float(source)
+                    break
+                except (ValueError, TypeError):
+                    continue
+
+        lon, lat = coords[0], coords[1]
+        places.append(PlaceResult(
+            id=props.get('place_id') or f"{lat}_{lon}",
+            name=props.get('name', 'Unknown'),
+            category=categories[0],
+            subcategory=categories[1] if len(categories) > 1 else categories[0],
+            lat=lat,
+            lon=lon,
+            address=props.get('formatted', ''),
+            distance=int(props.get('distance', 0)),
+            rating=rating,
+            phone=contact.get('phone'),
+            website=contact.get('website'),
+            opening_hours=props.get('opening_hours'),
+            description=props.get('description'),
+            categories=categories
+        ))
+
+    if center is not None:
+        return geometry.nearest_first(places, center[0], center[1],
+                                      [p.lat for p in places], [p.lon for p in places])
+    return sorted(places, key=lambda x: x.distance)
+
+
+def intern_categories(categories: List[str]) -> List[str]:
+    # the same few dozen category strings repeat across every place, keep one copy of each
+    return [sys.intern(category) for category in categories]
+
+
+def matches_categories(place_categories: List[str], wanted: List[str]) -> bool:
+    # geoapify categories are dotted paths, catering.restaurant.pizza matches catering.restaurant
+    for category in place_categories:
+        for prefix in wanted:
+            if category == prefix or category.startswith(prefix + '.'):
+                return True
+    return False
 
 class CityExplorer:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, concurrent: bool = True, max_workers: Optional[int] = None,
+                 coalesce: bool = True, place_cache=None, http_client: Optional[upstream.UpstreamClient] = None,
+                 base_url: Optional[str] = None, place_store=None, store_first: bool = False,
+                 async_http_client: Optional['upstream.AsyncUpstreamClient'] = None, async_pool_size: int = 100):
         self.api_key = api_key
-        self.base_url = "https://api.geoapify.com/v2/places"
+        self.base_url = base_url or "https://api.geoapify.com/v2/places"
+
+        # pooled keep-alive client with retries, shared by every explorer in the process
+        self.http = http_client if http_client is not None else upstream.get_client('geoapify')
+        # non-blocking client for the *_async methods, made from http's settings when not given
+        self.async_http = async_http_client
+        self.async_pool_size = async_pool_size
+        # (loop, semaphore) capping async requests in flight like _request_slots caps threads
+        self._async_slots = None
+
+        # run category searches in parallel instead of one after another
+        self.concurrent = concurrent
+        self.max_workers = max_workers
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+        # merge search types into shared upstream calls and split the results locally
+        self.coalesce = coalesce
+
+        # optional cache.PlaceCache consulted before every upstream request
+        self.place_cache = place_cache
+
+        # optional placestore.PlaceStore fed with every upstream result, with store_first
+        # it also answers searches in areas it already has fresh data for
+        self.place_store = place_store
+        self.store_first = store_first
 
         self.category_mappings = {
             'restaurants': ['catering.restaurant', 'catering.fast_food'],
@@ -49,25 +253,28 @@ class CityExplorer:
                                 search_type: str = 'all_dining',radius: int = 1000,
                                 limit: int = 50) -> List[PlaceResult]:
         # extract coordinates
-        if isinstance(event_location, dict):
-            lat = event_location.get('lat') or event_location.get('latitude')
-            lon = event_location.get('lon') or event_location.get('longitude')
-            if lat is None or lon is None:
-                raise ValueError("Event location must contain lat/lon coordinates")
-        else:
-            lat = event_location.lat
-            lon = event_location.lon
-            
-        categories = self.category_mappings.get(search_type, self.category_mappings['all_dining'])
-        
-        response = self._make_api_request(lat, lon, categories, radius, limit)
-        return self._parse_api_response(response)
-    
+        lat, lon = self._get_coordinates(event_location)
+        categories = self._get_categories(search_type)
+
+        return self._fetch_places(lat, lon, categories, radius, limit) or []
+
+    def places_by_category(self, event_location: Union[EventLocation, Dict], search_types: List[str],
+                           radius: int = 1000, limit_per_category: int = 10) -> Dict[str, Optional[List[PlaceResult]]]:
+        """
+        the places get_geojson_data would map, as PlaceResults keyed by search type
+
+        a search type that failed or ran past the deadline maps to None
+        """
+        with metrics.stage('fetch'):
+            return self._search_categories(event_location, search_types, radius, limit_per_category)
+
     def get_geojson_data(self,
                         event_location: Union[EventLocation, Dict],
                         search_types: List[str] = None,
                         radius: int = 1000,
-                        limit_per_category: int = 10) -> Dict:
+                        limit_per_category: int = 10,
+                        rating_weight: float = 0.0,
+                        category_scores: Optional[Dict[str, float]] = None) -> Dict:
         """
         get data formatted as GeoJSON
 
@@ -75,12 +282,46 @@ class CityExplorer:
         search_types: list of category types to search for
         radius: search radius in meters
         limit_per_category: max results per category
-            
-        returns geojson with locations
+        rating_weight, category_scores: optional re-ranking within each category,
+            see geometry.rank_places. by default places are nearest first
+
+        returns geojson with locations. inside an upstream.deadline() block the
+        categories still outstanding when it runs out are left empty, listed in
+        the properties' missing_categories and partial is set
         """
         if search_types is None:
             search_types = ['restaurants', 'bars', 'entertainment', 'attractions','shopping']
-            
+
+        # search for places in each category, results come back keyed by category
+        with metrics.stage('fetch'):
+            results = self._search_categories(event_location, search_types, radius, limit_per_category)
+
+        return self._build_geojson(event_location, search_types, radius, results, rating_weight, category_scores)
+
+    async def get_geojson_data_async(self,
+                                     event_location: Union[EventLocation, Dict],
+                                     search_types: List[str] = None,
+                                     radius: int = 1000,
+                                     limit_per_category: int = 10,
+                                     rating_weight: float = 0.0,
+                                     category_scores: Optional[Dict[str, float]] = None) -> Dict:
+        """
+        get_geojson_data for coroutines
+
+        the same search and output, with the upstream calls made together on the
+        non-blocking async_http client instead of on the thread pool
+        """
+        if search_types is None:
+            search_types = ['restaurants', 'bars', 'entertainment', 'attractions','shopping']
+
+        with metrics.stage('fetch'):
+            results = await self._search_categories_async(event_location, search_types, radius, limit_per_category)
+
+        return self._build_geojson(event_location, search_types, radius, results, rating_weight, category_scores)
+
+    def _build_geojson(self, event_location: Union[EventLocation, Dict], search_types: List[str], radius: int,
+                       results: Dict[str, Optional[List[PlaceResult]]], rating_weight: float,
+                       category_scores: Optional[Dict[str, float]]) -> Dict:
         event_lat = event_location.get('lat') or event_location.get('latitude') if isinstance(event_location, dict) else event_location.lat
         event_lon = event_location.get('lon') or event_location.get('longitude') if isinstance(event_location, dict) else event_location.lon
         
@@ -88,11 +329,164 @@ class CityExplorer:
         category_counts = {}
         
         # add the venue from ticketmaster as the first feature
-        event_feature = {
+        event_feature = self._event_feature(event_location, event_lat, event_lon)
+        features.append(event_feature)
+
+        missing = []
+        # arena imports PlaceResult from this module, so it can only be imported once this module is loaded
+        from arena import FeatureList, PlaceArena
+        arena = PlaceArena()
+
+        # walk search_types in the requested order so the output stays deterministic
+        with metrics.stage('build'):
+            for category in search_types:
+                places = results.get(category)
+                if places is None:
+                    category_counts[category] = 0
+                    if category not in missing:
+                        missing.append(category)
+                    continue
+
+                category_counts[category] = len(places)
+                if rating_weight or category_scores:
+                    places = geometry.rank_places(places, event_lat, event_lon, radius, rating_weight,
+                                                  category_scores)
+
+                arena.extend(places)
+
+        # place feature dicts are only built when the collection is serialized
+        features = FeatureList(features, arena, self._get_marker_color, self._get_marker_icon)
+
+        # create the GeoJSON feature collection
+        geojson = {
+            "type": "FeatureCollection",
+            "features": features,
+            "properties": self._summary_properties(event_lat, event_lon, radius, category_counts,
+                                                   len(features) - 1, missing)  # Subtract 1 for event marker
+        }
+
+        return geojson
+
+    def iter_geojson(self,
+                     event_location: Union[EventLocation, Dict],
+                     search_types: List[str] = None,
+                     radius: int = 1000,
+                     limit_per_category: int = 10) -> Iterator[Tuple]:
+        """
+        streaming version of get_geojson_data
+
+        yields ('event', feature) first, then ('category', name, features) for each
+        search type as soon as the query it depends on is back (so in completion
+        order, not request order), and finally ('summary', properties) with the same
+        properties get_geojson_data puts on the FeatureCollection. failed categories,
+        and those still outstanding when the upstream deadline runs out, are yielded
+        with no features, counted as 0 and listed in missing_categories.
+        """
+        if search_types is None:
+            search_types = ['restaurants', 'bars', 'entertainment', 'attractions', 'shopping']
+        search_types = list(dict.fromkeys(search_types))
+        limit = limit_per_category
+
+        lat, lon = self._get_coordinates(event_location)
+        yield ('event', self._event_feature(event_location, lat, lon))
+
+        if self.coalesce:
+            groups = self.plan_queries(search_types, limit)
+        else:
+            groups = [QueryGroup(search_types=[t], categories=self._get_categories(t), limit=limit)
+                      for t in search_types]
+
+        category_counts = {}
+        missing = []
+        total = 0
+        seen_ids = set()
+        top_ups = []
+
+        tasks = [(('group', group), (lat, lon, group.categories, radius, group.limit)) for group in groups]
+        for key, places in self._as_completed(tasks, top_ups):
+            ready = {}
+            if key[0] == 'group':
+                group = key[1]
+                if places is None:
+                    ready = {t: [] for t in group.search_types}
+                    missing.extend(group.search_types)
+                else:
+                    buckets, matched = self._partition_places(
+                        geometry.rank_places(places, lat, lon, radius), group.search_types, limit, seen_ids
+                    )
+                    saturated = len(places) >= group.limit and len(group.search_types) > 1 and _budget_left()
+                    for search_type, bucket in buckets.items():
+                        if saturated and len(bucket) < limit and matched[search_type] < limit:
+                            # crowded out, finish this type with its own query before sending it
+                            top_ups.append((('top_up', search_type, bucket),
+                                            (lat, lon, self._get_categories(search_type), radius, limit * 2)))
+                        else:
+                            ready[search_type] = bucket
+            else:
+                _, search_type, bucket = key
+                for place in places or []:
+                    if len(bucket) >= limit:
+                        break
+                    if place.id not in seen_ids:
+                        seen_ids.add(place.id)
+                        bucket.append(place)
+                bucket.sort(key=lambda x: x.distance)
+                ready[search_type] = bucket
+
+            for search_type, bucket in ready.items():
+                category_counts[search_type] = len(bucket)
+                total += len(bucket)
+                yield ('category', search_type, [self._place_to_feature(place) for place in bucket])
+
+        # keep the summary's category order the same as the request
+        ordered_counts = {t: category_counts.get(t, 0) for t in search_types}
+        yield ('summary', self._summary_properties(lat, lon, radius, ordered_counts, total,
+                                                   [t for t in search_types if t in missing]))
+
+    def _as_completed(self, tasks: List[Tuple], extra: List[Tuple]) -> Iterator[Tuple]:
+        """
+        runs (key, fetch args) tasks and yields (key, places) as each one finishes,
+        places is None when the fetch failed. tasks the consumer appends to extra
+        while handling a result are started as well. at the upstream deadline the
+        unfinished ones are yielded as failed and left to fill the cache
+        """
+        def fetch(args):
+            try:
+                return self._fetch_places(*args)
+            except Exception as e:
+                print(f"Error searching for {','.join(args[2])}: {e}")
+                return None
+
+        if not self.concurrent:
+            queue = list(tasks)
+            while queue:
+                key, args = queue.pop(0)
+                yield key, fetch(args)
+                queue.extend(extra)
+                extra.clear()
+            return
+
+        executor = self._get_executor()
+        futures = {self._submit(executor, fetch, args): key for key, args in tasks}
+        while futures:
+            done, _ = wait(futures, timeout=_wait_timeout(), return_when=FIRST_COMPLETED)
+            if not done:
+                for key in futures.values():
+                    yield key, None
+                return
+            for future in done:
+                key = futures.pop(future)
+                yield key, future.result()
+                for extra_key, args in extra:
+                    futures[self._submit(executor, fetch, args)] = extra_key
+                extra.clear()
+
+    def _event_feature(self, event_location: Union[EventLocation, Dict], event_lat: float, event_lon: float) -> Dict:
+        return {
             "type": "Feature",
             "geometry": {
                 "type": "Point",
-                "coordinates": [event_lon, event_lat] 
+                "coordinates": [event_lon, event_lat]
             },
             "properties": {
                 "id": "event_location",
@@ -105,176 +499,398 @@ class CityExplorer:
                 "marker_size": "large"
             }
         }
-        features.append(event_feature)
-        
-        # search for places in each category
-        for category in search_types:
+
+    def _summary_properties(self, event_lat: float, event_lon: float, radius: int,
+                            category_counts: Dict[str, int], total_places: int,
+                            missing: Optional[List[str]] = None) -> Dict:
+        if missing:
+            metrics.partial_results.inc()
+        return {
+            "center": [event_lon, event_lat],  # [lng, lat]
+            "radius": radius,
+            "categories": category_counts,
+            "bounds": self._calculate_bounds(event_lat, event_lon, radius),
+            "total_places": total_places,
+            # categories left empty because their search failed or ran out of time
+            "partial": bool(missing),
+            "missing_categories": missing or []
+        }
+    
+    def _search_categories(self, event_location: Union[EventLocation, Dict], search_types: List[str],
+                           radius: int, limit: int) -> Dict[str, Optional[List[PlaceResult]]]:
+        # returns places per category, None for categories that failed
+        steps = self._search_steps(event_location, search_types, radius, limit)
+        results = None
+        try:
+            while True:
+                batch = steps.send(results)
+                results = self._run_tasks({label: (self._fetch_places, args) for label, args in batch.items()})
+        except StopIteration as done:
+            return done.value
+
+    async def _search_categories_async(self, event_location: Union[EventLocation, Dict], search_types: List[str],
+                                       radius: int, limit: int) -> Dict[str, Optional[List[PlaceResult]]]:
+        steps = self._search_steps(event_location, search_types, radius, limit)
+        results = None
+        try:
+            while True:
+                batch = steps.send(results)
+                results = await self._run_fetches_async(batch)
+        except StopIteration as done:
+            return done.value
+
+    def _search_steps(self, event_location: Union[EventLocation, Dict], search_types: List[str],
+                      radius: int, limit: int):
+        """
+        the category search without the I/O: yields {label: _fetch_places args}
+        batches, is sent back {label: places or None} for each and returns places
+        per category, so the sync and async searches share one implementation
+        """
+        unique_types = list(dict.fromkeys(search_types))
+
+        if not self.coalesce:
             try:
-                places = self.search_places_near_event(
-                    event_location, category, radius, limit_per_category
-                )
-                category_counts[category] = len(places)
-                
-                # add each place as a feature
-                for place in places:
-                    place_feature = {
-                        "type": "Feature",
-                        "geometry": {
-                            "type": "Point",
-                            "coordinates": [place.lon, place.lat]  # [lng, lat] for GeoJSON
-                        },
-                        "properties": {
-                            "id": place.id,
-                            "name": place.name,
-                            "category": place.category,
-                            "subcategory": place.subcategory,
-                            "address": place.address,
-                            "distance": place.distance,
-                            "rating": place.rating,
-                            "phone": place.phone,
-                            "website": place.website,
-                            "opening_hours": place.opening_hours,
-                            "description": place.description,
-                            "marker_color": self._get_marker_color(place.category),
-                            "marker_icon": self._get_marker_icon(place.category),
-                            "marker_size": "medium"
-                        }
-                    }
-                    features.append(place_feature)
-                    
+                lat, lon = self._get_coordinates(event_location)
+            except ValueError as e:
+                print(f"Error searching for {', '.join(unique_types)}: {e}")
+                return {category: None for category in unique_types}
+            return (yield {
+                category: (lat, lon, self._get_categories(category), radius, limit)
+                for category in unique_types
+            })
+
+        # one upstream call per query group, then split the places back out per search type
+        lat, lon = self._get_coordinates(event_location)
+        groups = self.plan_queries(unique_types, limit)
+
+        responses = yield {
+            ', '.join(group.search_types): (lat, lon, group.categories, radius, group.limit)
+            for group in groups
+        }
+
+        # pool every group's places so a type can be filled from any call that found it,
+        # nearest first and in the requested type order
+        merged = []
+        failed_types = []
+        for group in groups:
+            places = responses[', '.join(group.search_types)]
+            if places is None:
+                failed_types.extend(group.search_types)
+            else:
+                merged.extend(places)
+        merged = geometry.rank_places(merged, lat, lon, radius)
+
+        live_types = [t for t in unique_types if t not in failed_types]
+        seen_ids = set()
+        results, matched = self._partition_places(merged, live_types, limit, seen_ids)
+        for search_type in failed_types:
+            results[search_type] = None
+
+        # a full response may have crowded out sparser types, ask for those on their own.
+        # a type that matched enough places but lost them to dedup is not short of data
+        top_ups = {}
+        for group in groups:
+            places = responses[', '.join(group.search_types)]
+            if places is None or len(places) < group.limit or len(group.search_types) < 2:
+                continue
+            for search_type in group.search_types:
+                if len(results[search_type]) < limit and matched[search_type] < limit:
+                    top_ups[search_type] = (lat, lon, self._get_categories(search_type), radius, limit * 2)
+
+        # top ups only improve on a usable answer, not worth going over budget for
+        if not top_ups or not _budget_left():
+            return results
+
+        for search_type, places in (yield top_ups).items():
+            if places is None:
+                continue
+            bucket = results[search_type]
+            for place in places:
+                if len(bucket) >= limit:
+                    break
+                if place.id not in seen_ids:
+                    seen_ids.add(place.id)
+                    bucket.append(place)
+            bucket.sort(key=lambda x: x.distance)
+
+        return results
+
+    def plan_queries(self, search_types: List[str], limit_per_category: int) -> List['QueryGroup']:
+        """
+        merge search types into as few upstream queries as possible
+
+        each type reserves limit_per_category * COALESCE_OVERSAMPLE results in its group
+        and a group never asks for more than MAX_GROUP_LIMIT results. dense types
+        (DENSE_SEARCH_TYPES) are never grouped with sparse ones, since a response
+        sorted by distance would be filled with restaurants before the first museum
+        showed up. within a tier, types that share geoapify categories are placed
+        together first since their results overlap anyway.
+        """
+        need = max(1, limit_per_category * COALESCE_OVERSAMPLE)
+        groups = []
+
+        for search_type in dict.fromkeys(search_types):
+            categories = self._get_categories(search_type)
+            # unknown types fall back to all_dining, so they are dense too
+            dense = search_type in DENSE_SEARCH_TYPES or search_type not in self.category_mappings
+
+            target = None
+            candidates = [g for g in groups if g.dense == dense]
+            overlapping = [g for g in candidates if set(categories) & set(g.categories)]
+            for group in overlapping + [g for g in candidates if g not in overlapping]:
+                # dense types only share a call when their results overlap
+                if dense and group not in overlapping:
+                    continue
+                if group.limit + need <= MAX_GROUP_LIMIT:
+                    target = group
+                    break
+
+            if target is None:
+                target = QueryGroup(search_types=[], categories=[], limit=0, dense=dense)
+                groups.append(target)
+
+            target.search_types.append(search_type)
+            target.categories.extend(c for c in categories if c not in target.categories)
+            target.limit = min(target.limit + need, MAX_GROUP_LIMIT)
+
+        return groups
+
+    def _partition_places(self, places: List[PlaceResult], search_types: List[str], limit: int,
+                          seen_ids: set) -> Tuple[Dict[str, List[PlaceResult]], Dict[str, int]]:
+        # assign each place once, to the first requested type it matches that still has room.
+        # also returns how many distinct places matched each type, assigned or not
+        buckets = {search_type: [] for search_type in search_types}
+        matched = {search_type: 0 for search_type in search_types}
+        type_categories = {search_type: self._get_categories(search_type) for search_type in search_types}
+        counted = set()
+
+        for place in places:
+            if place.id in counted:
+                continue
+            counted.add(place.id)
+
+            place_categories = place.categories or [place.category, place.subcategory]
+            matching = [t for t in search_types if matches_categories(place_categories, type_categories[t])]
+            for search_type in matching:
+                matched[search_type] += 1
+
+            if place.id in seen_ids:
+                continue
+            for search_type in matching:
+                bucket = buckets[search_type]
+                if len(bucket) < limit:
+                    bucket.append(place)
+                    seen_ids.add(place.id)
+                    break
+
+        return buckets, matched
+
+    def _run_tasks(self, tasks: Dict[str, Tuple]) -> Dict[str, Optional[object]]:
+        # runs (fn, args) tasks, in parallel when enabled, None marks a task that raised
+        results = {}
+
+        if not self.concurrent or len(tasks) < 2:
+            for label, (fn, args) in tasks.items():
+                try:
+                    results[label] = fn(*args)
+                except Exception as e:
+                    print(f"Error searching for {label}: {e}")
+                    results[label] = None
+            return results
+
+        # send every query at once, the in flight cap is enforced in _make_api_request
+        executor = self._get_executor()
+        futures = {label: self._submit(executor, fn, *args) for label, (fn, args) in tasks.items()}
+        for label, future in futures.items():
+            try:
+                # past the upstream deadline the fetch keeps going and still fills the cache
+                results[label] = future.result(timeout=_wait_timeout())
+            except FutureTimeout:
+                print(f"Out of time searching for {label}")
+                results[label] = None
             except Exception as e:
-                print(f"Error searching for {category}: {e}")
-                category_counts[category] = 0
-        
-        # create the GeoJSON feature collection
-        geojson = {
-            "type": "FeatureCollection",
-            "features": features,
+                print(f"Error searching for {label}: {e}")
+                results[label] = None
+        return results
+
+    def _get_categories(self, search_type: str) -> List[str]:
+        return self.category_mappings.get(search_type, self.category_mappings['all_dining'])
+
+    def _get_coordinates(self, event_location: Union[EventLocation, Dict]) -> Tuple[float, float]:
+        if isinstance(event_location, dict):
+            lat = event_location.get('lat') or event_location.get('latitude')
+            lon = event_location.get('lon') or event_location.get('longitude')
+            if lat is None or lon is None:
+                raise ValueError("Event location must contain lat/lon coordinates")
+            return lat, lon
+        return event_location.lat, event_location.lon
+
+    def _fetch_places(self, lat: float, lon: float, categories: List[str], radius: int,
+                      limit: int) -> Optional[List[PlaceResult]]:
+        places = self._local_places(lat, lon, categories, radius, limit)
+        if places is not None:
+            return places
+        body = self._make_api_request(lat, lon, categories, radius, limit)
+        return self._store_response(lat, lon, categories, radius, limit, body)
+
+    async def _fetch_places_async(self, lat: float, lon: float, categories: List[str], radius: int,
+                                  limit: int) -> Optional[List[PlaceResult]]:
+        places = self._local_places(lat, lon, categories, radius, limit)
+        if places is not None:
+            return places
+        body = await self._make_api_request_async(lat, lon, categories, radius, limit)
+        return self._store_response(lat, lon, categories, radius, limit, body)
+
+    async def _run_fetches_async(self, batch: Dict[str, Tuple]) -> Dict[str, Optional[List[PlaceResult]]]:
+        # every _fetch_places_async of a batch at once, None marks a fetch that raised or ran out of time
+        tasks = {label: asyncio.ensure_future(self._fetch_places_async(*args)) for label, args in batch.items()}
+        await asyncio.wait(tasks.values(), timeout=_wait_timeout())
+
+        results = {}
+        for label, task in tasks.items():
+            if not task.done():
+                # keeps going and still fills the cache
+                print(f"Out of time searching for {label}")
+                task.add_done_callback(_discard_result)
+                results[label] = None
+            elif task.exception() is not None:
+                print(f"Error searching for {label}: {task.exception()}")
+                results[label] = None
+            else:
+                results[label] = task.result()
+        return results
+
+    def _local_places(self, lat: float, lon: float, categories: List[str], radius: int,
+                      limit: int) -> Optional[List[PlaceResult]]:
+        # places the cache or the place store can answer with, None when upstream has to be asked
+        if self.place_cache is not None:
+            cached = self.place_cache.lookup(lat, lon, categories, radius, limit)
+            if cached is not None:
+                return cached
+
+        if self.place_store is not None and self.store_first and \
+                self.place_store.covers(lat, lon, categories, radius):
+            places = self.place_store.query(lat, lon, radius, categories, limit)
+            if self.place_cache is not None:
+                self.place_cache.store_places(lat, lon, categories, radius, limit, places)
+            return places
+        return None
+
+    def _store_response(self, lat: float, lon: float, categories: List[str], radius: int, limit: int,
+                        body: Optional[bytes]) -> Optional[List[PlaceResult]]:
+        # failed requests come back as None and must not be cached as "nothing here"
+        if body is None:
+            return None
+        with metrics.stage('parse'):
+            places = parse_places(body, center=(lat, lon))
+        if self.place_cache is not None:
+            self.place_cache.store_places(lat, lon, categories, radius, limit, places)
+        if self.place_store is not None:
+            self.place_store.add_places(places)
+            self.place_store.record_coverage(
+                lat, lon, categories, geometry.covered_radius(lat, lon, radius, limit, places)
+            )
+        return places
+
+    def _submit(self, executor: ThreadPoolExecutor, fn, *args):
+        # run in the caller's context so the upstream priority follows the work onto the pool
+        return executor.submit(contextvars.copy_context().run, fn, *args)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # the process wide pool unless this explorer was given its own size
+        if not self.max_workers:
+            return _shared_executor()
+
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="geoapify")
+        return self._executor
+
+    def _place_to_feature(self, place: PlaceResult) -> Dict:
+        marker_color, marker_icon = marker_style(place.category)
+        return {
+            "type": "Feature",
+            "geometry": {
+                "type": "Point",
+                "coordinates": [place.lon, place.lat]  # [lng, lat] for GeoJSON
+            },
             "properties": {
-                "center": [event_lon, event_lat],  # [lng, lat]
-                "radius": radius,
-                "categories": category_counts,
-                "bounds": self._calculate_bounds(event_lat, event_lon, radius),
-                "total_places": len(features) - 1  # Subtract 1 for event marker
+                "id": place.id,
+                "name": place.name,
+                "category": place.category,
+                "subcategory": place.subcategory,
+                "address": place.address,
+                "distance": place.distance,
+                "rating": place.rating,
+                "phone": place.phone,
+                "website": place.website,
+                "opening_hours": place.opening_hours,
+                "description": place.description,
+                "marker_color": marker_color,
+                "marker_icon": marker_icon,
+                "marker_size": "medium"
             }
         }
+
+    def _make_api_request(self, lat: float, lon: float, categories: List[str], radius: int,
+                          limit: int) -> Optional[bytes]:
+        # raw response body, None when the request failed
+        params = self._request_params(lat, lon, categories, radius, limit)
         
-        return geojson
-    
-    def _make_api_request(self, lat: float, lon: float, categories: List[str], radius: int, limit: int) -> Dict:
-        categories_str = ','.join(categories)
-        
-        params = {
-            'categories': categories_str,
+        try:
+            # the in flight slot is taken per attempt, not across retry backoff
+            response = self.http.get(self.base_url, params=params, slots=_request_slots)
+            response.raise_for_status()
+            return response.content
+        except requests.exceptions.RequestException as e:
+            print(f"Error making API request: {e}")
+            return None
+
+    async def _make_api_request_async(self, lat: float, lon: float, categories: List[str], radius: int,
+                                      limit: int) -> Optional[bytes]:
+        params = self._request_params(lat, lon, categories, radius, limit)
+
+        try:
+            response = await self._async_client().get(self.base_url, params=params, slots=self._async_request_slots())
+            upstream.raise_for_status(response)
+            return response.content
+        except requests.exceptions.RequestException as e:
+            print(f"Error making API request: {e}")
+            return None
+
+    def _request_params(self, lat: float, lon: float, categories: List[str], radius: int, limit: int) -> Dict:
+        return {
+            'categories': ','.join(categories),
             'filter': f'circle:{lon},{lat},{radius}',
             'bias': f'proximity:{lon},{lat}',
             'limit': limit,
             'apiKey': self.api_key,
             'format': 'geojson'
         }
-        
-        try:
-            response = requests.get(self.base_url, params=params, timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"Error making API request: {e}")
-            return {'features': []}
-    
-    def _parse_api_response(self, response: Dict) -> List[PlaceResult]:
-        # turns api response into place result
-        places = []
-        
-        for feature in response.get('features', []):
-            props = feature.get('properties', {})
-            coords = feature.get('geometry', {}).get('coordinates', [])
-            
-            if len(coords) < 2:
-                continue
-                
-            # extract category info
-            categories = props.get('categories', ['unknown'])
-            main_category = categories[0] if categories else 'unknown'
-            subcategory = categories[1] if len(categories) > 1 else main_category
-            
-            place = PlaceResult(
-                id=props.get('place_id', f"{coords[1]}_{coords[0]}"),
-                name=props.get('name', 'Unknown'),
-                category=main_category,
-                subcategory=subcategory,
-                lat=coords[1], 
-                lon=coords[0],  
-                address=props.get('formatted', ''),
-                distance=int(props.get('distance', 0)),
-                rating=self._extract_rating(props),
-                phone=props.get('contact', {}).get('phone'),
-                website=props.get('contact', {}).get('website'),
-                opening_hours=props.get('opening_hours'),
-                description=props.get('description')
-            )
-            places.append(place)
-            
-        return sorted(places, key=lambda x: x.distance)
+
+    def _async_client(self) -> 'upstream.AsyncUpstreamClient':
+        # made on first use, so it belongs to the event loop doing the first request
+        if self.async_http is None:
+            self.async_http = upstream.AsyncUpstreamClient.like(self.http, pool_size=self.async_pool_size)
+        return self.async_http
+
+    def _async_request_slots(self) -> asyncio.Semaphore:
+        # MAX_IN_FLIGHT_REQUESTS for the running loop, an asyncio semaphore can't be shared between loops
+        loop = asyncio.get_running_loop()
+        if self._async_slots is None or self._async_slots[0] is not loop:
+            self._async_slots = (loop, asyncio.Semaphore(MAX_IN_FLIGHT_REQUESTS))
+        return self._async_slots[1]
     
-    def _extract_rating(self, props: Dict) -> Optional[float]:
-        rating_sources = [
-            props.get('datasource', {}).get('raw', {}).get('rating'),
-            props.get('rating'),
-            props.get('datasource', {}).get('raw', {}).get('stars')
-        ]
-        
-        for rating in rating_sources:
-            if rating is not None:
-                try:
-                    return float(rating)
-                except (ValueError, TypeError):
-                    continue
-        return None
+    def _parse_api_response(self, response: Union[bytes, Dict],
+                            center: Optional[Tuple[float, float]] = None) -> List[PlaceResult]:
+        return parse_places(response, center)
     
     def _get_marker_color(self, category: str) -> str:
-        # map markers based on category
-        color_map = {
-            'catering.restaurant': 'green',
-            'catering.bar': 'purple',
-            'catering.pub': 'purple',
-            'catering.cafe': 'orange',
-            'catering.fast_food': 'lightgreen',
-            'entertainment': 'blue',
-            'tourism.attraction': 'red',
-            'commercial': 'gray'
-        }
-        
-        for key, color in color_map.items():
-            if key in category:
-                return color
-        return 'gray'
+        return marker_style(category)[0]
     
     def _get_marker_icon(self, category: str) -> str:
-        # returns marker color based on category
-        icon_map = {
-            'catering.restaurant': 'cutlery',
-            'catering.bar': 'glass',
-            'catering.pub': 'beer',
-            'catering.cafe': 'coffee',
-            'catering.fast_food': 'cutlery',
-            'entertainment': 'music',
-            'tourism.attraction': 'camera',
-            'commercial': 'shopping-cart'
-        }
-        
-        for key, icon in icon_map.items():
-            if key in category:
-                return icon
-        return 'map-marker'
+        return marker_style(category)[1]
     
     def _calculate_bounds(self, center_lat: float, center_lon: float, radius: int) -> Dict:
-        # 1 degree is about 111km
-        lat_offset = (radius / 111000)
-        lon_offset = (radius / 111000) / abs(center_lat / 90) if center_lat != 0 else (radius / 111000)
-        
-        return {
-            'north': center_lat + lat_offset,
-            'south': center_lat - lat_offset,
-            'east': center_lon + lon_offset,
-            'west': center_lon - lon_offset
-        }
+        return geometry.bounding_box(center_lat, center_lon, radius)
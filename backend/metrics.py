@@ -0,0 +1,277 @@
+import sys
+import time
+import bisect
+import contextvars
+import threading
+import collections
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+
+# seconds, tuned for calls between a cache hit and a slow upstream
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _label_key(labels: Dict[str, str]) -> Tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: Tuple) -> str:
+    if not key:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in key)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(key, escaped)) + '}'
+
+
+class Counter:
+    """monotonically increasing count per label set"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+    def samples(self) -> Iterator[Tuple[str, Tuple, float]]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name + '_total', key, value
+
+
+class Histogram:
+    """bucketed observations per label set, cumulative like prometheus expects"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._values = {}   # label key -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def count(self, **labels) -> int:
+        counts = self._values.get(_label_key(labels))
+        return sum(counts[:-1]) if counts else 0
+
+    def samples(self) -> Iterator[Tuple[str, Tuple, float]]:
+        with self._lock:
+            items = [(key, list(counts)) for key, counts in self._values.items()]
+        for key, counts in items:
+            running = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                running += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield self.name + '_bucket', key + (('le', le),), running
+            yield self.name + '_count', key, running
+            yield self.name + '_sum', key, counts[-1]
+
+
+class Registry:
+    """
+    metrics exposed on /metrics
+
+    counters and histograms are updated as things happen, collectors are
+    called at scrape time for values that already live elsewhere (cache
+    stats) and return (name, labels, value) gauges
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._register(name, lambda: Counter(name, help))
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(name, lambda: Histogram(name, help, buckets))
+
+    def add_collector(self, collector: Callable[[], List[Tuple[str, Dict, float]]]) -> None:
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        """prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, value in metric.samples():
+                lines.append(f"{name}{_format_labels(key)} {value:g}")
+
+        gauges = {}
+        for collector in collectors:
+            try:
+                for name, labels, value in collector():
+                    gauges.setdefault(name, []).append((_label_key(labels), value))
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+        for name, samples in gauges.items():
+            lines.append(f"# TYPE {name} gauge")
+            for key, value in samples:
+                lines.append(f"{name}{_format_labels(key)} {value:g}")
+
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, name: str, make):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = make()
+            return metric
+
+
+registry = Registry()
+
+stage_seconds = registry.histogram('citypulse_stage_seconds', 'Time spent per pipeline stage')
+request_seconds = registry.histogram('citypulse_http_request_seconds', 'Endpoint latency')
+response_bytes = registry.histogram('citypulse_http_response_bytes', 'Endpoint response size', SIZE_BUCKETS)
+upstream_seconds = registry.histogram('citypulse_upstream_request_seconds', 'Upstream call latency per attempt')
+upstream_responses = registry.counter('citypulse_upstream_responses', 'Upstream responses by status')
+upstream_errors = registry.counter('citypulse_upstream_errors', 'Upstream calls that got no response')
+upstream_hedges = registry.counter('citypulse_upstream_hedges', 'Duplicate upstream requests sent for slow attempts')
+partial_results = registry.counter('citypulse_partial_results', 'Place searches answered without some categories')
+upstream_throttled = registry.counter('citypulse_upstream_throttled', 'Upstream calls the rate limiter refused')
+
+
+# stage timings of the request being handled, a context variable so work the request
+# hands to a pool through contextvars.copy_context() adds to the same timings
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+_timings_lock = threading.Lock()
+
+
+def start_request() -> None:
+    _request_timings.set({})
+
+
+def request_stages() -> Dict[str, float]:
+    """stage -> seconds recorded for the current request since start_request, pool work included"""
+    stages = _request_timings.get()
+    if stages is None:
+        return {}
+    with _timings_lock:
+        return dict(stages)
+
+
+@contextmanager
+def stage(name: str):
+    """time a block as a pipeline stage (fetch, parse, build, serialize...)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(elapsed, stage=name)
+        stages = _request_timings.get()
+        if stages is not None:
+            with _timings_lock:
+                stages[name] = stages.get(name, 0.0) + elapsed
+
+
+def server_timing(stages: Dict[str, float], total: float) -> str:
+    """Server-Timing header value, durations in milliseconds"""
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in stages.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ', '.join(parts)
+
+
+class SamplingProfiler:
+    """
+    low overhead profiler that can be switched on in a running process
+
+    a background thread snapshots every thread's stack each interval and
+    counts the innermost depth frames, which is enough to see where wall
+    time goes without tracing every call
+    """
+
+    def __init__(self, interval: float = 0.005, depth: int = 8):
+        self.interval = interval
+        self.depth = depth
+        self.samples = 0
+        self._stacks = collections.Counter()
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        with self._lock:
+            if self.running:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+
+    def report(self, top: int = 30) -> Dict:
+        with self._lock:
+            stacks = self._stacks.most_common(top)
+            samples = self.samples
+        return {
+            "running": self.running,
+            "samples": samples,
+            "interval": self.interval,
+            "top": [{"stack": stack, "samples": count} for stack, count in stacks]
+        }
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                self.samples += 1
+                for thread_id, frame in frames.items():
+                    if thread_id == own:
+                        continue
+                    stack = []
+                    while frame is not None and len(stack) < self.depth:
+                        code = frame.f_code
+                        stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}:{frame.f_lineno}")
+                        frame = frame.f_back
+                    self._stacks[' <- '.join(stack)] += 1
+
+
+profiler = SamplingProfiler()
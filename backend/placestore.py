@@ -0,0 +1,251 @@
+import sys
+import json
+import math
+import time
+import sqlite3
+import threading
+from dataclasses import asdict, replace
+from typing import Dict, List, Optional, Union
+
+import geometry
+from geoapify import PlaceResult, intern_categories, matches_categories
+
+
+class PlaceStore:
+    """
+    local, persistent store of every place we have seen, with a grid index
+
+    places live in memory in lat/lon grid cells of cell_size degrees so a radius
+    query only looks at the handful of cells its bounding box touches. every
+    upstream search also records the circle it covered (per category set), which
+    is how the store knows whether it can answer a search on its own or whether
+    that area has no data or stale data and has to go upstream.
+
+    with a path the places and coverage are written to SQLite and loaded back
+    on startup, without one the store is memory only.
+    """
+
+    def __init__(self, path: Optional[str] = None, cell_size: float = 0.005, max_age: float = 7 * 86400):
+        self.path = path
+        self.cell_size = cell_size
+        self.max_age = max_age
+
+        self._places = {}      # id -> PlaceResult
+        self._cells = {}       # (row, col) -> {id: (lat, lon)}
+        self._coverage = {}    # (row, col) of center -> [(lat, lon, radius, category set, fetched_at)]
+        self._max_coverage_radius = 0.0
+        self._lock = threading.RLock()
+
+        self.queries = 0
+        self.covered = 0
+        self.uncovered = 0
+
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS places (id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS coverage (lat REAL, lon REAL, radius REAL, categories TEXT, fetched_at REAL)"
+            )
+            self._db.commit()
+            self._load()
+
+    def add_places(self, places: List[PlaceResult]) -> None:
+        now = time.time()
+        with self._lock:
+            for place in places:
+                self._index(place)
+            if self._db is not None:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO places (id, data, updated_at) VALUES (?, ?, ?)",
+                    [(p.id, json.dumps(asdict(p)), now) for p in places]
+                )
+                self._db.commit()
+
+    def record_coverage(self, lat: float, lon: float, categories: List[str], radius: float,
+                        fetched_at: Optional[float] = None) -> None:
+        """remember that every place with these categories within radius of (lat, lon) is stored"""
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        category_key = ','.join(sorted(set(categories)))
+
+        with self._lock:
+            self._add_coverage(lat, lon, radius, frozenset(categories), fetched_at)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT INTO coverage (lat, lon, radius, categories, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                    (lat, lon, radius, category_key, fetched_at)
+                )
+                self._db.commit()
+
+    def covers(self, lat: float, lon: float, categories: List[str], radius: float) -> bool:
+        """True when a fresh upstream search already covered this circle for these categories"""
+        wanted = set(categories)
+        oldest = time.time() - self.max_age
+
+        # a covering circle's center is at most its radius away, look that far out
+        reach = self._cells_for(lat, lon, self._max_coverage_radius)
+        with self._lock:
+            for cell in reach:
+                for c_lat, c_lon, c_radius, c_categories, fetched_at in self._coverage.get(cell, ()):
+                    if fetched_at < oldest or c_radius < radius or not wanted <= c_categories:
+                        continue
+                    if geometry.haversine_m(c_lat, c_lon, lat, lon) + radius <= c_radius:
+                        self._count('covered')
+                        return True
+        self._count('uncovered')
+        return False
+
+    def query(self, lat: float, lon: float, radius: float, categories: Optional[List[str]] = None,
+              limit: Optional[int] = None) -> List[PlaceResult]:
+        """places within radius meters, nearest first, with distance measured from (lat, lon)"""
+        self._count('queries')
+
+        # cheap equirectangular box test before the exact haversine distance
+        lat_span = radius / 111320.0
+        lon_span = radius / (111320.0 * max(math.cos(math.radians(lat)), 1e-6))
+
+        found = []
+        with self._lock:
+            for cell in self._cells_for(lat, lon, radius):
+                for place_id, (p_lat, p_lon) in self._cells.get(cell, {}).items():
+                    if abs(p_lat - lat) > lat_span or abs(p_lon - lon) > lon_span:
+                        continue
+                    distance = geometry.haversine_m(lat, lon, p_lat, p_lon)
+                    if distance > radius:
+                        continue
+                    place = self._places[place_id]
+                    if categories and not matches_categories(place.categories or [place.category], categories):
+                        continue
+                    found.append((distance, place))
+
+        found.sort(key=lambda item: item[0])
+        if limit is not None:
+            found = found[:limit]
+        return [replace(place, distance=int(distance)) for distance, place in found]
+
+    def load_geojson(self, source: Union[str, Dict]) -> int:
+        """
+        bulk load a FeatureCollection, either a raw geoapify response or our own
+        get_geojson_data output. source is a parsed dict or a file path. returns
+        the number of places added
+        """
+        if isinstance(source, str):
+            with open(source, 'rb') as f:
+                raw = f.read()
+            # dumps saved from windows shells come out as utf-16
+            encoding = 'utf-16' if raw[:2] in (b'\xff\xfe', b'\xfe\xff') else 'utf-8'
+            source = json.loads(raw.decode(encoding))
+
+        places = []
+        for feature in source.get('features', []):
+            props = feature.get('properties', {})
+            coords = feature.get('geometry', {}).get('coordinates', [])
+            if len(coords) < 2 or props.get('type') == 'event':
+                continue
+
+            if 'categories' in props:
+                categories = props['categories'] or ['unknown']
+            else:
+                categories = [c for c in (props.get('category'), props.get('subcategory')) if c] or ['unknown']
+            categories = intern_categories(categories)
+
+            contact = props.get('contact') or {}
+            places.append(PlaceResult(
+                id=props.get('place_id') or props.get('id') or f"{coords[1]}_{coords[0]}",
+                name=props.get('name', 'Unknown'),
+                category=categories[0],
+                subcategory=categories[1] if len(categories) > 1 else categories[0],
+                lat=coords[1],
+                lon=coords[0],
+                address=props.get('formatted') or props.get('address', ''),
+                distance=0,
+                rating=props.get('rating'),
+                phone=props.get('phone') or contact.get('phone'),
+                website=props.get('website') or contact.get('website'),
+                opening_hours=props.get('opening_hours'),
+                description=props.get('description'),
+                categories=categories
+            ))
+
+        self.add_places(places)
+        return len(places)
+
+    def __len__(self) -> int:
+        return len(self._places)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            coverage = sum(len(records) for records in self._coverage.values())
+            cells = len(self._cells)
+        return {
+            "places": len(self._places),
+            "cells": cells,
+            "coverage_records": coverage,
+            "queries": self.queries,
+            "covered": self.covered,
+            "uncovered": self.uncovered
+        }
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _load(self) -> None:
+        for (data,) in self._db.execute("SELECT data FROM places"):
+            place = PlaceResult(**json.loads(data))
+            place.category = sys.intern(place.category)
+            place.subcategory = sys.intern(place.subcategory)
+            if place.categories:
+                place.categories = intern_categories(place.categories)
+            self._index(place)
+
+        oldest = time.time() - self.max_age
+        self._db.execute("DELETE FROM coverage WHERE fetched_at < ?", (oldest,))
+        self._db.commit()
+        for lat, lon, radius, categories, fetched_at in self._db.execute(
+                "SELECT lat, lon, radius, categories, fetched_at FROM coverage"):
+            self._add_coverage(lat, lon, radius, frozenset(categories.split(',')), fetched_at)
+
+    def _add_coverage(self, lat: float, lon: float, radius: float, categories: frozenset, fetched_at: float) -> None:
+        self._coverage.setdefault(self._cell(lat, lon), []).append((lat, lon, radius, categories, fetched_at))
+        self._max_coverage_radius = max(self._max_coverage_radius, radius)
+
+    def _index(self, place: PlaceResult) -> None:
+        previous = self._places.get(place.id)
+        if previous is not None:
+            self._cells.get(self._cell(previous.lat, previous.lon), {}).pop(place.id, None)
+
+        # stored as is, query() hands out copies with their own distance
+        self._places[place.id] = place
+        self._cells.setdefault(self._cell(place.lat, place.lon), {})[place.id] = (place.lat, place.lon)
+
+    def _cell(self, lat: float, lon: float) -> tuple:
+        return int(math.floor(lat / self.cell_size)), int(math.floor(lon / self.cell_size))
+
+    def _cells_for(self, lat: float, lon: float, radius: float) -> List[tuple]:
+        lat_span = radius / 111320.0
+        lon_span = radius / (111320.0 * max(math.cos(math.radians(lat)), 1e-6))
+        row_min, col_min = self._cell(lat - lat_span, lon - lon_span)
+        row_max, col_max = self._cell(lat + lat_span, lon + lon_span)
+        return [(row, col) for row in range(row_min, row_max + 1) for col in range(col_min, col_max + 1)]
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+
+if __name__ == '__main__':
+    # python placestore.py places.db dump.geojson [more.geojson ...]
+    if len(sys.argv) < 3:
+        print("usage: python placestore.py <store.db> <file.geojson> [...]")
+        sys.exit(1)
+
+    store = PlaceStore(sys.argv[1])
+    for dump in sys.argv[2:]:
+        print(f"{dump}: loaded {store.load_geojson(dump)} places")
+    print(store.stats())
+    store.close()
@@ -0,0 +1,284 @@
+import re
+import time
+import itertools
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import geometry
+
+
+WEEK = 7 * 1440
+DAYS = ['Mo', 'Tu', 'We', 'Th', 'Fr', 'Sa', 'Su']
+
+# minutes spent at a stop of each search type
+DEFAULT_DWELL = {
+    'restaurants': 75, 'all_dining': 60, 'cafes': 30, 'bars': 60,
+    'entertainment': 90, 'attractions': 60, 'shopping': 45
+}
+
+# meters per minute, an unhurried walk
+WALK_SPEED = 80.0
+
+# a leg that has to leave out a stop costs more than any amount of walking
+SKIP_COST = 1e9
+
+_DAY_RANGE = re.compile(r"^(Mo|Tu|We|Th|Fr|Sa|Su)(?:-(Mo|Tu|We|Th|Fr|Sa|Su))?$")
+_TIME_SPAN = re.compile(r"^(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})\+?$")
+
+
+def parse_opening_hours(text: Optional[str]) -> Optional[List[Tuple[int, int]]]:
+    """
+    weekly open intervals in minutes from Monday 00:00 for an OSM opening_hours value
+
+    understands the common "Mo-Fr 09:00-17:00; Sa 10:00-14:00,16:00-20:00; Su off"
+    and "24/7" forms, a later rule replaces earlier ones for the days it names
+    and times past midnight run into the next day. None when there are no hours
+    or they use syntax beyond that, which planning treats as always open
+    """
+    if not isinstance(text, str) or not text.strip():
+        return None
+    text = text.strip()
+    if text == '24/7':
+        return [(0, WEEK)]
+
+    by_day = {}
+    for rule in text.split(';'):
+        rule = rule.strip()
+        if not rule or rule.startswith('PH'):
+            continue
+        first, _, rest = rule.partition(' ')
+        if _TIME_SPAN.match(first.split(',')[0]):
+            days, spans = list(range(7)), rule
+        else:
+            days = _parse_days(first)
+            spans = rest.strip()
+            if days is None:
+                return None
+
+        intervals = []
+        if spans != 'off':
+            for span in spans.split(','):
+                match = _TIME_SPAN.match(span.strip())
+                if match is None:
+                    return None
+                start = int(match.group(1)) * 60 + int(match.group(2))
+                end = int(match.group(3)) * 60 + int(match.group(4))
+                intervals.append((start, end if end > start else end + 1440))
+        for day in days:
+            by_day[day] = [(day * 1440 + start, day * 1440 + end) for start, end in intervals]
+
+    return sorted(interval for intervals in by_day.values() for interval in intervals)
+
+
+def _parse_days(text: str) -> Optional[List[int]]:
+    days = []
+    for part in text.split(','):
+        match = _DAY_RANGE.match(part)
+        if match is None:
+            return None
+        first = DAYS.index(match.group(1))
+        last = DAYS.index(match.group(2) or match.group(1))
+        days.extend((first + i) % 7 for i in range((last - first) % 7 + 1))
+    return days
+
+
+def is_open(hours: Optional[List[Tuple[int, int]]], start: float, end: float) -> bool:
+    """whether a visit from start to end (minutes from Monday 00:00, any week) fits one open interval"""
+    if hours is None:
+        return True
+    offset = start // WEEK * WEEK
+    start, end = start - offset, end - offset
+    # intervals running past Sunday midnight cover the start of the week after
+    return any(a <= start and end <= b or a <= start + WEEK and end + WEEK <= b for a, b in hours)
+
+
+def parse_event_time(text: str) -> datetime:
+    """an event's local start time from an ISO date or date and time, a bare date is taken as 19:00"""
+    text = text.strip()
+    if text.endswith('Z'):
+        text = text[:-1]
+    moment = datetime.fromisoformat(text)
+    if len(text) == 10:
+        moment = moment.replace(hour=19)
+    return moment.replace(tzinfo=None)
+
+
+def minute_of_week(moment: datetime) -> float:
+    return moment.weekday() * 1440 + moment.hour * 60 + moment.minute + moment.second / 60
+
+
+def plan_route(venue: Tuple[float, float], event_start: datetime, event_minutes: int,
+               before: Dict[str, Sequence], after: Dict[str, Sequence],
+               dwell: Optional[Dict[str, int]] = None, speed: float = WALK_SPEED, buffer: int = 15,
+               time_limit: float = 0.05) -> Dict:
+    """
+    an evening around an event: one stop per search type before it and after it
+
+    before and after map search types to candidate places (anything with
+    lat, lon and opening_hours, PlaceResult in practice). the pre event leg
+    starts at the venue and has to be back buffer minutes before event_start,
+    the post event leg starts at the venue when the event ends and returns to
+    it. every stop is visited for its dwell minutes inside its opening hours.
+
+    distances between every candidate and the venue come from one vectorized
+    pairwise pass. each leg tries the orders of its search types and for each
+    order picks the stops with a layered shortest path over the matrix, keeping
+    the order that walks the least. orders are tried until time_limit seconds
+    are up, with more than a handful of types not all of them get a turn.
+    a type none of whose candidates is open in time is left out and listed in
+    unplanned. a place picked before the event is not picked again after it,
+    so a type can be asked for on both sides
+    """
+    started = time.perf_counter()
+    dwell = dict(DEFAULT_DWELL, **(dwell or {}))
+
+    # index 0 is the venue, then every candidate of every leg
+    points = [None]
+    lats, lons = [venue[0]], [venue[1]]
+    legs = []
+    for types in (before, after):
+        layers = {}
+        for search_type, places in types.items():
+            layers[search_type] = np.arange(len(points), len(points) + len(places))
+            for place in places:
+                points.append(place)
+                lats.append(place.lat)
+                lons.append(place.lon)
+        legs.append(layers)
+
+    distances = geometry.pairwise_haversine(lats, lons)
+    hours = [None] + [parse_opening_hours(place.opening_hours) for place in points[1:]]
+
+    event_at = minute_of_week(event_start)
+    deadline = started + time_limit
+    solved = []
+    timed_out = False
+    used = set()
+    for layers, origin, direction in ((legs[0], event_at - buffer, -1), (legs[1], event_at + event_minutes, 1)):
+        # a place already visited before the event is not a candidate after it
+        layers = {search_type: candidates[[points[i].id not in used for i in candidates]]
+                  for search_type, candidates in layers.items()}
+        route, complete = _solve_leg(layers, distances / speed, hours, dwell, origin, direction, deadline)
+        timed_out = timed_out or not complete
+        solved.append(route)
+        used.update(points[index].id for _, index, _, _ in route['stops'])
+
+    result = {"unplanned": [], "candidates": len(points) - 1}
+    walked = 0.0
+    for name, route in zip(('before', 'after'), solved):
+        stops = []
+        previous = 0
+        for search_type, index, arrive, depart in route['stops']:
+            walked += distances[previous, index]
+            stops.append({
+                "type": search_type,
+                "place": _place_summary(points[index]),
+                "arrive": (event_start + timedelta(minutes=arrive - event_at)).isoformat(timespec='minutes'),
+                "depart": (event_start + timedelta(minutes=depart - event_at)).isoformat(timespec='minutes'),
+                "walk_m": int(distances[previous, index])
+            })
+            previous = index
+        walked += distances[previous, 0]
+        result[name] = stops
+        result[f"{name}_return_walk_m"] = int(distances[previous, 0])
+        result["unplanned"].extend(route['unplanned'])
+
+    result["walk_m"] = int(walked)
+    result["timed_out"] = timed_out
+    result["solve_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return result
+
+
+def _solve_leg(layers: Dict[str, np.ndarray], minutes: np.ndarray, hours: List, dwell: Dict[str, int],
+               origin: float, direction: int, deadline: float) -> Tuple[Dict, bool]:
+    """best route over the orders of a leg's search types tried before deadline, and whether all were tried"""
+    best = None
+    complete = True
+    for order in itertools.permutations(layers):
+        route = _route_for_order(order, layers, minutes, hours, dwell, origin, direction)
+        if best is None or route['cost'] < best['cost']:
+            best = route
+        if time.perf_counter() > deadline:
+            complete = False
+            break
+
+    if best is None:
+        return {"stops": [], "unplanned": [], "cost": 0.0}, complete
+    return best, complete
+
+
+def _route_for_order(order: Sequence[str], layers: Dict[str, np.ndarray], minutes: np.ndarray, hours: List,
+                     dwell: Dict[str, int], origin: float, direction: int) -> Dict:
+    """
+    cheapest stops for one order of search types, walking from the venue at origin
+
+    a layered shortest path: each layer keeps, per candidate, the least walking
+    to reach it and when it is reached. going backwards in time (direction -1)
+    the layers are walked from the event back to the first stop, so "reached"
+    is when the visit has to end. each candidate takes the cheapest way in from
+    the previous layer, is dropped when closed for the visit that gives it,
+    and a layer with nothing open is skipped
+    """
+    sequence = list(order) if direction > 0 else list(reversed(order))
+    previous = np.array([0])
+    cost = np.zeros(1)
+    clock = np.array([origin])
+    back = []
+    skipped = []
+
+    for search_type in sequence:
+        candidates = layers[search_type]
+        if len(candidates) == 0:
+            skipped.append(search_type)
+            continue
+        # (previous, candidate) walking minutes, the min-plus step of the shortest path
+        totals = cost[:, None] + minutes[np.ix_(previous, candidates)]
+        came_from = totals.argmin(axis=0)
+        new_cost = totals[came_from, np.arange(len(candidates))]
+        reached = clock[came_from] + direction * minutes[previous[came_from], candidates]
+
+        stay = dwell.get(search_type, 60)
+        for i, index in enumerate(candidates):
+            start, end = (reached[i], reached[i] + stay) if direction > 0 else (reached[i] - stay, reached[i])
+            if not is_open(hours[index], start, end):
+                new_cost[i] = np.inf
+        if np.isinf(new_cost).all():
+            skipped.append(search_type)
+            continue
+
+        back.append((search_type, came_from, reached))
+        previous = candidates
+        cost = new_cost
+        clock = reached + direction * stay
+
+    # back to the venue, then follow the pointers from the cheapest last stop
+    cost = cost + minutes[previous, 0]
+    pick = int(cost.argmin())
+    total = float(cost[pick])
+
+    stops = []
+    for search_type, came_from, reached in reversed(back):
+        stay = dwell.get(search_type, 60)
+        start = reached[pick] if direction > 0 else reached[pick] - stay
+        stops.append((search_type, int(layers[search_type][pick]), float(start), float(start + stay)))
+        pick = int(came_from[pick])
+
+    # the pointers run from the last layer back, which is walking order only for a backwards leg
+    if direction > 0:
+        stops.reverse()
+    return {"stops": stops, "unplanned": skipped, "cost": total + SKIP_COST * len(skipped)}
+
+
+def _place_summary(place) -> Dict:
+    return {
+        "id": place.id,
+        "name": place.name,
+        "category": place.category,
+        "lat": place.lat,
+        "lon": place.lon,
+        "address": place.address,
+        "rating": place.rating,
+        "opening_hours": place.opening_hours
+    }
@@ -0,0 +1,134 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    collapses concurrent calls with the same key into one execution
+
+    the first caller for a key runs fn, everyone arriving while it is still
+    running waits and gets the same result (or the same exception). a waiter
+    whose reuse(result) is false runs fn itself instead. nothing is remembered
+    once the call finishes, caching is left to the caches.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+        self.executions = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.max_waiters = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any], reuse: Optional[Callable[[Any], bool]] = None) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.executions += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            if reuse is None or reuse(call.result):
+                return call.result
+            with self._lock:
+                self.rejected += 1
+            return fn()
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                self.max_waiters = max(self.max_waiters, call.waiters)
+            call.done.set()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            in_flight = len(self._calls)
+            waiting = sum(call.waiters for call in self._calls.values())
+        return {
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "in_flight": in_flight,
+            "waiting": waiting,
+            "max_waiters": self.max_waiters
+        }
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for coroutines on one event loop
+
+    the first caller's coroutine runs as a task that every caller for the key
+    awaits, shielded, so a caller that goes away (a client disconnecting)
+    doesn't cancel the work for the others. reuse works as in SingleFlight
+    """
+
+    def __init__(self):
+        self._calls = {}    # key -> [task, waiters]
+
+        self.executions = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.max_waiters = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]],
+                 reuse: Optional[Callable[[Any], bool]] = None) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            task = asyncio.ensure_future(fn())
+            call = self._calls[key] = [task, 0]
+            self.executions += 1
+            task.add_done_callback(lambda done: self._finish(key, call))
+            return await asyncio.shield(task)
+
+        call[1] += 1
+        self.coalesced += 1
+        result = await asyncio.shield(call[0])
+        if reuse is None or reuse(result):
+            return result
+        self.rejected += 1
+        return await fn()
+
+    def stats(self) -> Dict:
+        return {
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "in_flight": len(self._calls),
+            "waiting": sum(call[1] for call in self._calls.values()),
+            "max_waiters": self.max_waiters
+        }
+
+    def _finish(self, key: Hashable, call: list) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        self.max_waiters = max(self.max_waiters, call[1])
+        task = call[0]
+        # mark the error as seen even when every caller was cancelled
+        if not task.cancelled():
+            task.exception()
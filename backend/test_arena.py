@@ -0,0 +1,64 @@
+import unittest
+
+import geoapify as geo
+import wire
+from arena import FeatureList, PlaceArena
+
+
+def make_place(i, **fields):
+    values = dict(
+        id=f"p{i}", name=f"Place {i}", category='catering.restaurant', subcategory='catering.restaurant.pizza',
+        lat=40.75 + i * 1e-4, lon=-73.99, address=f"{i} Main St", distance=i * 10,
+        categories=['catering', 'catering.restaurant']
+    )
+    values.update(fields)
+    return geo.PlaceResult(**values)
+
+
+class TestPlaceArena(unittest.TestCase):
+    def setUp(self):
+        self.places = [
+            make_place(0, rating=4.5, phone='555-0100', opening_hours={'mo': '9-5'}),
+            make_place(1),
+            make_place(2, category='catering.bar', subcategory='catering.bar', categories=None),
+        ]
+        self.arena = PlaceArena(self.places)
+
+    def test_round_trip(self):
+        self.assertEqual(len(self.arena), 3)
+        self.assertEqual(self.arena.to_places(), self.places)
+        self.assertEqual(self.arena.place(2, distance=7).distance, 7)
+        self.assertEqual(list(self.arena.lat_array()), [p.lat for p in self.places])
+
+    def test_strings_are_shared(self):
+        # one table entry per distinct category, and the optional fields only where set
+        self.assertEqual(len(self.arena._strings), 3)
+        self.assertEqual(list(self.arena.extras), [0])
+        a, b = self.arena.to_places([0, 1])
+        self.assertIs(a.category, b.category)
+
+    def test_features_match_explorer(self):
+        explorer = geo.CityExplorer('test_api_key')
+        features = list(self.arena.features(explorer._get_marker_color, explorer._get_marker_icon))
+        self.assertEqual(features, [explorer._place_to_feature(p) for p in self.places])
+
+    def test_feature_list_builds_features_when_read(self):
+        explorer = geo.CityExplorer('test_api_key')
+        head = {'type': 'Feature', 'properties': {'id': 'event_location'}}
+        features = FeatureList([head], self.arena, explorer._get_marker_color, explorer._get_marker_icon)
+        expected = [head] + [explorer._place_to_feature(p) for p in self.places]
+
+        self.assertEqual(len(features), 4)
+        self.assertEqual(features[0], head)
+        self.assertEqual(features[-1], expected[-1])
+        self.assertEqual(features[1:3], expected[1:3])
+        self.assertEqual(features, expected)
+        self.assertEqual(wire.loads(wire.dumps({'features': features})), {'features': wire.loads(wire.dumps(expected))})
+
+    def test_slotted_records(self):
+        with self.assertRaises(AttributeError):
+            self.places[0].extra = 1
+
+
+if __name__ == '__main__':
+    unittest.main()
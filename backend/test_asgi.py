@@ -0,0 +1,239 @@
+import json
+import asyncio
+import pytest
+
+import asgi
+import ticketmaster
+import upstream
+from cache import EventCache
+from singleflight import AsyncSingleFlight
+from test_ticketmaster import mock_ticketmaster_response
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+needs_httpx = pytest.mark.skipif(httpx is None, reason="the async upstream client needs httpx")
+
+
+def call(path, query=b'', method='GET', body=b'', headers=()):
+    """run one request through the ASGI app, (status, headers, body)"""
+    async def run():
+        messages = []
+        scope = {
+            'type': 'http', 'method': method, 'path': path, 'query_string': query, 'root_path': '',
+            'headers': [(b'host', b'testserver')] + list(headers), 'http_version': '1.1', 'scheme': 'http',
+            'server': ('testserver', 80), 'client': ('127.0.0.1', 50000)
+        }
+
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        await asgi.app(scope, receive, send)
+        return messages
+
+    messages = asyncio.run(run())
+    start = messages[0]
+    headers = {k.decode(): v.decode() for k, v in start['headers']}
+    return start['status'], headers, b''.join(m.get('body', b'') for m in messages[1:])
+
+
+@pytest.fixture
+def event_cache(monkeypatch):
+    cache = EventCache(ttl=300, stale_ttl=3600)
+    monkeypatch.setattr(ticketmaster, 'event_cache', cache)
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def stub_upstreams(monkeypatch, event_cache):
+    """async upstream clients answered by httpx.MockTransport, calls are recorded by host path"""
+    calls = []
+
+    def handle(request):
+        calls.append(request.url.path)
+        if request.url.path.endswith('events.json'):
+            return httpx.Response(200, json=mock_ticketmaster_response())
+        return httpx.Response(200, json={'type': 'FeatureCollection', 'features': [{
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [-97.7431, 30.2672]},
+            'properties': {'place_id': 'p1', 'name': 'Taco Spot', 'categories': ['catering.restaurant'],
+                           'formatted': '1 Main St', 'distance': 120}
+        }]})
+
+    transport = httpx.MockTransport(handle)
+    monkeypatch.setattr(ticketmaster, 'TICKETMASTER_URL', 'https://tm.test/discovery/v2/events.json')
+    monkeypatch.setattr(asgi, '_ticketmaster_http', upstream.AsyncUpstreamClient('ticketmaster', transport=transport))
+    monkeypatch.setattr(ticketmaster.city_explorer, 'async_http',
+                        upstream.AsyncUpstreamClient('geoapify', transport=transport))
+    monkeypatch.setattr(ticketmaster.city_explorer, 'place_cache', None)
+    return calls
+
+
+def test_events_missing_city():
+    status, _, body = call('/events')
+    assert status == 400
+    assert "Missing 'city'" in json.loads(body)['error']
+
+
+def test_events_served_from_shared_cache(event_cache):
+    event_cache.get('Austin', 20, lambda: [{'id': 'cached'}])
+
+    status, headers, body = call('/events', b'city=Austin')
+    assert status == 200
+    assert headers['content-type'] == 'application/json'
+    assert json.loads(body) == [{'id': 'cached'}]
+
+
+def test_cors_headers_match_flask(event_cache):
+    event_cache.get('Austin', 20, lambda: [{'id': 'cached'}])
+    origin = (b'origin', b'http://localhost:5173')
+
+    _, headers, _ = call('/events', b'city=Austin', headers=[origin])
+    with ticketmaster.app.test_client() as client:
+        flask_headers = client.get('/events?city=Austin', headers={'Origin': 'http://localhost:5173'}).headers
+
+    assert headers['access-control-allow-origin'] == flask_headers['Access-Control-Allow-Origin'] == \
+        'http://localhost:5173'
+    assert 'Origin' in headers['vary']
+
+    _, headers, _ = call('/events', b'city=Austin')
+    assert 'access-control-allow-origin' not in headers
+
+
+def test_server_timing_matches_flask(event_cache):
+    event_cache.get('Austin', 20, lambda: [{'id': 'cached'}])
+
+    _, headers, _ = call('/events', b'city=Austin&timing=1')
+    assert 'total;dur=' in headers['server-timing']
+    _, headers, _ = call('/events', b'city=Austin')
+    assert 'server-timing' not in headers
+
+
+def test_other_paths_fall_through_to_flask():
+    status, _, body = call('/stats')
+    assert status == 200
+    assert 'place_cache' in json.loads(body)
+
+    status, _, body = call('/places/batch', method='POST', body=b'{"events": []}',
+                           headers=[(b'content-type', b'application/json')])
+    assert status == 400
+
+
+def test_async_singleflight_shares_one_call():
+    flight = AsyncSingleFlight()
+    runs = []
+
+    async def fetch():
+        runs.append(1)
+        await asyncio.sleep(0.01)
+        return 'result'
+
+    async def run():
+        return await asyncio.gather(*(flight.do('key', fetch) for _ in range(5)))
+
+    assert asyncio.run(run()) == ['result'] * 5
+    assert len(runs) == 1
+    assert flight.stats()['coalesced'] == 4
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_async_rate_limiter_paces_coroutines():
+    limiter = upstream.RateLimiter(rate=50, burst=1, max_wait=(0.01, 1.0))
+
+    async def run():
+        await limiter.acquire_async()
+        with pytest.raises(upstream.RateLimited):
+            await limiter.acquire_async()
+        with upstream.background():
+            await limiter.acquire_async()
+
+    asyncio.run(run())
+    assert limiter.stats()['granted'] == {'interactive': 1, 'background': 1}
+
+
+@needs_httpx
+def test_event_map_data_async(stub_upstreams, monkeypatch):
+    monkeypatch.setattr(ticketmaster, 'prefetch_places', lambda *args: None)
+
+    status, _, body = call('/event-map-data', b'city=Austin&types=restaurants')
+    data = json.loads(body)
+
+    assert status == 200
+    assert data['event']['id'] == 'evt1'
+    assert [f['properties']['name'] for f in data['map_data']['features']][1:] == ['Taco Spot']
+    assert stub_upstreams.count('/discovery/v2/events.json') == 1
+
+
+@needs_httpx
+def test_places_async_matches_sync(stub_upstreams):
+    query = b'lat=30.2672&lng=-97.7431&types=restaurants'
+
+    _, _, async_body = call('/places', query)
+    with ticketmaster.app.test_client() as client:
+        with pytest.MonkeyPatch.context() as patch:
+            patch.setattr(ticketmaster.city_explorer, 'get_geojson_data',
+                          lambda **kw: asyncio.run(ticketmaster.city_explorer.get_geojson_data_async(**kw)))
+            sync_body = client.get('/places?' + query.decode()).get_data()
+
+    assert json.loads(async_body) == json.loads(sync_body)
+
+
+@needs_httpx
+def test_async_geoapify_requests_share_the_in_flight_cap(monkeypatch):
+    monkeypatch.setattr(ticketmaster.geo, 'MAX_IN_FLIGHT_REQUESTS', 2)
+    in_flight = []
+    peak = []
+
+    async def handle(request):
+        in_flight.append(1)
+        peak.append(len(in_flight))
+        await asyncio.sleep(0.02)
+        in_flight.pop()
+        return httpx.Response(200, json={'type': 'FeatureCollection', 'features': []})
+
+    explorer = ticketmaster.geo.CityExplorer('test_api_key', coalesce=False, async_pool_size=7)
+    assert ticketmaster.city_explorer.async_pool_size == ticketmaster.ASYNC_POOL_SIZE
+    explorer.async_http = upstream.AsyncUpstreamClient('geoapify', transport=httpx.MockTransport(handle))
+
+    async def run():
+        try:
+            return await explorer.get_geojson_data_async(
+                {'name': 'Venue', 'lat': 30.2672, 'lon': -97.7431},
+                ['restaurants', 'bars', 'cafes', 'shopping', 'attractions'])
+        finally:
+            await explorer.async_http.aclose()
+
+    asyncio.run(run())
+    assert len(peak) == 5
+    assert max(peak) == 2
+
+
+@needs_httpx
+def test_async_client_retries_and_maps_errors():
+    attempts = []
+
+    def handle(request):
+        attempts.append(1)
+        if len(attempts) == 1:
+            return httpx.Response(503)
+        raise httpx.ConnectError("refused")
+
+    client = upstream.AsyncUpstreamClient('stub', transport=httpx.MockTransport(handle), max_retries=2,
+                                          backoff_base=0.001)
+
+    async def run():
+        try:
+            with pytest.raises(upstream.requests.ConnectionError):
+                await client.get('https://stub.test/')
+        finally:
+            await client.aclose()
+
+    asyncio.run(run())
+    assert len(attempts) == 3
+    assert client.stats()['retries'] == 2
@@ -0,0 +1,227 @@
+import os
+import json
+import time
+import tempfile
+import unittest
+from unittest.mock import patch, Mock
+
+import geoapify as geo
+import geometry
+from cache import EventCache, MemoryCache, PlaceCache, SQLiteCache
+
+
+def make_place(place_id, lat, lon, distance=0):
+    return geo.PlaceResult(
+        id=place_id, name=place_id, category='catering.restaurant', subcategory='catering.restaurant',
+        lat=lat, lon=lon, address='', distance=distance, categories=['catering', 'catering.restaurant']
+    )
+
+
+class TestMemoryCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = MemoryCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        # b was least recently used
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_ttl_expiry(self):
+        cache = MemoryCache()
+        cache.set('a', 1, ttl=0.01)
+        time.sleep(0.02)
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['expirations'], 1)
+        self.assertEqual(cache.keys(), [])
+
+
+class TestSQLiteCache(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'cache.db')
+
+    def open(self, **kwargs):
+        cache = SQLiteCache(self.path, **kwargs)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_workers_share_entries(self):
+        # two handles on one file stand in for two worker processes
+        first, second = self.open(), self.open()
+        first.set('places:a', {'x': [1, 2]})
+
+        self.assertEqual(second.get('places:a'), {'x': [1, 2]})
+        self.assertEqual(second.keys('places:'), ['places:a'])
+        second.delete('places:a')
+        self.assertIsNone(first.get('places:a'))
+
+    def test_entries_survive_reopening(self):
+        cache = self.open()
+        cache.set('a', 1)
+        cache.close()
+
+        self.assertEqual(self.open().get('a'), 1)
+
+    def test_ttl_expiry(self):
+        cache = self.open()
+        cache.set('a', 1, ttl=0.01)
+        time.sleep(0.02)
+
+        self.assertEqual(cache.keys(), [])
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['expirations'], 1)
+        self.assertEqual(len(cache), 0)
+
+    def test_least_recently_read_is_evicted(self):
+        cache = self.open(max_entries=2)
+        cache.set('a', 1)
+        time.sleep(0.002)
+        cache.set('b', 2)
+        time.sleep(0.002)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertIsNone(cache.peek('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_tables_are_separate(self):
+        places, events = self.open(table='places'), self.open(table='events')
+        places.set('k', 'place')
+        events.set('k', 'event')
+
+        self.assertEqual(places.get('k'), 'place')
+        self.assertEqual(events.get('k'), 'event')
+        with self.assertRaises(ValueError):
+            SQLiteCache(self.path, table='places; drop')
+
+    def test_place_cache_sees_other_workers_entries(self):
+        lat, lon = 40.7505, -73.9934
+        categories = ['catering.restaurant']
+        PlaceCache(self.open()).store_places(lat, lon, categories, 1000, 10, [make_place('near', lat + 0.0009, lon)])
+
+        # containment lookups find entries another process stored
+        places = PlaceCache(self.open()).lookup(lat + 0.0002, lon, categories, 300, 10)
+        self.assertEqual([p.id for p in places], ['near'])
+
+    def test_event_cache_on_shared_store(self):
+        first, other = EventCache(self.open(), ttl=60), EventCache(self.open(), ttl=60)
+        self.addCleanup(first.close)
+        self.addCleanup(other.close)
+        first.get('Paris', 10, lambda: [{'id': 'e1'}])
+
+        self.assertEqual(other.get('Paris', 10, lambda: self.fail("fetched again")), [{'id': 'e1'}])
+
+
+class TestPlaceCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = PlaceCache()
+        self.lat, self.lon = 40.7505, -73.9934
+        self.categories = ['catering.restaurant', 'catering.fast_food']
+
+        # places roughly 100m, 400m and 900m north of the venue
+        self.places = [
+            make_place('near', self.lat + 0.0009, self.lon),
+            make_place('mid', self.lat + 0.0036, self.lon),
+            make_place('far', self.lat + 0.0081, self.lon),
+        ]
+
+    def test_exact_hit(self):
+        self.cache.store_places(self.lat, self.lon, self.categories, 1000, 10, self.places)
+
+        # category order does not matter
+        places = self.cache.lookup(self.lat, self.lon, list(reversed(self.categories)), 1000, 10)
+
+        self.assertEqual([p.id for p in places], ['near', 'mid', 'far'])
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_smaller_radius_is_served_by_containment(self):
+        self.cache.store_places(self.lat, self.lon, self.categories, 1000, 10, self.places)
+
+        # a nearby center with a smaller circle still fits inside the cached search
+        lat = self.lat + 0.0005
+        places = self.cache.lookup(lat, self.lon, self.categories, 300, 10)
+
+        self.assertEqual([p.id for p in places], ['near'])
+        self.assertEqual(places[0].distance, int(geometry.haversine_m(lat, self.lon, *self._coords('near'))))
+        self.assertEqual(self.cache.stats()['containment_hits'], 1)
+
+    def test_truncated_entry_only_covers_farthest_place(self):
+        # limit reached, so nothing is known beyond the farthest returned place
+        self.cache.store_places(self.lat, self.lon, self.categories, 1500, 3, self.places)
+
+        self.assertIsNotNone(self.cache.lookup(self.lat, self.lon, self.categories, 800, 3))
+        self.assertIsNone(self.cache.lookup(self.lat, self.lon, self.categories, 1200, 3))
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_scanned_entries_are_not_promoted(self):
+        store = MemoryCache(max_entries=2)
+        cache = PlaceCache(store)
+        cache.store_places(self.lat, self.lon, self.categories, 200, 10, self.places[:1])
+        cache.store_places(self.lat + 0.001, self.lon, self.categories, 200, 10, self.places[:1])
+
+        # both entries sit in the scanned tile but neither contains this circle
+        self.assertIsNone(cache.lookup(self.lat + 0.0005, self.lon, self.categories, 900, 10))
+        self.assertEqual(store.stats()['hits'], 0)
+
+        # so the oldest entry is still the one evicted
+        cache.store_places(self.lat + 0.002, self.lon, self.categories, 200, 10, self.places[:1])
+        self.assertIsNone(store.peek(cache._key(self.lat, self.lon, cache._category_key(self.categories), 200, 10)))
+        self.assertEqual(store.stats()['evictions'], 1)
+
+    def test_different_categories_miss(self):
+        self.cache.store_places(self.lat, self.lon, self.categories, 1000, 10, self.places)
+
+        self.assertIsNone(self.cache.lookup(self.lat, self.lon, ['catering.bar'], 500, 10))
+
+    @patch('upstream.requests.Session.get')
+    def test_explorer_skips_upstream_on_hit(self, mock_get):
+        mock_response = Mock()
+        mock_response.raise_for_status.return_value = None
+        mock_response.content = json.dumps({'features': []}).encode()
+        mock_get.return_value = mock_response
+
+        explorer = geo.CityExplorer('test_api_key', place_cache=self.cache)
+        location = {'lat': self.lat, 'lon': self.lon}
+        explorer.get_geojson_data(location, ['restaurants', 'bars'], radius=1000)
+        calls = mock_get.call_count
+        explorer.get_geojson_data(location, ['restaurants', 'bars'], radius=500)
+
+        self.assertEqual(mock_get.call_count, calls)
+
+    def _coords(self, place_id):
+        place = next(p for p in self.places if p.id == place_id)
+        return place.lat, place.lon
+
+
+class TestEventCache(unittest.TestCase):
+    def test_stale_listing_refreshes_in_background(self):
+        cache = EventCache(ttl=0, stale_ttl=60)
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            return [{'id': f'v{len(calls)}'}]
+
+        self.assertEqual(cache.get('Austin', 20, fetch), [{'id': 'v1'}])
+
+        # stale entry comes back at once while the refresh runs
+        self.assertEqual(cache.get('austin', 20, fetch), [{'id': 'v1'}])
+        for _ in range(50):
+            if cache.refreshes:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(cache.get('Austin', 20, fetch)[0]['id'], 'v2')
+        self.assertEqual(cache.stats()['misses'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import random
+import unittest
+
+from clustering import ClusterPyramid
+
+
+def make_feature(lat, lon, category='catering.restaurant', kind=None):
+    properties = {'id': f"{lat},{lon}", 'category': category}
+    if kind:
+        properties['type'] = kind
+    return {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [lon, lat]}, 'properties': properties}
+
+
+class TestClusterPyramid(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(3)
+        self.lat, self.lon = 40.7505, -73.9934
+        self.features = [
+            make_feature(self.lat + rng.uniform(-0.01, 0.01), self.lon + rng.uniform(-0.01, 0.01),
+                         rng.choice(['catering.restaurant', 'catering.bar']))
+            for _ in range(500)
+        ]
+        self.features.append(make_feature(self.lat, self.lon, 'event', kind='event'))
+        self.pyramid = ClusterPyramid(self.features)
+        self.bbox = (self.lon - 0.02, self.lat - 0.02, self.lon + 0.02, self.lat + 0.02)
+
+    def test_counts_add_up_at_every_zoom(self):
+        for zoom in (0, 10, 14, 17, 18):
+            features = self.pyramid.query(self.bbox, zoom)
+            places = sum(f['properties'].get('point_count', 1) for f in features
+                         if f['properties'].get('type') != 'event')
+            self.assertEqual(places, 500)
+
+    def test_zoomed_out_is_bounded(self):
+        features = self.pyramid.query(self.bbox, 10)
+        self.assertLess(len(features), 10)
+        cluster = next(f for f in features if f['properties'].get('cluster'))
+        self.assertEqual(sum(cluster['properties']['categories'].values()), cluster['properties']['point_count'])
+        self.assertGreater(cluster['properties']['expansion_zoom'], 10)
+
+    def test_event_marker_is_never_clustered(self):
+        features = self.pyramid.query(self.bbox, 0)
+        self.assertIn('event', [f['properties'].get('type') for f in features])
+
+    def test_bbox_filters(self):
+        east_only = (self.lon, self.lat - 0.02, self.lon + 0.02, self.lat + 0.02)
+        features = self.pyramid.query(east_only, 18)
+        self.assertTrue(all(f['geometry']['coordinates'][0] >= self.lon for f in features))
+        self.assertLess(len(features), 500)
+
+
+if __name__ == '__main__':
+    unittest.main()
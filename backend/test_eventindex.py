@@ -0,0 +1,81 @@
+import unittest
+
+from eventindex import EventIndex, tokenize
+
+
+def make_event(event_id, name, localdate='2025-08-01', segment='Music', genre='Rock', lat=30.2672, lng=-97.7431):
+    return {
+        'id': event_id, 'name': name, 'url': '', 'localdate': localdate, 'venue': 'Venue', 'address': '',
+        'city': 'Austin', 'lat': lat, 'lng': lng, 'segment': segment, 'genre': genre
+    }
+
+
+class TestEventIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = EventIndex()
+        self.index.add('Austin', [
+            make_event('e1', 'Taylor Swift Eras Tour', '2025-08-03'),
+            make_event('e2', 'Austin Jazz Festival', '2025-08-01', genre='Jazz', lat=30.30, lng=-97.70),
+            make_event('e3', 'Longhorns vs Aggies', '2025-09-10', segment='Sports', genre='Football',
+                       lat=30.2837, lng=-97.7326),
+            make_event('e4', 'Comedy Night', 'TBD', segment='Arts & Theatre', genre='Comedy')
+        ])
+
+    def ids(self, **filters):
+        return [e['id'] for e in self.index.search(**filters)['events']]
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize("Longhorns vs. Aggies!"), ['longhorns', 'vs', 'aggies'])
+
+    def test_everything_in_date_order(self):
+        self.assertEqual(self.ids(), ['e2', 'e1', 'e3', 'e4'])
+
+    def test_combined_filters(self):
+        self.assertEqual(self.ids(segments=['music']), ['e2', 'e1'])
+        self.assertEqual(self.ids(segments=['Music', 'Sports'], genres=['rock', 'football']), ['e1', 'e3'])
+        self.assertEqual(self.ids(city='austin', start='2025-08-02', end='2025-09-10'), ['e1', 'e3'])
+        self.assertEqual(self.ids(city='Dallas'), [])
+
+    def test_name_prefix_and_fuzzy(self):
+        self.assertEqual(self.ids(q='tay'), ['e1'])
+        self.assertEqual(self.ids(q='jazz fest'), ['e2'])
+        self.assertEqual(self.ids(q='longhrons'), ['e3'])
+        self.assertEqual(self.ids(q='lnghrons'), [])
+        self.assertEqual(self.ids(q='longhorn aggeis'), ['e3'])
+        self.assertEqual(self.ids(q='aggeis', fuzzy=False), [])
+
+    def test_near(self):
+        result = self.index.search(near=(30.2672, -97.7431), radius=3000)
+        self.assertEqual([e['id'] for e in result['events']], ['e1', 'e4', 'e3'])
+        self.assertEqual(result['events'][0]['distance'], 0)
+        self.assertGreater(result['events'][2]['distance'], 1000)
+
+    def test_pagination(self):
+        first = self.index.search(limit=3)
+        self.assertEqual(first['total'], 4)
+        self.assertEqual(first['next_offset'], 3)
+        second = self.index.search(offset=first['next_offset'], limit=3)
+        self.assertEqual([e['id'] for e in second['events']], ['e4'])
+        self.assertIsNone(second['next_offset'])
+
+    def test_updates_replace_the_previous_version(self):
+        self.index.add('Austin', [make_event('e1', 'Eras Tour Moved', '2025-10-01', lat=30.40, lng=-97.60)])
+
+        self.assertEqual(self.ids(q='taylor'), [])
+        self.assertEqual(self.ids(q='moved'), ['e1'])
+        self.assertEqual(self.ids(start='2025-10-01'), ['e1'])
+        self.assertNotIn('e1', self.ids(near=(30.2672, -97.7431), radius=3000))
+        self.assertEqual(self.index.stats()['events'], 4)
+
+    def test_oldest_seen_are_evicted(self):
+        index = EventIndex(max_events=2)
+        index.add('Austin', [make_event('a', 'One'), make_event('b', 'Two')])
+        index.add('Dallas', [make_event('c', 'Three')])
+
+        self.assertEqual([e['id'] for e in index.search()['events']], ['c', 'b'])
+        self.assertEqual(index.search(q='one')['total'], 0)
+        self.assertEqual(index.stats()['evicted'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,11 @@
+import json
+import time
+import threading
 import unittest
+import requests
 from unittest.mock import patch, Mock
 import geoapify as geo
+from arena import PlaceArena
 
 class TestCityExplorer(unittest.TestCase):
     def setUp(self):
@@ -34,11 +39,11 @@ class TestCityExplorer(unittest.TestCase):
             venue_id=venue.get('id', '')
         )
     
-    @patch('geoapify.requests.get')
+    @patch('upstream.requests.Session.get')
     def test_api_404_error(self, mock_get):
         mock_response = Mock()
         mock_response.status_code = 404
-        mock_response.raise_for_status.side_effect = Exception("404 Not Found")
+        mock_response.raise_for_status.side_effect = requests.HTTPError("404 Not Found")
         mock_get.return_value = mock_response
         
         results = self.explorer.search_places_near_event(self.event_location, 'restaurants')
@@ -46,12 +51,12 @@ class TestCityExplorer(unittest.TestCase):
         self.assertEqual(len(results), 0)
         mock_get.assert_called_once()
     
-    @patch('geoapify.requests.get')
+    @patch('upstream.requests.Session.get')
     def test_empty_api_response(self, mock_get):
         mock_response = Mock()
         mock_response.status_code = 200
         mock_response.raise_for_status.return_value = None
-        mock_response.json.return_value = {'features': []}
+        mock_response.content = json.dumps({'features': []}).encode()
         mock_get.return_value = mock_response
         
         results = self.explorer.search_places_near_event(self.event_location, 'restaurants')
@@ -67,12 +72,12 @@ class TestCityExplorer(unittest.TestCase):
         self.assertEqual(self.event_location.address, "4 Pennsylvania Plaza")
         self.assertEqual(self.event_location.venue_id, "KovZpZAJledA")
      
-    @patch('geoapify.requests.get')
+    @patch('upstream.requests.Session.get')
     def test_multiple_search_categories(self, mock_get):
         mock_response = Mock()
         mock_response.status_code = 200
         mock_response.raise_for_status.return_value = None
-        mock_response.json.return_value = {
+        mock_response.content = json.dumps({
             'features': [
                 {
                     'properties': {
@@ -87,7 +92,7 @@ class TestCityExplorer(unittest.TestCase):
                     }
                 }
             ]
-        }
+        }).encode()
         mock_get.return_value = mock_response
         
         geojson_data = self.explorer.get_geojson_data(self.event_location)
@@ -95,6 +100,260 @@ class TestCityExplorer(unittest.TestCase):
         # confirms categories and total places exists in geojson data
         self.assertIn('categories', geojson_data['properties'])
         self.assertIn('total_places', geojson_data['properties'])
-    
+
+        # the places stay in an arena until the collection is read or serialized
+        self.assertIsInstance(geojson_data['features'].arena, PlaceArena)
+        self.assertEqual(geojson_data['features'][1]['properties']['id'], 'place_789')
+
+    @patch('upstream.requests.Session.get')
+    def test_concurrent_category_search(self, mock_get):
+        active = {'now': 0, 'peak': 0}
+        lock = threading.Lock()
+
+        def slow_get(url, params=None, timeout=None):
+            with lock:
+                active['now'] += 1
+                active['peak'] = max(active['peak'], active['now'])
+            time.sleep(0.2)
+            with lock:
+                active['now'] -= 1
+            category = params['categories'].split(',')[0]
+            mock_response = Mock()
+            mock_response.raise_for_status.return_value = None
+            mock_response.content = json.dumps({
+                'features': [{
+                    'properties': {'place_id': category, 'name': category, 'categories': [category], 'distance': 10},
+                    'geometry': {'coordinates': [-73.99, 40.75]}
+                }]
+            }).encode()
+            return mock_response
+
+        mock_get.side_effect = slow_get
+        search_types = ['shopping', 'restaurants', 'bars', 'attractions']
+        explorer = geo.CityExplorer(self.api_key, coalesce=False)
+
+        start = time.perf_counter()
+        geojson_data = explorer.get_geojson_data(self.event_location, search_types)
+        elapsed = time.perf_counter() - start
+
+        # all four categories overlap instead of running back to back
+        self.assertLess(elapsed, 0.6)
+        self.assertGreater(active['peak'], 1)
+
+        # features and counts follow the requested order
+        ids = [f['properties']['id'] for f in geojson_data['features'][1:]]
+        self.assertEqual(ids, ['commercial.shopping_mall', 'catering.restaurant', 'catering.bar', 'tourism.attraction'])
+        self.assertEqual(list(geojson_data['properties']['categories']), search_types)
+
+    @patch('upstream.requests.Session.get')
+    def test_max_in_flight_requests(self, mock_get):
+        active = {'now': 0, 'peak': 0}
+        lock = threading.Lock()
+
+        def slow_get(url, params=None, timeout=None):
+            with lock:
+                active['now'] += 1
+                active['peak'] = max(active['peak'], active['now'])
+            time.sleep(0.05)
+            with lock:
+                active['now'] -= 1
+            mock_response = Mock()
+            mock_response.raise_for_status.return_value = None
+            mock_response.content = json.dumps({'features': []}).encode()
+            return mock_response
+
+        mock_get.side_effect = slow_get
+        geo.set_max_in_flight_requests(2)
+        try:
+            geo.CityExplorer(self.api_key, coalesce=False).get_geojson_data(self.event_location, ['restaurants', 'bars', 'cafes', 'shopping', 'attractions'])
+        finally:
+            geo.set_max_in_flight_requests(8)
+
+        self.assertLessEqual(active['peak'], 2)
+
+    @patch('upstream.requests.Session.get')
+    def test_pool_does_not_cap_below_in_flight_limit(self, mock_get):
+        active = {'now': 0, 'peak': 0}
+        lock = threading.Lock()
+
+        def slow_get(url, params=None, timeout=None):
+            with lock:
+                active['now'] += 1
+                active['peak'] = max(active['peak'], active['now'])
+            time.sleep(0.1)
+            with lock:
+                active['now'] -= 1
+            mock_response = Mock()
+            mock_response.raise_for_status.return_value = None
+            mock_response.content = json.dumps({'features': []}).encode()
+            return mock_response
+
+        mock_get.side_effect = slow_get
+        explorer = geo.CityExplorer(self.api_key, coalesce=False)
+        geo.set_max_in_flight_requests(64)
+        # 40 requests at once, this is about the in flight cap not the rate limiter
+        limiter, explorer.http.limiter = explorer.http.limiter, None
+        try:
+            threads = [
+                threading.Thread(target=explorer.get_geojson_data,
+                                 args=(self.event_location, ['restaurants', 'bars', 'cafes', 'shopping']))
+                for _ in range(10)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            explorer.http.limiter = limiter
+            geo.set_max_in_flight_requests(8)
+
+        # 40 upstream calls, only the semaphore should limit them
+        self.assertGreater(active['peak'], 8)
+
+    @patch('upstream.requests.Session.get')
+    def test_deadline_returns_partial_results(self, mock_get):
+        def get(url, params=None, timeout=None):
+            # bars never answer within the budget
+            if 'catering.bar' in params['categories']:
+                time.sleep(0.5)
+            mock_response = Mock()
+            mock_response.status_code = 200
+            mock_response.raise_for_status.return_value = None
+            mock_response.content = json.dumps({
+                'features': [{
+                    'properties': {'place_id': params['categories'], 'name': 'Place',
+                                   'categories': params['categories'].split(','), 'distance': 10},
+                    'geometry': {'coordinates': [-73.99, 40.75]}
+                }]
+            }).encode()
+            return mock_response
+
+        mock_get.side_effect = get
+        explorer = geo.CityExplorer(self.api_key, coalesce=False)
+
+        start = time.perf_counter()
+        with geo.upstream.deadline(0.2):
+            geojson_data = explorer.get_geojson_data(self.event_location, ['restaurants', 'bars'])
+        self.assertLess(time.perf_counter() - start, 0.45)
+
+        properties = geojson_data['properties']
+        self.assertTrue(properties['partial'])
+        self.assertEqual(properties['missing_categories'], ['bars'])
+        self.assertEqual(properties['categories'], {'restaurants': 1, 'bars': 0})
+
+        with geo.upstream.deadline(0.2):
+            summary = list(explorer.iter_geojson(self.event_location, ['restaurants', 'bars']))[-1]
+        self.assertEqual(summary[1]['missing_categories'], ['bars'])
+
+    def test_plan_queries_merges_types(self):
+        groups = self.explorer.plan_queries(['restaurants', 'bars', 'entertainment', 'attractions'], 15)
+
+        # restaurants are dense enough to get their own call, the sparse types share one
+        self.assertEqual([g.search_types for g in groups], [['restaurants'], ['bars', 'entertainment', 'attractions']])
+        self.assertIn('tourism.sights', groups[1].categories)
+        self.assertEqual(groups[1].limit, 3 * 15 * geo.COALESCE_OVERSAMPLE)
+
+        # overlapping dense types share a call, groups stay under the upstream cap
+        groups = self.explorer.plan_queries(['restaurants', 'all_dining', 'bars', 'cafes', 'shopping'], 40)
+        self.assertEqual([g.search_types for g in groups],
+                         [['restaurants', 'all_dining'], ['bars', 'shopping'], ['cafes']])
+        self.assertTrue(all(g.limit <= geo.MAX_GROUP_LIMIT for g in groups))
+
+    @patch('upstream.requests.Session.get')
+    def test_coalesced_search_partitions_and_dedupes(self, mock_get):
+        def feature(place_id, categories, distance):
+            return {
+                'properties': {'place_id': place_id, 'name': place_id, 'categories': categories, 'distance': distance},
+                'geometry': {'coordinates': [-73.99, 40.75]}
+            }
+
+        mock_response = Mock()
+        mock_response.raise_for_status.return_value = None
+        mock_response.content = json.dumps({
+            'features': [
+                feature('r1', ['catering', 'catering.restaurant'], 10),
+                feature('b1', ['catering', 'catering.bar'], 20),
+                feature('r2', ['catering', 'catering.restaurant.pizza'], 30),
+                feature('r3', ['catering', 'catering.restaurant'], 40),
+                feature('r1', ['catering', 'catering.restaurant'], 10),
+            ]
+        }).encode()
+        mock_get.return_value = mock_response
+
+        geojson_data = self.explorer.get_geojson_data(
+            self.event_location, ['restaurants', 'bars', 'all_dining'], limit_per_category=2
+        )
+
+        self.assertEqual(mock_get.call_count, 2)
+        ids = [f['properties']['id'] for f in geojson_data['features'][1:]]
+        self.assertEqual(ids, ['r1', 'r2', 'b1', 'r3'])
+        self.assertEqual(geojson_data['properties']['categories'], {'restaurants': 2, 'bars': 1, 'all_dining': 1})
+
+    @patch('upstream.requests.Session.get')
+    def test_saturated_dense_area_needs_no_top_ups(self, mock_get):
+        def dense_get(url, params=None, timeout=None):
+            limit = params['limit']
+            if 'catering.restaurant' in params['categories']:
+                features = [('r%d' % i, ['catering.restaurant'], i) for i in range(limit)]
+            else:
+                features = [('b1', ['catering.bar'], 5), ('b2', ['catering.pub'], 15),
+                            ('m1', ['entertainment.culture'], 25), ('a1', ['tourism.attraction'], 35)]
+            mock_response = Mock()
+            mock_response.raise_for_status.return_value = None
+            mock_response.content = json.dumps({'features': [
+                {'properties': {'place_id': pid, 'name': pid, 'categories': cats, 'distance': d},
+                 'geometry': {'coordinates': [-73.99, 40.75]}}
+                for pid, cats, d in features
+            ]}).encode()
+            return mock_response
+
+        mock_get.side_effect = dense_get
+        geojson_data = self.explorer.get_geojson_data(
+            self.event_location, ['restaurants', 'bars', 'entertainment', 'attractions'], limit_per_category=5
+        )
+
+        # the restaurant flood stays in its own call, so nothing is crowded out
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertEqual(geojson_data['properties']['categories'],
+                         {'restaurants': 5, 'bars': 2, 'entertainment': 1, 'attractions': 1})
+
+    @patch('upstream.requests.Session.get')
+    def test_dedup_shortfall_is_not_topped_up(self, mock_get):
+        mock_response = Mock()
+        mock_response.raise_for_status.return_value = None
+        # a full response that only holds three distinct places
+        mock_response.content = json.dumps({'features': [
+            {'properties': {'place_id': 'r%d' % (i % 3), 'name': 'r', 'categories': ['catering.restaurant'],
+                            'distance': i % 3},
+             'geometry': {'coordinates': [-73.99, 40.75]}}
+            for i in range(8)
+        ]}).encode()
+        mock_get.return_value = mock_response
+
+        geojson_data = self.explorer.get_geojson_data(
+            self.event_location, ['restaurants', 'all_dining'], limit_per_category=2
+        )
+
+        mock_get.assert_called_once()
+        self.assertEqual(geojson_data['properties']['categories'], {'restaurants': 2, 'all_dining': 1})
+
+    def test_parse_places_from_bytes(self):
+        body = json.dumps({'features': [
+            {'properties': {'place_id': 'p1', 'name': 'Pub', 'categories': ['catering', 'catering.pub'],
+                            'distance': 20, 'contact': {'phone': '555'},
+                            'datasource': {'raw': {'rating': 'n/a', 'stars': '4'}}},
+             'geometry': {'coordinates': [-73.99, 40.75]}},
+            {'properties': {'place_id': 'p2', 'categories': ['commercial']},
+             'geometry': {'coordinates': [-73.99]}},
+        ]}).encode()
+
+        places = geo.parse_places(body)
+
+        self.assertEqual(len(places), 1)
+        self.assertEqual((places[0].subcategory, places[0].phone, places[0].rating), ('catering.pub', '555', 4.0))
+        self.assertEqual(geo.marker_style(places[0].subcategory), ('purple', 'beer'))
+        self.assertEqual(geo.marker_style('natural.beach'), geo.DEFAULT_MARKER_STYLE)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
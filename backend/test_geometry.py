@@ -0,0 +1,90 @@
+import math
+import unittest
+
+import numpy as np
+
+import geoapify as geo
+import geometry
+
+
+def make_place(place_id, lat, lon, rating=None, category='catering.restaurant'):
+    return geo.PlaceResult(
+        id=place_id, name=place_id, category=category, subcategory=category,
+        lat=lat, lon=lon, address='', distance=0, rating=rating
+    )
+
+
+class TestGeometry(unittest.TestCase):
+    def test_haversine_many_matches_scalar(self):
+        lats = [40.7505, 40.76, 51.5, -33.86]
+        lons = [-73.9934, -73.98, -0.12, 151.2]
+
+        distances = geometry.haversine_many(40.7505, -73.9934, lats, lons)
+
+        for d, lat, lon in zip(distances, lats, lons):
+            self.assertAlmostEqual(d, geometry.haversine_m(40.7505, -73.9934, lat, lon), places=3)
+        self.assertEqual(distances[0], 0)
+
+    def test_pairwise_matrix(self):
+        matrix = geometry.pairwise_haversine([40.75, 40.76, 40.77], [-73.99, -73.98, -73.97])
+
+        self.assertEqual(matrix.shape, (3, 3))
+        self.assertTrue(np.allclose(matrix, matrix.T))
+        self.assertAlmostEqual(matrix[0, 2], geometry.haversine_m(40.75, -73.99, 40.77, -73.97), places=3)
+
+    def test_cluster_points(self):
+        lats = [40.7505, 40.7510, 40.7600, 40.7505]
+        lons = [-73.9934, -73.9934, -73.9934, -73.9930]
+
+        self.assertEqual(geometry.cluster_points(lats, lons, 100), [0, 0, 1, 0])
+        self.assertEqual(geometry.cluster_points(lats, lons, 10), [0, 1, 2, 3])
+        self.assertEqual(geometry.cluster_points([], [], 100), [])
+
+    def test_bounding_box_spans_the_radius(self):
+        for lat in (0.0, 40.7505, 60.0, -33.86):
+            box = geometry.bounding_box(lat, 10.0, 1000)
+
+            width = geometry.haversine_m(lat, box['west'], lat, box['east'])
+            height = geometry.haversine_m(box['south'], 10.0, box['north'], 10.0)
+            self.assertAlmostEqual(width, 2000, delta=20)
+            self.assertAlmostEqual(height, 2000, delta=20)
+
+    def test_explorer_bounds_use_cosine_latitude(self):
+        bounds = geo.CityExplorer('key')._calculate_bounds(40.7505, -73.9934, 1000)
+
+        self.assertAlmostEqual(bounds['east'] - (-73.9934), 1000 / (111320 * math.cos(math.radians(40.7505))))
+
+    def test_rank_places(self):
+        places = [
+            make_place('far_rated', 40.7585, -73.9934, rating=5),
+            make_place('near', 40.7510, -73.9934),
+            make_place('mid', 40.7540, -73.9934, category='tourism.attraction'),
+        ]
+
+        nearest = geometry.rank_places(places, 40.7505, -73.9934, 1000)
+        self.assertEqual([p.id for p in nearest], ['near', 'mid', 'far_rated'])
+
+        by_rating = geometry.rank_places(places, 40.7505, -73.9934, 1000, rating_weight=1.0)
+        self.assertEqual(by_rating[0].id, 'far_rated')
+
+        by_category = geometry.rank_places(places, 40.7505, -73.9934, 1000,
+                                           category_scores={'tourism.attraction': 1.0})
+        self.assertEqual(by_category[0].id, 'mid')
+
+    def test_parser_measures_distance_when_upstream_omits_it(self):
+        explorer = geo.CityExplorer('key')
+        response = {'features': [
+            {'properties': {'place_id': 'b', 'categories': ['catering.bar']},
+             'geometry': {'coordinates': [-73.9934, 40.7545]}},
+            {'properties': {'place_id': 'a', 'categories': ['catering.bar']},
+             'geometry': {'coordinates': [-73.9934, 40.7515]}},
+        ]}
+
+        places = explorer._parse_api_response(response, center=(40.7505, -73.9934))
+
+        self.assertEqual([p.id for p in places], ['a', 'b'])
+        self.assertAlmostEqual(places[0].distance, 111, delta=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import time
+import unittest
+
+import metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_histogram_exposition(self):
+        latency = self.registry.histogram('test_seconds', 'latency', buckets=(0.1, 1.0))
+        latency.observe(0.05, endpoint='/places')
+        latency.observe(0.5, endpoint='/places')
+        latency.observe(5, endpoint='/places')
+
+        text = self.registry.render()
+        self.assertIn('# TYPE test_seconds histogram', text)
+        self.assertIn('test_seconds_bucket{endpoint="/places",le="0.1"} 1', text)
+        self.assertIn('test_seconds_bucket{endpoint="/places",le="1.0"} 2', text)
+        self.assertIn('test_seconds_bucket{endpoint="/places",le="+Inf"} 3', text)
+        self.assertIn('test_seconds_count{endpoint="/places"} 3', text)
+
+    def test_counters_and_collectors(self):
+        errors = self.registry.counter('test_errors', 'errors')
+        errors.inc(upstream='geoapify', error='ReadTimeout')
+        errors.inc(upstream='geoapify', error='ReadTimeout')
+        self.registry.add_collector(lambda: [('test_hit_ratio', {'cache': 'place'}, 0.75)])
+
+        text = self.registry.render()
+        self.assertIn('test_errors_total{error="ReadTimeout",upstream="geoapify"} 2', text)
+        self.assertIn('test_hit_ratio{cache="place"} 0.75', text)
+
+    def test_stage_timings_for_the_current_request(self):
+        metrics.start_request()
+        with metrics.stage('parse'):
+            time.sleep(0.01)
+        with metrics.stage('parse'):
+            pass
+
+        stages = metrics.request_stages()
+        self.assertGreaterEqual(stages['parse'], 0.01)
+        self.assertTrue(metrics.server_timing(stages, 0.02).endswith('total;dur=20.0'))
+
+    def test_sampling_profiler(self):
+        profiler = metrics.SamplingProfiler(interval=0.001)
+        profiler.start()
+        deadline = time.time() + 0.1
+        while time.time() < deadline:
+            sum(range(1000))
+        profiler.stop()
+
+        report = profiler.report()
+        self.assertFalse(report['running'])
+        self.assertGreater(report['samples'], 0)
+        self.assertTrue(any('test_metrics.py' in entry['stack'] for entry in report['top']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import json
+import os
+import time
+import random
+import tempfile
+import unittest
+from unittest.mock import patch, Mock
+
+import geoapify as geo
+from placestore import PlaceStore
+
+SAMPLE_PATH = os.path.join(os.path.dirname(__file__), 'sample_text.txt')
+
+
+def make_place(place_id, lat, lon, categories=('catering', 'catering.restaurant')):
+    return geo.PlaceResult(
+        id=place_id, name=place_id, category=categories[0], subcategory=categories[-1],
+        lat=lat, lon=lon, address='', distance=0, categories=list(categories)
+    )
+
+
+class TestPlaceStore(unittest.TestCase):
+    def setUp(self):
+        self.lat, self.lon = 40.7505, -73.9934
+        self.store = PlaceStore()
+        self.store.add_places([
+            make_place('near', self.lat + 0.0009, self.lon),
+            make_place('bar', self.lat - 0.0018, self.lon, ('catering', 'catering.bar')),
+            make_place('far', self.lat + 0.0180, self.lon),
+        ])
+
+    def test_radius_and_category_query(self):
+        places = self.store.query(self.lat, self.lon, 500)
+        self.assertEqual([p.id for p in places], ['near', 'bar'])
+        self.assertEqual(places[0].distance, 100)
+
+        places = self.store.query(self.lat, self.lon, 500, categories=['catering.bar'])
+        self.assertEqual([p.id for p in places], ['bar'])
+
+        self.assertEqual(len(self.store.query(self.lat, self.lon, 3000, limit=2)), 2)
+
+    def test_coverage(self):
+        self.assertFalse(self.store.covers(self.lat, self.lon, ['catering.restaurant'], 500))
+
+        self.store.record_coverage(self.lat, self.lon, ['catering.restaurant', 'catering.bar'], 1000)
+        self.assertTrue(self.store.covers(self.lat + 0.001, self.lon, ['catering.restaurant'], 500))
+        self.assertFalse(self.store.covers(self.lat, self.lon, ['catering.restaurant'], 1500))
+        self.assertFalse(self.store.covers(self.lat, self.lon, ['tourism.sights'], 500))
+
+        # old coverage no longer counts
+        self.store.record_coverage(self.lat, self.lon, ['tourism.sights'], 1000, fetched_at=time.time() - 30 * 86400)
+        self.assertFalse(self.store.covers(self.lat, self.lon, ['tourism.sights'], 500))
+
+    def test_persists_to_sqlite(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'places.db')
+            store = PlaceStore(path)
+            store.add_places([make_place('near', self.lat, self.lon)])
+            store.record_coverage(self.lat, self.lon, ['catering.restaurant'], 800)
+            store.close()
+
+            reopened = PlaceStore(path)
+            self.assertEqual(len(reopened), 1)
+            self.assertTrue(reopened.covers(self.lat, self.lon, ['catering.restaurant'], 500))
+            reopened.close()
+
+    def test_bulk_load_sample_dump(self):
+        store = PlaceStore()
+        loaded = store.load_geojson(SAMPLE_PATH)
+
+        # the event marker is skipped
+        self.assertEqual(loaded, 50)
+        shops = store.query(self.lat, self.lon, 1000, categories=['commercial'])
+        self.assertTrue(shops)
+        self.assertTrue(all(p.category.startswith('commercial') for p in shops))
+
+    def test_radius_query_over_many_places(self):
+        rng = random.Random(7)
+        store = PlaceStore()
+        store.add_places([
+            make_place(str(i), self.lat + rng.uniform(-0.5, 0.5), self.lon + rng.uniform(-0.5, 0.5))
+            for i in range(200000)
+        ])
+
+        start = time.perf_counter()
+        for _ in range(100):
+            store.query(self.lat + rng.uniform(-0.3, 0.3), self.lon + rng.uniform(-0.3, 0.3), 500)
+        per_query = (time.perf_counter() - start) / 100
+
+        self.assertLess(per_query, 0.005)
+
+    @patch('upstream.requests.Session.get')
+    def test_explorer_answers_covered_areas_from_store(self, mock_get):
+        mock_response = Mock()
+        mock_response.raise_for_status.return_value = None
+        mock_response.content = json.dumps({'features': [
+            {'properties': {'place_id': 'r1', 'name': 'r1', 'categories': ['catering', 'catering.restaurant'],
+                            'distance': 50},
+             'geometry': {'coordinates': [self.lon, self.lat + 0.0005]}}
+        ]}).encode()
+        mock_get.return_value = mock_response
+
+        store = PlaceStore()
+        explorer = geo.CityExplorer('test_api_key', place_store=store, store_first=True)
+        first = explorer.search_places_near_event({'lat': self.lat, 'lon': self.lon}, 'restaurants', 1000, 10)
+        second = explorer.search_places_near_event({'lat': self.lat, 'lon': self.lon}, 'restaurants', 600, 10)
+
+        mock_get.assert_called_once()
+        self.assertEqual([p.id for p in first], ['r1'])
+        self.assertEqual([p.id for p in second], ['r1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import unittest
+from datetime import datetime
+
+import geoapify as geo
+import planner
+
+VENUE = (40.7505, -73.9934)
+# a Friday
+EVENT = datetime(2025, 8, 1, 20, 0)
+
+
+def make_place(place_id, lat, lon, opening_hours=None, category='catering.restaurant'):
+    return geo.PlaceResult(
+        id=place_id, name=place_id, category=category, subcategory=category,
+        lat=lat, lon=lon, address='', distance=0, opening_hours=opening_hours
+    )
+
+
+class TestOpeningHours(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(planner.parse_opening_hours('24/7'), [(0, planner.WEEK)])
+        self.assertEqual(planner.parse_opening_hours('Sa 10:00-14:00,16:00-20:00; Su off'),
+                         [(5 * 1440 + 600, 5 * 1440 + 840), (5 * 1440 + 960, 5 * 1440 + 1200)])
+        # a later rule replaces the earlier one for its days, past midnight runs into the next day
+        hours = planner.parse_opening_hours('Mo-Su 11:00-23:00; Fr-Sa 11:00-02:00')
+        self.assertIn((4 * 1440 + 660, 5 * 1440 + 120), hours)
+        self.assertEqual(len(hours), 7)
+
+    def test_unparseable_is_none(self):
+        for text in (None, '', 'sunrise-sunset', 'Mo-Fr 09:00-17:00 "by appointment"', {'Mo': '9-5'}):
+            self.assertIsNone(planner.parse_opening_hours(text))
+
+    def test_is_open(self):
+        hours = planner.parse_opening_hours('Fr-Su 18:00-02:00')
+        friday_night = planner.minute_of_week(EVENT)
+        self.assertTrue(planner.is_open(hours, friday_night, friday_night + 300))
+        self.assertFalse(planner.is_open(hours, friday_night, friday_night + 400))
+        # sunday's hours run past the end of the week into monday
+        self.assertTrue(planner.is_open(hours, planner.WEEK - 60, planner.WEEK + 60))
+        self.assertFalse(planner.is_open(hours, 3 * 1440 + 1200, 3 * 1440 + 1260))
+        self.assertTrue(planner.is_open(None, 0, 10))
+
+    def test_parse_event_time(self):
+        self.assertEqual(planner.parse_event_time('2025-08-01'), datetime(2025, 8, 1, 19, 0))
+        self.assertEqual(planner.parse_event_time('2025-08-01T20:30:00Z'), datetime(2025, 8, 1, 20, 30))
+        with self.assertRaises(ValueError):
+            planner.parse_event_time('tonight')
+
+
+class TestPlanRoute(unittest.TestCase):
+    def test_nearest_open_stops_in_time(self):
+        before = {
+            'restaurants': [
+                # closest, but shut on fridays
+                make_place('closed', 40.7507, -73.9934, 'Mo-Th 11:00-22:00'),
+                make_place('open', 40.7525, -73.9934, 'Mo-Su 11:00-22:00'),
+                make_place('far', 40.7700, -73.9934)
+            ]
+        }
+        after = {
+            'bars': [make_place('bar', 40.7515, -73.9934, 'Mo-Su 18:00-03:00')],
+            'cafes': [make_place('early', 40.7506, -73.9934, 'Mo-Su 07:00-18:00')]
+        }
+        plan = planner.plan_route(VENUE, EVENT, 180, before, after)
+
+        self.assertEqual([stop['place']['id'] for stop in plan['before']], ['open'])
+        self.assertLessEqual(plan['before'][0]['depart'], '2025-08-01T19:45')
+        self.assertEqual([stop['place']['id'] for stop in plan['after']], ['bar'])
+        self.assertGreaterEqual(plan['after'][0]['arrive'], '2025-08-01T23:00')
+        self.assertEqual(plan['unplanned'], ['cafes'])
+        self.assertEqual(plan['candidates'], 5)
+        legs = [stop['walk_m'] for stop in plan['before'] + plan['after']]
+        legs += [plan['before_return_walk_m'], plan['after_return_walk_m']]
+        # each leg is rounded down on its own
+        self.assertAlmostEqual(plan['walk_m'], sum(legs), delta=len(legs))
+
+    def test_order_with_least_walking(self):
+        # a, b and c are the corners of a square with the venue, taking them in the given order crosses over
+        after = {
+            'bars': [make_place('a', 40.7525, -73.9934)],
+            'cafes': [make_place('c', 40.7505, -73.99076)],
+            'shopping': [make_place('b', 40.7525, -73.99076)]
+        }
+        plan = planner.plan_route(VENUE, EVENT, 120, {}, after)
+
+        self.assertIn([stop['place']['id'] for stop in plan['after']], (['a', 'b', 'c'], ['c', 'b', 'a']))
+        self.assertLess(plan['walk_m'], 900)
+        self.assertGreater(plan['after'][1]['arrive'], plan['after'][0]['depart'])
+
+    def test_type_on_both_sides_visits_different_places(self):
+        bars = [make_place('near', 40.7510, -73.9934), make_place('next', 40.7520, -73.9934)]
+        plan = planner.plan_route(VENUE, EVENT, 120, {'bars': bars}, {'bars': bars})
+
+        self.assertEqual([stop['place']['id'] for stop in plan['before']], ['near'])
+        self.assertEqual([stop['place']['id'] for stop in plan['after']], ['next'])
+
+        # with a single candidate the second visit is left unplanned
+        plan = planner.plan_route(VENUE, EVENT, 120, {'bars': bars[:1]}, {'bars': bars[:1]})
+        self.assertEqual(len(plan['before']) + len(plan['after']), 1)
+        self.assertEqual(plan['unplanned'], ['bars'])
+
+    def test_time_limit(self):
+        after = {search_type: [make_place(f'{search_type}{i}', 40.75 + i * 0.001, -73.99) for i in range(3)]
+                 for search_type in ('bars', 'cafes', 'restaurants', 'shopping', 'attractions', 'entertainment',
+                                     'all_dining', 'pubs')}
+        plan = planner.plan_route(VENUE, EVENT, 60, {}, after, time_limit=0)
+
+        self.assertTrue(plan['timed_out'])
+        self.assertEqual(len(plan['after']) + len(plan['unplanned']), 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
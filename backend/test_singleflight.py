@@ -0,0 +1,87 @@
+import time
+import threading
+import unittest
+
+from singleflight import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        self.flight = SingleFlight()
+
+    def run_concurrently(self, key, fn, callers=5):
+        results = []
+        errors = []
+
+        def call():
+            try:
+                results.append(self.flight.do(key, fn))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.01)
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_concurrent_calls_share_one_execution(self):
+        executions = []
+
+        def compute():
+            executions.append(1)
+            time.sleep(0.2)
+            return {'features': []}
+
+        results, errors = self.run_concurrently('places', compute)
+
+        self.assertEqual(len(executions), 1)
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(r is results[0] for r in results))
+        stats = self.flight.stats()
+        self.assertEqual(stats['coalesced'], 4)
+        self.assertEqual(stats['max_waiters'], 4)
+        self.assertEqual(stats['in_flight'], 0)
+
+    def test_errors_reach_every_waiter(self):
+        def compute():
+            time.sleep(0.1)
+            raise ValueError("upstream down")
+
+        results, errors = self.run_concurrently('places', compute, callers=3)
+
+        self.assertEqual(results, [])
+        self.assertEqual(len(errors), 3)
+
+    def test_finished_calls_are_not_reused(self):
+        calls = []
+        self.flight.do('a', lambda: calls.append(1))
+        self.flight.do('a', lambda: calls.append(1))
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.flight.stats()['executions'], 2)
+
+    def test_waiters_can_turn_down_a_result(self):
+        executions = []
+
+        def compute():
+            executions.append(1)
+            time.sleep(0.1)
+            return {'partial': len(executions) == 1}
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(self.flight.do('places', compute)))
+        leader.start()
+        time.sleep(0.02)
+        results.append(self.flight.do('places', compute, reuse=lambda data: not data['partial']))
+        leader.join()
+
+        self.assertEqual(len(executions), 2)
+        self.assertEqual(sorted(r['partial'] for r in results), [False, True])
+        self.assertEqual(self.flight.stats()['rejected'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,34 @@
+import gzip
+import json
+import time
 import pytest
+import requests
+import ticketmaster
+import upstream
 from ticketmaster import app
+from cache import EventCache
 from unittest.mock import patch, Mock
 
 @pytest.fixture
-def client():
-    app.config['TESTING'] = True
+def event_cache(monkeypatch):
+    # each test gets its own cache, shut down and swapped back out afterwards
+    caches = []
+
+    def install(**options):
+        cache = EventCache(**options)
+        caches.append(cache)
+        monkeypatch.setattr(ticketmaster, 'event_cache', cache)
+        return cache
+
+    install(ttl=300, stale_ttl=3600)
+    yield install
+    for cache in caches:
+        cache.close()
+
+@pytest.fixture
+def client(monkeypatch, event_cache):
+    monkeypatch.setitem(app.config, 'TESTING', True)
+    monkeypatch.setattr(ticketmaster.ticketmaster_client, 'backoff_base', 0)
     with app.test_client() as client:
         yield client
 
@@ -13,60 +37,421 @@ def mock_ticketmaster_response(events=True):
         "_embedded": {
             "events": [
                 {
+                    "id": "evt1",
                     "name": "Concert A",
                     "url": "https://example.com/eventA",
-                    "dates": {"start": {"dateTime": "2025-08-01T20:00:00Z"}},
+                    "dates": {"start": {"localDate": "2025-08-01", "dateTime": "2025-08-01T20:00:00Z"}},
+                    "classifications": [{"segment": {"name": "Music"}, "genre": {"name": "Rock"}}],
                     "_embedded": {
                         "venues": [
                             {
                                 "name": "Stadium X",
+                                "address": {"line1": "1 Main St"},
+                                "city": {"name": "Austin"},
                                 "location": {"latitude": "40.7128", "longitude": "-74.0060"}
                             }
                         ]
-                    },
-                    "distance": 3.5
+                    }
+                },
+                {
+                    "id": "evt2",
+                    "name": "Missing Venue",
+                    "dates": {"start": {}}
                 }
             ]
         }
     } if events else {}
 
-@patch('app.requests.get')
-def test_search_city_success(mock_get, client):
+def ok_response(payload):
     mock_response = Mock()
-    mock_response.json.return_value = mock_ticketmaster_response()
+    mock_response.json.return_value = payload
+    mock_response.content = json.dumps(payload).encode()
+    mock_response.status_code = 200
     mock_response.raise_for_status = Mock()
-    mock_get.return_value = mock_response
+    return mock_response
+
+@patch('upstream.requests.Session.get')
+def test_events_success(mock_get, client, monkeypatch):
+    # no latency budget, so the configured read timeout is the one used
+    monkeypatch.setattr(ticketmaster, 'LATENCY_BUDGET', 0)
+    mock_get.return_value = ok_response(mock_ticketmaster_response())
 
-    response = client.get('/search?city=Austin')
+    response = client.get('/events?city=Austin')
     assert response.status_code == 200
     data = response.get_json()
     assert isinstance(data, list)
+    assert len(data) == 1
     assert data[0]['name'] == "Concert A"
+    assert data[0]['venue'] == "Stadium X"
+    assert data[0]['segment'] == "Music"
+    assert mock_get.call_args.kwargs['timeout'][1] == ticketmaster.TICKETMASTER_TIMEOUT
 
-@patch('app.requests.get')
-def test_search_geo_success(mock_get, client):
-    mock_response = Mock()
-    mock_response.json.return_value = mock_ticketmaster_response()
-    mock_response.raise_for_status = Mock()
-    mock_get.return_value = mock_response
+def test_events_missing_city(client):
+    response = client.get('/events')
+    assert response.status_code == 400
+    assert "Missing 'city'" in response.get_json()['error']
+
+@patch('upstream.requests.Session.get')
+def test_events_upstream_failure(mock_get, client):
+    mock_get.side_effect = requests.ConnectionError("down")
 
-    response = client.get('/search/geo?lat=40.7128&lon=-74.0060&radius=10&unit=miles')
+    response = client.get('/events?city=Austin')
+    assert response.status_code == 500
+    assert response.get_json()['error'] == "Failed to connect to Ticketmaster"
+
+@patch('upstream.requests.Session.get')
+def test_events_rate_limited(mock_get, client, monkeypatch):
+    limiter = ticketmaster.upstream.RateLimiter(rate=100, daily_quota=1)
+    limiter.acquire()
+    monkeypatch.setattr(ticketmaster.ticketmaster_client, 'limiter', limiter)
+
+    response = client.get('/events?city=Austin')
+    assert response.status_code == 503
+    assert int(response.headers['Retry-After']) > 0
+    mock_get.assert_not_called()
+
+@patch('upstream.requests.Session.get')
+def test_events_deadline_exceeded(mock_get, client):
+    mock_get.side_effect = requests.ReadTimeout("too slow")
+
+    response = client.get('/events?city=Austin&budget=0.5')
+
+    assert response.status_code == 504
+    # the read timeout was cut down to the budget
+    assert mock_get.call_args.kwargs['timeout'][1] <= 0.5
+
+@patch('upstream.requests.Session.get')
+def test_events_search(mock_get, client, monkeypatch):
+    monkeypatch.setattr(ticketmaster, 'event_index', ticketmaster.EventIndex())
+    mock_get.return_value = ok_response(mock_ticketmaster_response())
+
+    response = client.get('/events/search?city=Austin&q=concrt&segment=music')
     assert response.status_code == 200
     data = response.get_json()
-    assert isinstance(data, list)
-    assert data[0]['venue'] == "Stadium X"
+    assert [e['id'] for e in data['events']] == ['evt1']
+    assert data['total'] == 1
 
-def test_search_missing_city(client):
-    response = client.get('/search')
-    assert response.status_code == 400
-    assert "Missing 'city'" in response.get_json()['error']
+    # the listing is indexed now, later searches don't go upstream
+    response = client.get('/events/search?city=Austin&lat=40.7128&lng=-74.0060&radius=100&genre=Jazz')
+    assert response.get_json()['total'] == 0
+    mock_get.assert_called_once()
 
-def test_search_geo_invalid_coords(client):
-    response = client.get('/search/geo?lat=abc&lon=xyz')
-    assert response.status_code == 400
-    assert "Invalid latitude or longitude format" in response.get_json()['error']
+@patch('upstream.requests.Session.get')
+def test_events_served_from_cache(mock_get, client):
+    mock_get.return_value = ok_response(mock_ticketmaster_response())
 
-def test_search_geo_missing_coords(client):
-    response = client.get('/search/geo')
-    assert response.status_code == 400
-    assert "Both 'lat' and 'lon'" in response.get_json()['error']
+    client.get('/events?city=Austin')
+    response = client.get('/events?city=austin')
+
+    assert response.status_code == 200
+    assert response.get_json()[0]['id'] == "evt1"
+    mock_get.assert_called_once()
+
+@patch('upstream.requests.Session.get')
+def test_stale_events_served_while_refresh_fails(mock_get, client, event_cache):
+    cache = event_cache(ttl=0, stale_ttl=3600)
+    mock_get.return_value = ok_response(mock_ticketmaster_response())
+    client.get('/events?city=Austin')
+
+    # upstream is down, the stale listing is still returned straight away
+    mock_get.side_effect = requests.Timeout("slow")
+    response = client.get('/events?city=Austin')
+    assert response.status_code == 200
+    assert response.get_json()[0]['id'] == "evt1"
+
+    for _ in range(50):
+        if cache.refresh_failures:
+            break
+        time.sleep(0.01)
+    stats = cache.stats()
+    assert stats['stale_hits'] == 1
+    assert stats['refresh_failures'] == 1
+
+def geoapify_places_response(url, params=None, timeout=None):
+    # one place per requested category, all next to the event
+    features = []
+    for i, category in enumerate(params['categories'].split(',')):
+        features.append({
+            'properties': {'place_id': f"{category}_{i}", 'name': category, 'categories': [category],
+                           'distance': 10 * i},
+            'geometry': {'coordinates': [-74.0060, 40.7128 + 0.0001 * i]}
+        })
+    return ok_response({'features': features})
+
+@pytest.fixture
+def explorer(monkeypatch):
+    # uncached explorer so place lookups don't leak between tests
+    explorer = ticketmaster.geo.CityExplorer('test_api_key', http_client=ticketmaster.geoapify_client)
+    monkeypatch.setattr(ticketmaster, 'city_explorer', explorer)
+    return explorer
+
+@patch('upstream.requests.Session.get')
+def test_places_stream_ndjson(mock_get, client, explorer):
+    mock_get.side_effect = geoapify_places_response
+    response = client.get('/places?lat=40.7128&lng=-74.0060&types=restaurants&types=bars',
+                          headers={'Accept': 'application/x-ndjson'})
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [ticketmaster.json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    assert lines[0]['properties']['type'] == 'event'
+    assert {line['name'] for line in lines if line['type'] == 'Category'} == {'restaurants', 'bars'}
+    summary = lines[-1]
+    assert summary['type'] == 'Summary'
+    assert summary['properties']['total_places'] == sum(1 for line in lines[1:] if line['type'] == 'Feature')
+    assert list(summary['properties']['categories']) == ['restaurants', 'bars']
+
+@patch('upstream.requests.Session.get')
+def test_places_server_timing_includes_pool_stages(mock_get, client, explorer):
+    mock_get.side_effect = geoapify_places_response
+    response = client.get('/places?lat=40.7128&lng=-74.0060&types=restaurants&types=bars&timing=1')
+
+    # parsing happens on the geoapify pool, not on the request thread
+    timing = response.headers['Server-Timing']
+    assert 'parse;dur=' in timing and 'fetch;dur=' in timing
+
+def test_partial_places_only_shared_with_spent_budgets():
+    partial = {'properties': {'partial': True}}
+    assert ticketmaster.reusable_places({'properties': {'partial': False}})
+    assert not ticketmaster.reusable_places(partial)
+    with upstream.deadline(5):
+        assert not ticketmaster.reusable_places(partial)
+    with upstream.deadline(0.001):
+        time.sleep(0.01)
+        assert ticketmaster.reusable_places(partial)
+
+@patch('upstream.requests.Session.get')
+def test_places_stream_geojson_matches_buffered(mock_get, client, explorer):
+    mock_get.side_effect = geoapify_places_response
+    query = '/places?lat=40.7128&lng=-74.0060&types=restaurants&types=bars'
+    buffered = client.get(query).get_json()
+    streamed = ticketmaster.json.loads(client.get(query + '&stream=geojson').get_data(as_text=True))
+
+    assert streamed['type'] == 'FeatureCollection'
+    assert streamed['properties'] == buffered['properties']
+    assert sorted(f['properties']['id'] for f in streamed['features']) == \
+        sorted(f['properties']['id'] for f in buffered['features'])
+
+
+@patch('upstream.requests.Session.get')
+def test_plan(mock_get, client, explorer):
+    mock_get.side_effect = geoapify_places_response
+    response = client.get('/plan?lat=40.7128&lng=-74.0060&datetime=2025-08-01T20:00:00'
+                          '&before=restaurants&after=bars&after=cafes')
+
+    assert response.status_code == 200
+    plan = response.get_json()
+    assert [stop['type'] for stop in plan['before']] == ['restaurants']
+    assert sorted(stop['type'] for stop in plan['after']) == ['bars', 'cafes']
+    assert plan['before'][-1]['depart'] <= '2025-08-01T19:45'
+    assert plan['after'][0]['arrive'] >= '2025-08-01T23:00'
+    assert plan['unplanned'] == [] and not plan['partial']
+
+    assert client.get('/plan?lat=40.7128&lng=-74.0060&datetime=tonight').status_code == 400
+    assert client.get('/plan?lat=40.7128&datetime=2025-08-01').status_code == 400
+@patch('upstream.requests.Session.get')
+def test_event_with_places_stream_geojson(mock_get, client, explorer):
+    mock_get.side_effect = geoapify_places_response
+    response = client.get('/event-with-places?event_id=evt1&lat=40.7128&lng=-74.0060&types=bars&stream=geojson')
+
+    data = ticketmaster.json.loads(response.get_data(as_text=True))
+    assert data['event']['id'] == 'evt1'
+    assert data['search_params']['types'] == ['bars']
+    assert list(data['places_data']['properties']['categories']) == ['bars']
+    assert data['places_data']['features'][0]['properties']['type'] == 'event'
+
+@patch('upstream.requests.Session.get')
+def test_places_columnar_gzip(mock_get, client, explorer):
+    mock_get.side_effect = geoapify_places_response
+    query = '/places?lat=40.7128&lng=-74.0060&types=restaurants&types=bars'
+    plain = client.get(query).get_json()
+    response = client.get(query + '&format=columnar', headers={'Accept-Encoding': 'gzip'})
+
+    assert response.mimetype == ticketmaster.wire.MIMETYPES['columnar']
+    body = response.get_data()
+    if response.headers.get('Content-Encoding') == 'gzip':
+        body = gzip.decompress(body)
+    assert ticketmaster.wire.decode(body, 'columnar') == plain
+
+@patch('upstream.requests.Session.get')
+def test_places_batch_shares_place_sets_per_venue(mock_get, client, explorer):
+    mock_get.side_effect = geoapify_places_response
+    events = [
+        {"id": "a", "lat": 40.7128, "lng": -74.0060},
+        {"id": "b", "lat": 40.7129, "lng": -74.0060},  # same venue, ~11m away
+        {"id": "c", "lat": 40.7500, "lng": -73.9900},
+    ]
+    response = client.post('/places/batch', json={"events": events, "types": ["bars"]})
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert [e['place_set'] for e in data['events']] == ['0', '0', '1']
+    assert set(data['place_sets']) == {'0', '1'}
+    assert data['place_sets']['0']['type'] == 'FeatureCollection'
+    # one geoapify query per cluster, not per event
+    assert mock_get.call_count == 2
+
+def test_places_batch_validation(client):
+    assert client.post('/places/batch', json={}).status_code == 400
+    assert client.post('/places/batch', json={"events": [{"id": "a"}]}).status_code == 400
+
+    event = {"id": "a", "lat": 40.7128, "lng": -74.0060}
+    for bad in ({"radius": "abc"}, {"limit": None}):
+        response = client.post('/places/batch', json=dict(bad, events=[event]))
+        assert response.status_code == 400
+        assert 'radius and limit' in response.get_json()['error']
+
+def city_events_response(count=3):
+    venue = mock_ticketmaster_response()["_embedded"]["events"][0]
+    events = []
+    for i in range(count):
+        event = dict(venue, id=f"evt{i}", name=f"Concert {i}")
+        event["_embedded"] = {"venues": [dict(venue["_embedded"]["venues"][0],
+                                              location={"latitude": str(40.70 + 0.02 * i), "longitude": "-74.0060"})]}
+        events.append(event)
+    return {"_embedded": {"events": events}}
+
+@pytest.fixture
+def prefetch(monkeypatch):
+    executor = ticketmaster.ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(ticketmaster, 'prefetch_executor', executor)
+    monkeypatch.setattr(ticketmaster, 'prefetch_stats', {"submitted": 0, "dropped": 0, "failed": 0, "pending": 0})
+    yield executor
+    executor.shutdown(wait=True)
+
+@patch('upstream.requests.Session.get')
+def test_event_map_data_prefetches_next_events(mock_get, client, monkeypatch, prefetch):
+    from cache import MemoryCache, PlaceCache
+    explorer = ticketmaster.geo.CityExplorer('test_api_key', http_client=ticketmaster.geoapify_client,
+                                             place_cache=PlaceCache(MemoryCache()))
+    monkeypatch.setattr(ticketmaster, 'city_explorer', explorer)
+
+    def route(url, params=None, timeout=None):
+        if url == ticketmaster.TICKETMASTER_URL:
+            return ok_response(city_events_response())
+        return geoapify_places_response(url, params, timeout)
+    mock_get.side_effect = route
+
+    response = client.get('/event-map-data?city=Austin&types=bars')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['event']['id'] == 'evt0'
+    assert [e['id'] for e in data['all_events']] == ['evt0', 'evt1', 'evt2']
+    assert data['map_data']['type'] == 'FeatureCollection'
+
+    for _ in range(100):
+        if not ticketmaster.prefetch_stats['pending']:
+            break
+        time.sleep(0.01)
+    assert ticketmaster.prefetch_stats['submitted'] == 2
+    calls = mock_get.call_count
+
+    # the next event's places were prefetched, and the events are cached
+    response = client.get('/event-map-data?city=Austin&types=bars&event_id=evt1')
+    assert response.get_json()['event']['id'] == 'evt1'
+    assert mock_get.call_count == calls
+
+def test_event_map_data_missing_city(client):
+    assert client.get('/event-map-data').status_code == 400
+
+@patch('upstream.requests.Session.get')
+def test_place_clusters(mock_get, client, explorer, monkeypatch):
+    monkeypatch.setattr(ticketmaster, 'cluster_cache', ticketmaster.MemoryCache())
+    mock_get.side_effect = geoapify_places_response
+    query = '/places/clusters?lat=40.7128&lng=-74.0060&types=bars'
+
+    zoomed_out = client.get(query + '&zoom=3').get_json()
+    assert zoomed_out['properties']['clusters'] == 1
+    cluster = next(f for f in zoomed_out['features'] if f['properties'].get('cluster'))
+    assert cluster['properties']['point_count'] == zoomed_out['properties']['total_places']
+
+    zoomed_in = client.get(query + '&zoom=19').get_json()
+    assert zoomed_in['properties']['clusters'] == 0
+    # the pyramid is built once per dataset
+    assert mock_get.call_count == 1
+    assert client.get(query + '&bbox=1,2').status_code == 400
+
+def test_partial_place_clusters_are_not_cached(client, monkeypatch):
+    monkeypatch.setattr(ticketmaster, 'cluster_cache', ticketmaster.MemoryCache())
+    calls = []
+
+    def partial_geojson(event_location, search_types, radius, limit):
+        calls.append(1)
+        bounds = {'west': -74.01, 'south': 40.70, 'east': -74.00, 'north': 40.72}
+        return {'features': [], 'properties': {'bounds': bounds, 'partial': True, 'missing_categories': ['bars']}}
+
+    monkeypatch.setattr(ticketmaster, 'get_places_geojson', partial_geojson)
+    for _ in range(2):
+        response = client.get('/places/clusters?lat=40.7128&lng=-74.0060&types=bars')
+        assert response.get_json()['properties']['partial']
+    assert len(calls) == 2
+
+def discovery_page(page, total_pages, ids):
+    data = city_events_response(len(ids))
+    for event, (event_id, date) in zip(data["_embedded"]["events"], ids):
+        event["id"] = event_id
+        event["dates"] = {"start": {"localDate": date}}
+    data["page"] = {"number": page, "totalPages": total_pages}
+    return data
+
+PAGES = {
+    0: [("a", "2025-08-01"), ("b", "2025-08-02")],
+    1: [("b", "2025-08-02"), ("c", "2025-08-03")],  # b moved across the page boundary
+    2: [("d", "2025-08-04"), ("e", "2025-08-05")],
+}
+
+@patch('upstream.requests.Session.get')
+def test_events_paged_merges_and_dedupes(mock_get, client, monkeypatch):
+    monkeypatch.setattr(ticketmaster, 'EVENTS_PAGES_PER_SECOND', 1000)
+    mock_get.side_effect = lambda url, params=None, timeout=None: ok_response(
+        discovery_page(params.get("page", 0), 3, PAGES[params.get("page", 0)]))
+
+    data = client.get('/events?city=Austin&paged=1').get_json()
+
+    assert [e['id'] for e in data['events']] == ['a', 'b', 'c', 'd', 'e']
+    assert data['next_cursor'] is None
+    assert data['pages_fetched'] == 3
+    assert mock_get.call_count == 3
+
+    # the merged listing and its pages are cached
+    assert client.get('/events?city=austin&paged=1').get_json() == data
+    assert client.get(f"/events?city=Austin&cursor={ticketmaster.encode_cursor(1)}&pages=2").get_json()['events']
+    assert mock_get.call_count == 3
+
+@patch('upstream.requests.Session.get')
+def test_events_cursor_continues_listing(mock_get, client, monkeypatch):
+    # 0 turns the page pacing off
+    monkeypatch.setattr(ticketmaster, 'EVENTS_PAGES_PER_SECOND', 0)
+    mock_get.side_effect = lambda url, params=None, timeout=None: ok_response(
+        discovery_page(params.get("page", 0), 3, PAGES[params.get("page", 0)]))
+
+    first = client.get('/events?city=Austin&paged=1&pages=2').get_json()
+    assert [e['id'] for e in first['events']] == ['a', 'b', 'c']
+
+    second = client.get(f"/events?city=Austin&cursor={first['next_cursor']}").get_json()
+    assert [e['id'] for e in second['events']] == ['d', 'e']
+    assert second['next_cursor'] is None
+
+    assert client.get('/events?city=Austin&cursor=nonsense').status_code == 400
+
+@patch('upstream.requests.Session.get')
+def test_metrics_and_server_timing(mock_get, client):
+    mock_get.return_value = ok_response(mock_ticketmaster_response())
+    response = client.get('/events?city=Austin&timing=1')
+
+    assert 'fetch;dur=' in response.headers['Server-Timing']
+    assert 'total;dur=' in response.headers['Server-Timing']
+
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'citypulse_http_request_seconds_count{endpoint="/events",status="200"}' in text
+    assert 'citypulse_upstream_responses_total{status="200",upstream="ticketmaster"}' in text
+    assert 'citypulse_event_cache_misses' in text
+    assert 'citypulse_upstream_client_requests{upstream="ticketmaster"}' in text
+
+    # one TYPE line per metric family, or the scrape is rejected
+    families = [line.split()[2] for line in text.splitlines() if line.startswith('# TYPE ')]
+    assert len(families) == len(set(families))
+
+def test_profiler_endpoint_is_off_by_default(client):
+    assert client.post('/debug/profiler?action=start').status_code == 404
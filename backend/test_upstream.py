@@ -0,0 +1,230 @@
+import json
+import time
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import upstream
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        server.ports.add(self.client_address[1])
+        server.calls += 1
+
+        status, headers, delay = server.script.pop(0) if server.script else (200, {}, 0)
+        time.sleep(delay)
+        body = json.dumps({"call": server.calls}).encode()
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestUpstreamClient(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.script = []
+        self.server.ports = set()
+        self.server.calls = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/places"
+        self.client = upstream.UpstreamClient('stub', backoff_base=0.01, max_retries=2)
+        self.running = True
+
+    def tearDown(self):
+        self.client.close()
+        if self.running:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def test_connections_are_reused(self):
+        for _ in range(5):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+
+        self.assertEqual(self.server.calls, 5)
+        self.assertEqual(len(self.server.ports), 1)
+
+    def test_retries_transient_errors(self):
+        self.server.script = [(503, {}, 0), (429, {"Retry-After": "0"}, 0)]
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["call"], 3)
+        self.assertEqual(self.client.stats()["retries"], 2)
+
+    def test_gives_up_after_max_retries(self):
+        self.server.script = [(500, {}, 0)] * 3
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.server.calls, 3)
+        self.assertEqual(self.client.stats()["failures"], 1)
+
+    def test_long_retry_after_is_not_waited_on(self):
+        self.server.script = [(429, {"Retry-After": "120"}, 0)]
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(self.server.calls, 1)
+
+    def test_read_timeout_is_not_retried(self):
+        self.server.script = [(200, {}, 0.3)]
+
+        with self.assertRaises(requests.ReadTimeout):
+            self.client.get(self.url, timeout=0.1)
+        self.assertEqual(self.client.stats()["requests"], 1)
+
+    def test_slot_is_released_between_attempts(self):
+        self.server.script = [(503, {"Retry-After": "0.2"}, 0)]
+        slots = threading.BoundedSemaphore(1)
+        acquired = []
+
+        def other_caller():
+            time.sleep(0.05)
+            acquired.append(slots.acquire(timeout=0.1))
+            slots.release()
+
+        thread = threading.Thread(target=other_caller)
+        thread.start()
+        self.assertEqual(self.client.get(self.url, slots=slots).status_code, 200)
+        thread.join()
+
+        # the other caller got the slot while the first one was backing off
+        self.assertEqual(acquired, [True])
+
+    def test_connection_errors_raise_after_retries(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.running = False
+
+        with self.assertRaises(requests.ConnectionError):
+            self.client.get(self.url)
+        self.assertEqual(self.client.stats()["requests"], 3)
+
+    def test_deadline_cuts_the_timeout(self):
+        self.server.script = [(200, {}, 0.5)]
+
+        start = time.perf_counter()
+        with upstream.deadline(0.1):
+            with self.assertRaises(upstream.DeadlineExceeded):
+                self.client.get(self.url)
+        self.assertLess(time.perf_counter() - start, 0.4)
+
+    def test_retry_that_does_not_fit_the_budget_is_skipped(self):
+        self.server.script = [(503, {"Retry-After": "1"}, 0)]
+
+        with upstream.deadline(0.3):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.server.calls, 1)
+
+    def test_slow_attempt_is_hedged(self):
+        client = upstream.UpstreamClient('stub', hedge_percentile=0.5, hedge_min_samples=5, hedge_min_delay=0.05)
+        self.addCleanup(client.close)
+        for _ in range(5):
+            client.get(self.url)
+        self.server.script = [(200, {}, 1.0)]
+
+        start = time.perf_counter()
+        response = client.get(self.url)
+
+        # the duplicate answered while the original was still stuck
+        self.assertLess(time.perf_counter() - start, 0.5)
+        self.assertEqual(response.json()["call"], 7)
+        self.assertEqual(client.stats()["hedges"], 1)
+        self.assertEqual(client.stats()["hedge_wins"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_burst_then_paced(self):
+        limiter = upstream.RateLimiter(rate=50, burst=2)
+        start = time.monotonic()
+        for _ in range(4):
+            limiter.acquire()
+
+        # two from the burst, two more at 50 per second
+        self.assertGreaterEqual(time.monotonic() - start, 0.035)
+        self.assertEqual(limiter.stats()["granted"]["interactive"], 4)
+
+    def test_gives_up_past_max_wait(self):
+        limiter = upstream.RateLimiter(rate=1, burst=1, max_wait=(0.05, 0.05))
+        limiter.acquire()
+
+        with self.assertRaises(upstream.RateLimited) as raised:
+            limiter.acquire()
+        self.assertEqual(raised.exception.reason, 'wait')
+        self.assertIsInstance(raised.exception, requests.RequestException)
+        self.assertEqual(limiter.stats()["waiting"], 0)
+
+    def test_interactive_goes_before_background(self):
+        limiter = upstream.RateLimiter(rate=20, burst=1)
+        limiter.acquire()
+        order = []
+
+        def take(priority, name):
+            limiter.acquire(priority)
+            order.append(name)
+
+        background = threading.Thread(target=take, args=(upstream.BACKGROUND, 'background'))
+        background.start()
+        time.sleep(0.01)
+        interactive = threading.Thread(target=take, args=(upstream.INTERACTIVE, 'interactive'))
+        interactive.start()
+        background.join()
+        interactive.join()
+
+        self.assertEqual(order, ['interactive', 'background'])
+
+    def test_background_keeps_off_the_reserved_quota(self):
+        limiter = upstream.RateLimiter(rate=1000, burst=10, daily_quota=5, background_share=0.6)
+        with upstream.background():
+            for _ in range(3):
+                limiter.acquire()
+            with self.assertRaises(upstream.RateLimited) as raised:
+                limiter.acquire()
+        self.assertEqual(raised.exception.reason, 'quota')
+
+        limiter.acquire()
+        limiter.acquire()
+        with self.assertRaises(upstream.RateLimited):
+            limiter.acquire()
+        self.assertEqual(limiter.quota_remaining(), 0)
+
+    def test_client_refuses_without_calling_upstream(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        server.script, server.ports, server.calls = [], set(), 0
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        client = upstream.UpstreamClient('limited', limiter=upstream.RateLimiter(rate=1000, daily_quota=1))
+        self.addCleanup(client.close)
+        url = f"http://127.0.0.1:{server.server_address[1]}/"
+        client.get(url)
+
+        with self.assertRaises(upstream.RateLimited):
+            client.get(url)
+        self.assertEqual(server.calls, 1)
+        self.assertEqual(client.stats()["limiter"]["rejected"]["interactive"], 1)
@@ -0,0 +1,56 @@
+import gzip
+import unittest
+
+import geoapify as geo
+import wire
+
+
+def make_collection(count=100):
+    explorer = geo.CityExplorer('test_api_key')
+    features = [explorer._place_to_feature(geo.PlaceResult(
+        id=f"p{i}", name=f"Place {i}", category='catering.restaurant' if i % 2 else 'catering.bar',
+        subcategory='catering.restaurant', lat=40.75 + i * 1e-4, lon=-73.99 - i * 1e-4,
+        address=f"{i} Main St", distance=i * 10, rating=4.5 if i % 3 else None
+    )) for i in range(count)]
+    return {
+        "type": "FeatureCollection",
+        "features": features,
+        "properties": {"center": [-73.99, 40.75], "radius": 1000, "total_places": count}
+    }
+
+
+class TestWire(unittest.TestCase):
+    def setUp(self):
+        self.collection = make_collection()
+        self.payload = {"event": {"id": "evt1"}, "places_data": self.collection}
+
+    def test_columnar_round_trip(self):
+        columnar = wire.to_columnar(self.collection)
+        self.assertEqual(len(columnar['coordinates']), 200)
+        self.assertEqual(sorted(columnar['tables']['category']), ['catering.bar', 'catering.restaurant'])
+        self.assertEqual(wire.from_columnar(columnar), self.collection)
+
+    def test_binary_round_trip_with_nested_collection(self):
+        body = wire.encode(self.payload, wire.BINARY)
+        self.assertTrue(body.startswith(wire.BINARY_MAGIC))
+        self.assertEqual(wire.decode(body, wire.BINARY), self.payload)
+
+    def test_compact_formats_are_smaller(self):
+        plain = len(wire.encode(self.payload))
+        self.assertLess(len(wire.encode(self.payload, wire.COLUMNAR)), plain / 2)
+        self.assertLess(len(wire.encode(self.payload, wire.BINARY)), plain / 2)
+
+    def test_negotiation_and_compression(self):
+        self.assertEqual(wire.negotiate_format('columnar', ''), wire.COLUMNAR)
+        self.assertEqual(wire.negotiate_format(None, wire.MIMETYPES[wire.BINARY]), wire.BINARY)
+        self.assertEqual(wire.negotiate_format('bogus', ''), wire.JSON)
+
+        body = wire.encode(self.payload)
+        compressed, encoding = wire.compress(body, 'gzip, deflate')
+        self.assertEqual(encoding, 'gzip')
+        self.assertEqual(gzip.decompress(compressed), body)
+        self.assertEqual(wire.compress(b'{}', 'gzip'), (b'{}', None))
+
+
+if __name__ == '__main__':
+    unittest.main()
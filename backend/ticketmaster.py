@@ -1,29 +1,282 @@
 import os
 import requests
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from dotenv import load_dotenv
 from flask_cors import CORS
 import json
+import time
+import base64
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import geoapify as geo
+import geometry
+import metrics
+import planner
+import upstream
+import wire
+from cache import EventCache, MemoryCache, PlaceCache, SQLiteCache
+from clustering import ClusterPyramid
+from eventindex import EventIndex
+from placestore import PlaceStore
+from singleflight import SingleFlight
 
 # Load environment variables from .env file
 load_dotenv()
 
+# origins the browser may call the API from, comma separated, shared with the ASGI mode
+CORS_ORIGINS = [origin.strip() for origin in os.getenv("CORS_ORIGINS", "*").split(",") if origin.strip()]
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask's JSON, with the lazily built feature lists of place collections written as arrays"""
+
+    @staticmethod
+    def default(o):
+        try:
+            return wire.json_default(o)
+        except TypeError:
+            return DefaultJSONProvider.default(o)
+
 app = Flask(__name__)
-CORS(app)
+app.json = JSONProvider(app)
+CORS(app, origins=CORS_ORIGINS)
 
 # Read API key from environment
 TICKETMASTER_API_KEY = os.getenv("TICKETMASTER_API_KEY")
 GEOAPIFY_API_KEY = os.getenv("GEOAPIFY_API_KEY")
 
-city_explorer = geo.CityExplorer(GEOAPIFY_API_KEY)
+# upstream endpoints can be pointed at local stand-ins for testing
+TICKETMASTER_URL = os.getenv("TICKETMASTER_URL", "https://app.ticketmaster.com/discovery/v2/events.json")
+TICKETMASTER_TIMEOUT = float(os.getenv("TICKETMASTER_TIMEOUT", "8"))
+GEOAPIFY_URL = os.getenv("GEOAPIFY_URL", "https://api.geoapify.com/v2/places")
+GEOAPIFY_TIMEOUT = float(os.getenv("GEOAPIFY_TIMEOUT", "10"))
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "2"))
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "10"))
+
+# per process request rates (per second) and daily quotas, 0 turns a limit off.
+# interactive calls wait at most UPSTREAM_MAX_WAIT seconds for a slot, prefetch
+# and cache refreshes up to UPSTREAM_BACKGROUND_MAX_WAIT
+TICKETMASTER_RATE = float(os.getenv("TICKETMASTER_RATE", "5"))
+TICKETMASTER_DAILY_QUOTA = int(os.getenv("TICKETMASTER_DAILY_QUOTA", "5000"))
+GEOAPIFY_RATE = float(os.getenv("GEOAPIFY_RATE", "5"))
+GEOAPIFY_DAILY_QUOTA = int(os.getenv("GEOAPIFY_DAILY_QUOTA", "3000"))
+UPSTREAM_BURST = float(os.getenv("UPSTREAM_BURST", "10"))
+UPSTREAM_MAX_WAIT = float(os.getenv("UPSTREAM_MAX_WAIT", "2"))
+UPSTREAM_BACKGROUND_MAX_WAIT = float(os.getenv("UPSTREAM_BACKGROUND_MAX_WAIT", "30"))
+
+# seconds a request may spend on upstream calls before answering with what it has, 0 turns it off.
+# clients can ask for a tighter or looser one with ?budget= up to LATENCY_BUDGET_MAX
+LATENCY_BUDGET = float(os.getenv("LATENCY_BUDGET", "5"))
+LATENCY_BUDGET_MAX = float(os.getenv("LATENCY_BUDGET_MAX", "20"))
+# an upstream call slower than this percentile of recent ones gets a duplicate, 0 turns hedging off
+UPSTREAM_HEDGE_PERCENTILE = float(os.getenv("UPSTREAM_HEDGE_PERCENTILE", "0.95"))
+
+
+def rate_limiter(rate: float, daily_quota: int):
+    if not rate:
+        return None
+    return upstream.RateLimiter(
+        rate, burst=UPSTREAM_BURST, daily_quota=daily_quota,
+        max_wait=(UPSTREAM_MAX_WAIT, UPSTREAM_BACKGROUND_MAX_WAIT)
+    )
+
+
+ticketmaster_client = upstream.get_client(
+    'ticketmaster', pool_size=UPSTREAM_POOL_SIZE, read_timeout=TICKETMASTER_TIMEOUT, max_retries=UPSTREAM_MAX_RETRIES,
+    limiter=rate_limiter(TICKETMASTER_RATE, TICKETMASTER_DAILY_QUOTA), hedge_percentile=UPSTREAM_HEDGE_PERCENTILE
+)
+geoapify_client = upstream.get_client(
+    'geoapify', pool_size=UPSTREAM_POOL_SIZE, read_timeout=GEOAPIFY_TIMEOUT, max_retries=UPSTREAM_MAX_RETRIES,
+    limiter=rate_limiter(GEOAPIFY_RATE, GEOAPIFY_DAILY_QUOTA), hedge_percentile=UPSTREAM_HEDGE_PERCENTILE
+)
+
+# shared place cache so repeat lookups around the same venue skip geoapify
+PLACE_CACHE_TTL = int(os.getenv("PLACE_CACHE_TTL", "900"))
+PLACE_CACHE_SIZE = int(os.getenv("PLACE_CACHE_SIZE", "2048"))
+# with CACHE_PATH set the place and event caches live in one SQLite file that every
+# worker process shares and that survives restarts, otherwise each process has its own
+CACHE_PATH = os.getenv("CACHE_PATH", "")
+
+if CACHE_PATH:
+    place_cache_store = SQLiteCache(CACHE_PATH, max_entries=PLACE_CACHE_SIZE, default_ttl=PLACE_CACHE_TTL, table='places')
+else:
+    place_cache_store = MemoryCache(max_entries=PLACE_CACHE_SIZE, default_ttl=PLACE_CACHE_TTL)
+place_cache = PlaceCache(place_cache_store, ttl=PLACE_CACHE_TTL)
+# optional on-disk store of every place seen, PLACE_STORE_FIRST answers from it when it can
+PLACE_STORE_PATH = os.getenv("PLACE_STORE_PATH", "")
+PLACE_STORE_FIRST = os.getenv("PLACE_STORE_FIRST", "0") == "1"
+PLACE_STORE_MAX_AGE = int(os.getenv("PLACE_STORE_MAX_AGE", str(7 * 86400)))
+
+place_store = PlaceStore(PLACE_STORE_PATH, max_age=PLACE_STORE_MAX_AGE) if PLACE_STORE_PATH else None
+# connections each async upstream client keeps in the ASGI serving mode
+ASYNC_POOL_SIZE = int(os.getenv("ASYNC_POOL_SIZE", "200"))
+
+city_explorer = geo.CityExplorer(
+    GEOAPIFY_API_KEY, place_cache=place_cache, http_client=geoapify_client, base_url=GEOAPIFY_URL,
+    place_store=place_store, store_first=PLACE_STORE_FIRST, async_pool_size=ASYNC_POOL_SIZE
+)
+
+# city listings change slowly, serve them from cache and refresh in the background
+EVENT_CACHE_TTL = int(os.getenv("EVENT_CACHE_TTL", "300"))
+EVENT_CACHE_STALE_TTL = int(os.getenv("EVENT_CACHE_STALE_TTL", "3600"))
+
+event_cache = EventCache(
+    SQLiteCache(CACHE_PATH, max_entries=512, default_ttl=EVENT_CACHE_TTL + EVENT_CACHE_STALE_TTL, table='events')
+    if CACHE_PATH else None,
+    ttl=EVENT_CACHE_TTL, stale_ttl=EVENT_CACHE_STALE_TTL, refresh_context=upstream.background
+)
+
+# /places/batch: events closer than BATCH_CLUSTER_RADIUS meters share one place set
+BATCH_MAX_EVENTS = int(os.getenv("BATCH_MAX_EVENTS", "100"))
+BATCH_CLUSTER_RADIUS = float(os.getenv("BATCH_CLUSTER_RADIUS", "75"))
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "4"))
+BATCH_MAX_RADIUS = int(os.getenv("BATCH_MAX_RADIUS", "5000"))
+BATCH_MAX_LIMIT = int(os.getenv("BATCH_MAX_LIMIT", "50"))
+
+# cluster pyramids built for /places/clusters, one per places dataset
+CLUSTER_CACHE_SIZE = int(os.getenv("CLUSTER_CACHE_SIZE", "128"))
+cluster_cache = MemoryCache(max_entries=CLUSTER_CACHE_SIZE, default_ttl=PLACE_CACHE_TTL)
+
+# paged /events: Discovery caps a page at 200 events and paging depth at 1000
+EVENTS_PAGE_SIZE = int(os.getenv("EVENTS_PAGE_SIZE", "200"))
+EVENTS_MAX_PAGES = int(os.getenv("EVENTS_MAX_PAGES", "5"))
+EVENTS_PAGE_WORKERS = int(os.getenv("EVENTS_PAGE_WORKERS", "4"))
+EVENTS_PAGES_PER_SECOND = float(os.getenv("EVENTS_PAGES_PER_SECOND", "4"))
+DISCOVERY_MAX_DEPTH = 1000
+
+# every listing fetched is indexed for /events/search, the events seen longest ago go first past the cap
+EVENT_INDEX_MAX_EVENTS = int(os.getenv("EVENT_INDEX_MAX_EVENTS", "50000"))
+SEARCH_MAX_LIMIT = int(os.getenv("SEARCH_MAX_LIMIT", "100"))
+event_index = EventIndex(max_events=EVENT_INDEX_MAX_EVENTS)
+
+# /plan walks at PLAN_WALK_SPEED meters a minute, is back PLAN_BUFFER minutes before the event
+# and gives the route solver PLAN_TIME_LIMIT seconds
+PLAN_WALK_SPEED = float(os.getenv("PLAN_WALK_SPEED", str(planner.WALK_SPEED)))
+PLAN_BUFFER = int(os.getenv("PLAN_BUFFER", "15"))
+PLAN_TIME_LIMIT = float(os.getenv("PLAN_TIME_LIMIT", "0.05"))
+
+# /event-map-data warms places for the next PREFETCH_EVENTS events on a small pool
+PREFETCH_EVENTS = int(os.getenv("PREFETCH_EVENTS", "5"))
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "2"))
+PREFETCH_QUEUE_SIZE = int(os.getenv("PREFETCH_QUEUE_SIZE", "20"))
+
+prefetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+prefetch_lock = threading.Lock()
+prefetch_stats = {"submitted": 0, "dropped": 0, "failed": 0, "pending": 0}
+
+# identical requests arriving together share one upstream computation
+places_flight = SingleFlight()
+events_flight = SingleFlight()
+
+# Server-Timing breakdown on every response, or per request with ?timing=1
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+# the runtime profiler switch at /debug/profiler is only mounted when this is set
+PROFILER_ENDPOINT = os.getenv("PROFILER_ENDPOINT", "0") == "1"
+
+def _cache_gauges() -> list:
+    gauges = []
+    for name, stats in (("place", place_cache.stats()), ("event", event_cache.stats())):
+        for field, value in stats.items():
+            if isinstance(value, (int, float)):
+                gauges.append((f"citypulse_{name}_cache_{field}", {}, value))
+    for name, flight in (("places", places_flight), ("events", events_flight)):
+        for field, value in flight.stats().items():
+            gauges.append((f"citypulse_singleflight_{field}", {"flight": name}, value))
+    for name, stats in upstream.all_stats().items():
+        limiter = stats.pop("limiter", None)
+        for field, value in stats.items():
+            # client_ keeps these apart from the per-call counters metrics registers under citypulse_upstream_
+            gauges.append((f"citypulse_upstream_client_{field}", {"upstream": name}, value))
+        if limiter is not None:
+            for field in ("tokens", "waiting", "used_today"):
+                gauges.append((f"citypulse_upstream_limiter_{field}", {"upstream": name}, limiter[field]))
+    return gauges
+
+metrics.registry.add_collector(_cache_gauges)
+
+@app.before_request
+def start_timing():
+    g.request_started = time.perf_counter()
+    metrics.start_request()
+
+@app.after_request
+def record_timing(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+    metrics.request_seconds.observe(elapsed, endpoint=endpoint, status=str(response.status_code))
+    # streamed bodies have no length up front
+    if not response.is_streamed:
+        metrics.response_bytes.observe(response.calculate_content_length() or 0, endpoint=endpoint)
+    if SERVER_TIMING or request.args.get('timing') == '1':
+        response.headers['Server-Timing'] = metrics.server_timing(metrics.request_stages(), elapsed)
+    return response
+
+def latency_budget(requested=None) -> float:
+    """Latency budget in seconds for a request asking for requested (?budget=), clamped to LATENCY_BUDGET_MAX"""
+    if requested is None or requested <= 0:
+        return LATENCY_BUDGET
+    return min(requested, LATENCY_BUDGET_MAX)
+
+def budgeted(view):
+    """Run a view's upstream calls inside the request's latency budget"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with upstream.deadline(latency_budget(request.args.get('budget', type=float))):
+            return view(*args, **kwargs)
+    return wrapper
+
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/debug/profiler', methods=['GET', 'POST'])
+def profiler_control():
+    """Start, stop or reset the sampling profiler (POST ?action=), GET returns the hottest stacks"""
+    if not PROFILER_ENDPOINT:
+        return jsonify({"error": "Not found"}), 404
+
+    if request.method == 'POST':
+        action = request.args.get('action', '')
+        if action == 'start':
+            metrics.profiler.start()
+        elif action == 'stop':
+            metrics.profiler.stop()
+        elif action == 'reset':
+            metrics.profiler.reset()
+        else:
+            return jsonify({"error": "action must be start, stop or reset"}), 400
+
+    return jsonify(metrics.profiler.report(request.args.get('top', 30, type=int)))
 
 @app.route('/')
 def home():
     return "CityPulse API is running! Use /search?city=Austin to test."
 
+@app.route('/stats')
+def get_stats():
+    """Cache counters used to tune sizes and TTLs"""
+    return jsonify({
+        "place_cache": place_cache.stats(),
+        "event_cache": event_cache.stats(),
+        "upstream": upstream.all_stats(),
+        "place_store": place_store.stats() if place_store is not None else None,
+        "prefetch": dict(prefetch_stats),
+        "event_index": event_index.stats(),
+        "singleflight": {
+            "places": places_flight.stats(),
+            "events": events_flight.stats()
+        }
+    })
+
 @app.route('/events')
+@budgeted
 def get_events():
     """Get events from Ticketmaster API"""
     city = request.args.get('city', '').strip()
@@ -32,46 +285,362 @@ def get_events():
     if not city:
         return jsonify({"error": "Missing 'city' parameter"}), 400
 
-    url = "https://app.ticketmaster.com/discovery/v2/events.json"
+    # paged mode: several Discovery pages merged, with a cursor for the next batch
+    cursor = request.args.get('cursor')
+    if cursor or request.args.get('paged'):
+        pages = request.args.get('pages', EVENTS_MAX_PAGES, type=int)
+        try:
+            start_page = decode_cursor(cursor) if cursor else 0
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
+        try:
+            return jsonify(get_city_events_paged(city, start_page, pages))
+        except upstream.RateLimited as e:
+            return rate_limited(e)
+        except upstream.DeadlineExceeded as e:
+            return deadline_exceeded(e)
+        except requests.RequestException as e:
+            return jsonify({"error": "Failed to connect to Ticketmaster", "details": str(e)}), 500
+
+    try:
+        events = get_city_events(city, size)
+    except upstream.RateLimited as e:
+        return rate_limited(e)
+    except upstream.DeadlineExceeded as e:
+        return deadline_exceeded(e)
+    except requests.RequestException as e:
+        return jsonify({"error": "Failed to connect to Ticketmaster", "details": str(e)}), 500
+
+    return jsonify(events)
+
+def rate_limited(error: upstream.RateLimited):
+    """503 with a Retry-After for a request the upstream rate limiter turned away"""
+    response = jsonify({"error": "Too many requests to Ticketmaster, try again shortly", "details": str(error)})
+    response.status_code = 503
+    if error.retry_after is not None:
+        response.headers['Retry-After'] = str(max(1, int(error.retry_after + 0.999)))
+    return response
+
+@app.route('/events/search')
+@budgeted
+def search_events():
+    """
+    Filter indexed events server side
+
+    q (name, prefix and one typo fuzzy unless fuzzy=0), city, segment and
+    genre (repeatable), start/end (YYYY-MM-DD, inclusive), lat/lng with radius
+    meters (nearest first), offset and limit. a city not indexed yet has its
+    listing fetched first
+    """
+    args = request.args
+    city = args.get('city', '').strip()
+    lat = args.get('lat', type=float)
+    lng = args.get('lng', type=float)
+    if (lat is None) != (lng is None):
+        return jsonify({"error": "lat and lng go together"}), 400
+
+    if city and not event_index.has_city(city):
+        try:
+            # may come from a cache another worker filled, so it is indexed here as well
+            event_index.add(city, get_city_events(city, EVENTS_PAGE_SIZE))
+        except upstream.RateLimited as e:
+            return rate_limited(e)
+        except upstream.DeadlineExceeded as e:
+            return deadline_exceeded(e)
+        except requests.RequestException as e:
+            return jsonify({"error": "Failed to connect to Ticketmaster", "details": str(e)}), 500
+
+    return jsonify(event_index.search(
+        q=args.get('q', ''),
+        city=city,
+        segments=args.getlist('segment'),
+        genres=args.getlist('genre'),
+        start=args.get('start', ''),
+        end=args.get('end', ''),
+        near=(lat, lng) if lat is not None else None,
+        radius=args.get('radius', 5000, type=float),
+        offset=max(0, args.get('offset', 0, type=int)),
+        limit=max(1, min(args.get('limit', 20, type=int), SEARCH_MAX_LIMIT)),
+        fuzzy=args.get('fuzzy', '1') != '0'
+    ))
+
+def deadline_exceeded(error: upstream.DeadlineExceeded):
+    """504 for a request whose latency budget ran out before Ticketmaster answered"""
+    return jsonify({"error": "Ticketmaster did not answer in time", "details": str(error)}), 504
+
+def get_city_events_paged(city: str, start_page: int = 0, pages: int = None) -> dict:
+    """
+    Up to pages Discovery pages of a city's events starting at start_page
+
+    the first page says how many there are, the rest are fetched concurrently
+    (EVENTS_PAGE_WORKERS at a time, started no faster than
+    EVENTS_PAGES_PER_SECOND, unpaced when that is 0). events are deduplicated
+    by id and kept in date order. next_cursor picks up where this batch
+    stopped, including at a page that failed, and is None once the listing
+    (or the API's paging depth) ends. the merged batch and each page are kept
+    in the event cache
+    """
+    pages = max(1, min(pages or EVENTS_MAX_PAGES, EVENTS_MAX_PAGES))
+    span = f"{start_page}-{start_page + pages - 1}"
+    key = (city.strip().lower(), EVENTS_PAGE_SIZE, span)
+    return event_cache.get(city, EVENTS_PAGE_SIZE, lambda: events_flight.do(
+        key, lambda: merge_events_pages(city, start_page, pages)), page=span)
+
+def merge_events_pages(city: str, start_page: int, pages: int) -> dict:
+    """Fetch and merge a run of Discovery pages, see get_city_events_paged"""
+    first_events, total_pages = fetch_events_page(city, start_page)
+
+    # the Discovery API refuses pages reaching past DISCOVERY_MAX_DEPTH events
+    last_page = min(total_pages, DISCOVERY_MAX_DEPTH // EVENTS_PAGE_SIZE) - 1
+    remaining = list(range(start_page + 1, min(start_page + pages, last_page + 1)))
+
+    started = time.monotonic()
+    # the page threads get what is left of this request's budget, a page it cuts off ends the batch
+    budget = upstream.remaining()
+
+    def fetch(offset_page):
+        offset, page = offset_page
+        delay = started + offset / EVENTS_PAGES_PER_SECOND - time.monotonic() if EVENTS_PAGES_PER_SECOND > 0 else 0
+        if delay > 0:
+            time.sleep(delay)
+        try:
+            with upstream.deadline(budget):
+                return fetch_events_page(city, page)[0]
+        except requests.RequestException as e:
+            print(f"Failed to fetch page {page} for {city}: {e}")
+            return None
+
+    batches = [first_events]
+    next_page = start_page + 1
+    if remaining:
+        with ThreadPoolExecutor(max_workers=min(EVENTS_PAGE_WORKERS, len(remaining))) as executor:
+            for page, events in zip(remaining, executor.map(fetch, enumerate(remaining, start=1))):
+                if events is None:
+                    break
+                batches.append(events)
+                next_page = page + 1
+
+    events = []
+    seen = set()
+    for batch in batches:
+        for event in batch:
+            if event['id'] not in seen:
+                seen.add(event['id'])
+                events.append(event)
+    # pages are date ordered already, this only fixes events that moved across a page boundary
+    events.sort(key=lambda e: (e['localdate'] == 'TBD', e['localdate']))
+
+    return {
+        "events": events,
+        "next_cursor": encode_cursor(next_page) if next_page <= last_page else None,
+        "pages_fetched": len(batches),
+        "total_pages": total_pages
+    }
+
+def encode_cursor(page: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"page": page}).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        page = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())['page']
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"bad cursor: {cursor}") from e
+    if not isinstance(page, int) or page < 0:
+        raise ValueError(f"bad cursor: {cursor}")
+    return page
+
+def get_city_events(city: str, size: int = 20) -> list:
+    """Events for a city, served from the event cache when possible"""
+    key = (city.strip().lower(), size)
+    return event_cache.get(city, size, lambda: events_flight.do(key, lambda: fetch_city_events(city, size)))
+
+def places_key(event_location: dict, search_types: list, radius: int, limit: int) -> tuple:
+    """Identity of a places dataset"""
+    return (
+        round(event_location['lat'], 6), round(event_location['lon'], 6),
+        event_location.get('name'), event_location.get('address'),
+        tuple(search_types), radius, limit
+    )
+
+def get_places_geojson(event_location: dict, search_types: list, radius: int, limit: int) -> dict:
+    """GeoJSON around an event, concurrent identical requests share one computation"""
+    key = places_key(event_location, search_types, radius, limit)
+    return places_flight.do(key, lambda: city_explorer.get_geojson_data(
+        event_location=event_location,
+        search_types=search_types,
+        radius=radius,
+        limit_per_category=limit
+    ), reuse=reusable_places)
+
+def reusable_places(data: dict) -> bool:
+    """
+    Whether GeoJSON another request computed will do for this one
+
+    a result the leader's budget cut short is only shared with requests whose
+    own budget is spent too, the others search again (mostly from the place
+    cache the leader's outstanding fetches keep filling)
+    """
+    if not data.get('properties', {}).get('partial'):
+        return True
+    left = upstream.remaining()
+    return left is not None and left <= 0
+
+def respond(data) -> Response:
+    """Map payload response in the format and compression the client negotiated"""
+    fmt = wire.negotiate_format(request.args.get('format'), request.headers.get('Accept', ''))
+    with metrics.stage('serialize'):
+        body, encoding = wire.compress(wire.encode(data, fmt), request.headers.get('Accept-Encoding', ''))
+
+    response = Response(body, mimetype=wire.MIMETYPES[fmt])
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    return response
+
+def stream_mode() -> str:
+    """'ndjson' or 'geojson' when the client asked for a streamed response, '' otherwise"""
+    mode = request.args.get('stream', '').strip().lower()
+    if mode in ('ndjson', 'geojson'):
+        return mode
+    if mode in ('1', 'true'):
+        return 'ndjson'
+    if 'application/x-ndjson' in request.headers.get('Accept', ''):
+        return 'ndjson'
+    return ''
+
+def stream_places(mode: str, event_location: dict, search_types: list, radius: int, limit: int,
+                  head: dict = None) -> Response:
+    """
+    Send the places around an event as they arrive instead of all at once
+
+    ndjson: one JSON object per line, the event marker feature first, each
+    category's features followed by a {"type": "Category"} line, and a final
+    {"type": "Summary"} line with the collection properties. geojson: the same
+    FeatureCollection get_geojson_data returns, serialized incrementally. head
+    holds extra top level fields sent before the places (as its own line in
+    ndjson, wrapping the collection as places_data in geojson)
+    """
+    items = within_budget(upstream.remaining(), city_explorer.iter_geojson(
+        event_location=event_location,
+        search_types=search_types,
+        radius=radius,
+        limit_per_category=limit
+    ))
+
+    def ndjson():
+        if head is not None:
+            yield json.dumps(dict(head, type="Event")) + "\n"
+        for item in items:
+            if item[0] == 'event':
+                yield json.dumps(item[1]) + "\n"
+            elif item[0] == 'category':
+                _, name, features = item
+                for feature in features:
+                    yield json.dumps(feature) + "\n"
+                yield json.dumps({"type": "Category", "name": name, "count": len(features)}) + "\n"
+            else:
+                yield json.dumps({"type": "Summary", "properties": item[1]}) + "\n"
+
+    def geojson():
+        if head is not None:
+            yield json.dumps(head)[:-1] + (', ' if head else '') + '"places_data": '
+        yield '{"type": "FeatureCollection", "features": ['
+        first = True
+        for item in items:
+            if item[0] == 'summary':
+                yield '], "properties": ' + json.dumps(item[1]) + '}'
+                break
+            features = [item[1]] if item[0] == 'event' else item[2]
+            for feature in features:
+                yield ('' if first else ', ') + json.dumps(feature)
+                first = False
+        if head is not None:
+            yield '}'
+
+    if mode == 'ndjson':
+        return Response(stream_with_context(ndjson()), mimetype='application/x-ndjson')
+    return Response(stream_with_context(geojson()), mimetype='application/geo+json')
+
+def within_budget(budget, items):
+    """Iterate items under a latency budget, a streamed body is produced after its view returned"""
+    with upstream.deadline(budget):
+        yield from items
+
+def fetch_city_events(city: str, size: int = 20) -> list:
+    """Fetch and transform a city's events straight from the Discovery API"""
+    data = fetch_discovery(city, size)
+    with metrics.stage('parse'):
+        events = transform_events(data)
+    event_index.add(city, events)
+    return events
+
+def fetch_events_page(city: str, page: int) -> tuple:
+    """
+    (events, total pages) for one EVENTS_PAGE_SIZE page, from the event cache
+    when possible, identical concurrent page fetches are shared
+    """
+    key = (city.strip().lower(), EVENTS_PAGE_SIZE, page)
+
+    def fetch():
+        data = fetch_discovery(city, EVENTS_PAGE_SIZE, page)
+        events = transform_events(data)
+        event_index.add(city, events)
+        return events, data.get("page", {}).get("totalPages", 1)
+
+    return event_cache.get(city, EVENTS_PAGE_SIZE, lambda: events_flight.do(key, fetch), page=page)
+
+def fetch_discovery(city: str, size: int, page: int = 0) -> dict:
+    """Raw Discovery API response for one page of a city's events"""
+    with metrics.stage('fetch'):
+        response = ticketmaster_client.get(TICKETMASTER_URL, params=discovery_params(city, size, page))
+        response.raise_for_status()
+        return response.json()
+
+def discovery_params(city: str, size: int, page: int = 0) -> dict:
+    """Discovery API query for one page of a city's events"""
     params = {
         "apikey": TICKETMASTER_API_KEY,
         "city": city,
         "size": size,
         "sort": "date,asc"
     }
+    if page:
+        params["page"] = page
+    return params
 
-    try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        data = response.json()
-    except requests.RequestException as e:
-        return jsonify({"error": "Failed to connect to Ticketmaster", "details": str(e)}), 500
-
+def transform_events(data: dict) -> list:
+    """Transformed events of a Discovery API response, skipping ones that don't parse"""
     events = []
     if "_embedded" in data:
         for event in data["_embedded"]["events"]:
             try:
-                venue = event["_embedded"]["venues"][0]
-                events.append({
-                    "id": event["id"],
-                    "name": event["name"],
-                    "url": event["url"] if "url" in event else "",
-                    "localdate": event["dates"]["start"].get("localDate", "TBD"),
-                    "venue": venue.get("name", "Unknown"),
-                    "address": venue.get("address", {}).get("line1", ""),
-                    "city": venue.get("city", {}).get("name", ""),
-                    "lat": float(venue["location"]["latitude"]),
-                    "lng": float(venue["location"]["longitude"]),
-                    "segment": event.get("classifications", [{}])[0].get("segment", {}).get("name", "Unknown"),
-                    "genre": event.get("classifications", [{}])[0].get("genre", {}).get("name", "Unknown")
-                })
+                events.append(transform_event(event))
             except (KeyError, IndexError, ValueError) as parse_error:
                 print(f"Skipping event due to parse error: {parse_error}")
                 continue
 
-    return jsonify(events)
+    return events
+
+def transform_event(event: dict) -> dict:
+    """Flatten a Discovery API event into the shape the frontend uses"""
+    venue = event["_embedded"]["venues"][0]
+    return {
+        "id": event["id"],
+        "name": event["name"],
+        "url": event["url"] if "url" in event else "",
+        "localdate": event["dates"]["start"].get("localDate", "TBD"),
+        "venue": venue.get("name", "Unknown"),
+        "address": venue.get("address", {}).get("line1", ""),
+        "city": venue.get("city", {}).get("name", ""),
+        "lat": float(venue["location"]["latitude"]),
+        "lng": float(venue["location"]["longitude"]),
+        "segment": event.get("classifications", [{}])[0].get("segment", {}).get("name", "Unknown"),
+        "genre": event.get("classifications", [{}])[0].get("genre", {}).get("name", "Unknown")
+    }
 
 @app.route('/places')
+@budgeted
 def get_places():
     """Get places near an event location"""
     try:
@@ -95,20 +664,128 @@ def get_places():
             'address': address
         }
 
+        mode = stream_mode()
+        if mode:
+            return stream_places(mode, event_location, search_types, radius, limit)
+
         # get GeoJSON data
-        geojson_data = city_explorer.get_geojson_data(
-            event_location=event_location,
-            search_types=search_types,
-            radius=radius,
-            limit_per_category=limit
-        )
+        geojson_data = get_places_geojson(event_location, search_types, radius, limit)
 
-        return jsonify(geojson_data)
+        return respond(geojson_data)
 
     except Exception as e:
         return jsonify({"error": "Failed to fetch places", "details": str(e)}), 500
 
+@app.route('/plan')
+@budgeted
+def plan_evening():
+    """
+    Plan stops around an event
+
+    lat/lng of the venue, datetime (ISO, a bare date is taken as 19:00) and
+    duration minutes of the event, before and after (repeatable search types,
+    one stop each), radius and limit for the candidate places. returns the
+    stops in walking order with arrival and departure times, search types that
+    could not be fitted in are listed in unplanned
+    """
+    args = request.args
+    lat = args.get('lat', type=float)
+    lng = args.get('lng', type=float)
+    if lat is None or lng is None:
+        return jsonify({"error": "Missing lat/lng parameters"}), 400
+    try:
+        event_start = planner.parse_event_time(args.get('datetime', ''))
+    except ValueError:
+        return jsonify({"error": "datetime must be an ISO date or date and time"}), 400
+
+    before = args.getlist('before') or ['restaurants']
+    after = args.getlist('after') or ['bars']
+    try:
+        places = city_explorer.places_by_category(
+            {'lat': lat, 'lon': lng}, list(dict.fromkeys(before + after)),
+            radius=args.get('radius', 1500, type=int),
+            limit_per_category=args.get('limit', 20, type=int)
+        )
+    except Exception as e:
+        return jsonify({"error": "Failed to fetch places", "details": str(e)}), 500
+
+    # a category that failed has no candidates, the planner reports it as unplanned
+    plan = planner.plan_route(
+        (lat, lng), event_start, args.get('duration', 180, type=int),
+        {search_type: places.get(search_type) or [] for search_type in before},
+        {search_type: places.get(search_type) or [] for search_type in after},
+        speed=PLAN_WALK_SPEED, buffer=PLAN_BUFFER, time_limit=PLAN_TIME_LIMIT
+    )
+    plan["partial"] = any(places.get(search_type) is None for search_type in before + after)
+    return jsonify(plan)
+
+@app.route('/places/clusters')
+@budgeted
+def get_place_clusters():
+    """
+    Clustered places for a map viewport
+
+    takes the /places parameters plus zoom and bbox=west,south,east,north
+    (the whole search circle when left out). places closer than a marker's
+    width at that zoom come back as one cluster point with a point_count and
+    a per category breakdown
+    """
+    try:
+        lat = request.args.get('lat', type=float)
+        lng = request.args.get('lng', type=float)
+        event_name = request.args.get('event_name', 'Event Location')
+        address = request.args.get('address', '')
+        search_types = request.args.getlist('types') or ['restaurants', 'bars', 'entertainment']
+        radius = request.args.get('radius', 1000, type=int)
+        limit = request.args.get('limit', 10, type=int)
+        zoom = request.args.get('zoom', 14, type=int)
+
+        if not lat or not lng:
+            return jsonify({"error": "Missing lat/lng parameters"}), 400
+
+        event_location = {
+            'name': event_name,
+            'lat': lat,
+            'lon': lng,
+            'address': address
+        }
+
+        bbox = request.args.get('bbox')
+        if bbox:
+            try:
+                bbox = [float(v) for v in bbox.split(',')]
+            except ValueError:
+                bbox = []
+            if len(bbox) != 4:
+                return jsonify({"error": "bbox must be west,south,east,north"}), 400
+
+        key = 'clusters:' + json.dumps(places_key(event_location, search_types, radius, limit))
+        entry = cluster_cache.get(key)
+        if entry is None:
+            geojson_data = get_places_geojson(event_location, search_types, radius, limit)
+            entry = (ClusterPyramid(geojson_data['features']), geojson_data['properties'])
+            # a map missing categories is served once but not kept, the next request searches again
+            if not geojson_data['properties'].get('partial'):
+                cluster_cache.set(key, entry)
+        pyramid, properties = entry
+
+        if not bbox:
+            bounds = properties['bounds']
+            bbox = [bounds['west'], bounds['south'], bounds['east'], bounds['north']]
+
+        features = pyramid.query(bbox, zoom)
+        return respond({
+            "type": "FeatureCollection",
+            "features": features,
+            "properties": dict(properties, zoom=zoom, bbox=bbox, clusters=sum(
+                1 for f in features if f['properties'].get('cluster')))
+        })
+
+    except Exception as e:
+        return jsonify({"error": "Failed to fetch place clusters", "details": str(e)}), 500
+
 @app.route('/event-with-places')
+@budgeted
 def get_event_with_places():
     # Get a specific event with nearby places data
     try:
@@ -138,81 +815,150 @@ def get_event_with_places():
             'address': address
         }
 
+        event = {
+            "id": event_id,
+            "name": event_name,
+            "lat": lat,
+            "lng": lng,
+            "address": address,
+            "venue": venue,
+            "datetime": datetime,
+            "url": url
+        }
+        search_params = {
+            "types": search_types,
+            "radius": radius,
+            "limit_per_category": limit
+        }
+
+        mode = stream_mode()
+        if mode:
+            return stream_places(mode, event_location, search_types, radius, limit,
+                                 head={"event": event, "search_params": search_params})
+
         # get places around the event
-        geojson_data = city_explorer.get_geojson_data(
-            event_location=event_location,
-            search_types=search_types,
-            radius=radius,
-            limit_per_category=limit
-        )
+        geojson_data = get_places_geojson(event_location, search_types, radius, limit)
 
         # return both event data and places data
         response_data = {
-            "event": {
-                "id": event_id,
-                "name": event_name,
-                "lat": lat,
-                "lng": lng,
-                "address": address,
-                "venue": venue,
-                "datetime": datetime,
-                "url": url
-            },
+            "event": event,
             "places_data": geojson_data,
-            "search_params": {
-                "types": search_types,
-                "radius": radius,
-                "limit_per_category": limit
-            }
+            "search_params": search_params
         }
 
-        return jsonify(response_data)
+        return respond(response_data)
 
     except Exception as e:
         return jsonify({"error": "Failed to fetch event with places", "details": str(e)}), 500
 
+@app.route('/places/batch', methods=['POST'])
+@budgeted
+def get_places_batch():
+    """
+    Places for many events in one call
+
+    body: {"events": [{"id", "lat", "lng", "name"?, "address"?}, ...], "types"?,
+    "radius"?, "limit"?}, radius and limit are capped at BATCH_MAX_RADIUS and
+    BATCH_MAX_LIMIT. events at the same venue or within
+    BATCH_CLUSTER_RADIUS meters of each other are looked up once, around the
+    first of them, and every event points at its cluster's place set by key
+    """
+    body = request.get_json(silent=True) or {}
+    events = body.get('events')
+    search_types = body.get('types') or ['restaurants', 'bars', 'entertainment']
+    try:
+        radius = max(1, min(int(body.get('radius', 1000)), BATCH_MAX_RADIUS))
+        limit = max(1, min(int(body.get('limit', 10)), BATCH_MAX_LIMIT))
+    except (TypeError, ValueError):
+        return jsonify({"error": "radius and limit must be integers"}), 400
+
+    if not isinstance(events, list) or not events:
+        return jsonify({"error": "Missing 'events' list"}), 400
+    if len(events) > BATCH_MAX_EVENTS:
+        return jsonify({"error": f"At most {BATCH_MAX_EVENTS} events per batch"}), 400
+    try:
+        points = [(float(event['lat']), float(event['lng'])) for event in events]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "Every event needs numeric lat/lng"}), 400
+
+    labels = geometry.cluster_points([p[0] for p in points], [p[1] for p in points], BATCH_CLUSTER_RADIUS)
+
+    anchors = {}
+    for event, (lat, lng), label in zip(events, points, labels):
+        anchors.setdefault(label, {
+            'name': event.get('venue') or event.get('name', 'Event Location'),
+            'lat': lat,
+            'lon': lng,
+            'address': event.get('address', '')
+        })
+
+    budget = upstream.remaining()
+
+    def fetch(label):
+        try:
+            with upstream.deadline(budget):
+                return get_places_geojson(anchors[label], search_types, radius, limit)
+        except Exception as e:
+            return {"error": "Failed to fetch places", "details": str(e)}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(BATCH_WORKERS, len(anchors)))) as executor:
+        place_sets = dict(zip((str(label) for label in anchors), executor.map(fetch, anchors)))
+
+    return respond({
+        "events": [
+            {
+                "id": event.get('id'),
+                "place_set": str(label),
+                "distance_to_anchor": int(geometry.haversine_m(lat, lng, anchors[label]['lat'], anchors[label]['lon']))
+            }
+            for event, (lat, lng), label in zip(events, points, labels)
+        ],
+        "place_sets": place_sets,
+        "search_params": {
+            "types": search_types,
+            "radius": radius,
+            "limit_per_category": limit,
+            "cluster_radius": BATCH_CLUSTER_RADIUS
+        }
+    })
+
 @app.route('/event-map-data')
+@budgeted
 def get_event_map_data():
     # get both event and surrounding places data for map
     try:
         event_id = request.args.get('event_id')
-        city = request.args.get('city')
-        
+        city = request.args.get('city', '').strip()
+        size = request.args.get('size', 20, type=int)
+        search_types = request.args.getlist('types') or ['restaurants', 'bars', 'entertainment', 'attractions']
+        radius = request.args.get('radius', 1500, type=int)
+        limit = request.args.get('limit', 15, type=int)
+
         if not city:
             return jsonify({"error": "Missing city parameter"}), 400
 
-        events_response = get_events()
-        if events_response[1] != 200: 
-            return events_response
-
-        events_data = events_response[0].get_json()
-        events = events_data.get('events', [])
+        try:
+            events = get_city_events(city, size)
+        except upstream.RateLimited as e:
+            return rate_limited(e)
+        except upstream.DeadlineExceeded as e:
+            return deadline_exceeded(e)
+        except requests.RequestException as e:
+            return jsonify({"error": "Failed to connect to Ticketmaster", "details": str(e)}), 500
 
         if not events:
             return jsonify({"error": "No events found"}), 404
 
         # if specific event_id provided, find that event
-        if event_id:
-            selected_event = next((e for e in events if e['id'] == event_id), events[0])
-        else:
-            selected_event = events[0]
+        index = next((i for i, e in enumerate(events) if e['id'] == event_id), 0) if event_id else 0
+        selected_event = events[index]
 
-        # get places around the selected event
-        event_location = {
-            'name': selected_event['name'],
-            'lat': selected_event['lat'],
-            'lon': selected_event['lng'],
-            'address': selected_event['address']
-        }
+        # the events after the selected one are the likeliest next clicks, warm their places
+        prefetch_places(events[index + 1:index + 1 + PREFETCH_EVENTS], search_types, radius, limit)
 
-        geojson_data = city_explorer.get_geojson_data(
-            event_location=event_location,
-            search_types=['restaurants', 'bars', 'entertainment', 'attractions'],
-            radius=1500,
-            limit_per_category=15
-        )
+        geojson_data = get_places_geojson(event_location_for(selected_event), search_types, radius, limit)
 
-        return jsonify({
+        return respond({
             "event": selected_event,
             "map_data": geojson_data,
             "all_events": events
@@ -221,6 +967,46 @@ def get_event_map_data():
     except Exception as e:
         return jsonify({"error": "Failed to fetch event map data", "details": str(e)}), 500
 
+def event_location_for(event: dict) -> dict:
+    """Geoapify event location for a transformed event"""
+    return {
+        'name': event['name'],
+        'lat': event['lat'],
+        'lon': event['lng'],
+        'address': event['address']
+    }
+
+def prefetch_places(events: list, search_types: list, radius: int, limit: int) -> None:
+    """
+    Fetch places for events in the background so a later click is served warm
+
+    runs on the bounded prefetch pool, events that would push the queue past
+    PREFETCH_QUEUE_SIZE are dropped rather than queued behind everything else.
+    results land in the place cache, and a click on an event still being
+    prefetched joins that computation through singleflight
+    """
+    for event in events:
+        with prefetch_lock:
+            if prefetch_stats['pending'] >= PREFETCH_QUEUE_SIZE:
+                prefetch_stats['dropped'] += 1
+                continue
+            prefetch_stats['pending'] += 1
+            prefetch_stats['submitted'] += 1
+        prefetch_executor.submit(_prefetch_one, event_location_for(event), search_types, radius, limit)
+
+def _prefetch_one(event_location: dict, search_types: list, radius: int, limit: int) -> None:
+    try:
+        # warming never takes upstream slots ahead of a user's request
+        with upstream.background():
+            get_places_geojson(event_location, search_types, radius, limit)
+    except Exception as e:
+        print(f"Prefetch failed for {event_location.get('name')}: {e}")
+        with prefetch_lock:
+            prefetch_stats['failed'] += 1
+    finally:
+        with prefetch_lock:
+            prefetch_stats['pending'] -= 1
+
 if __name__ == '__main__':
      print("Starting Flask CityPulse app")
      app.run(debug=True)
\ No newline at end of file
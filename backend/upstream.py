@@ -0,0 +1,667 @@
+import time
+import heapq
+import asyncio
+import random
+import itertools
+import threading
+import collections
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from contextlib import contextmanager, nullcontext
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Sequence, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+import metrics
+
+
+# statuses worth another try, everything else goes straight back to the caller
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# request priorities, lower goes first
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = ('interactive', 'background')
+
+_priority = contextvars.ContextVar('upstream_priority', default=INTERACTIVE)
+
+
+@contextmanager
+def background():
+    """upstream calls made inside this block queue behind interactive ones"""
+    token = _priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+_deadline = contextvars.ContextVar('upstream_deadline', default=None)
+
+
+@contextmanager
+def deadline(seconds: Optional[float]):
+    """
+    upstream calls made inside this block have to finish within seconds, a
+    falsy budget adds no limit and a nested budget can only shorten the outer one
+    """
+    if not seconds:
+        yield
+        return
+    expires = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(expires if current is None else min(current, expires))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """seconds left of the current budget, None when there is none"""
+    expires = _deadline.get()
+    return None if expires is None else expires - time.monotonic()
+
+
+class RateLimited(requests.RequestException):
+    """a request the rate limiter would not send, either the wait was too long or the daily quota is spent"""
+
+    def __init__(self, message: str, reason: str = 'wait', retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(requests.Timeout):
+    """the request's latency budget ran out before the upstream answered"""
+
+
+class RateLimiter:
+    """
+    token bucket with a priority queue and a daily quota for one upstream
+
+    tokens refill at rate per second up to burst. callers wait in priority
+    order (interactive before background, FIFO within a priority) and give up
+    with RateLimited after max_wait[priority] seconds, so a spike turns into
+    cache hits and partial results instead of upstream 429s. background work
+    may only spend background_share of the daily quota, the rest is kept for
+    users. the quota resets at midnight UTC. limits are per process, divide
+    them by the number of workers.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None, daily_quota: int = 0,
+                 background_share: float = 0.8, max_wait: Sequence[float] = (2.0, 30.0)):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.daily_quota = daily_quota
+        self.background_share = background_share
+        self.max_wait = tuple(max_wait)
+
+        self._tokens = self.burst
+        self._refilled = time.monotonic()
+        self._day = self._today()
+        self.used_today = 0
+
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self.granted = [0] * len(PRIORITY_NAMES)
+        self.rejected = [0] * len(PRIORITY_NAMES)
+
+    def acquire(self, priority: Optional[int] = None) -> None:
+        """wait for a token, raises RateLimited instead of waiting past max_wait or the request's budget"""
+        priority = current_priority() if priority is None else priority
+        deadline = time.monotonic() + self._max_wait(priority)
+        ticket = (priority, next(self._sequence))
+
+        with self._cond:
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    self._check_quota(priority)
+                    now = time.monotonic()
+                    self._refill(now)
+                    first = self._waiters[0] == ticket
+                    if first and self._tokens >= 1:
+                        self._tokens -= 1
+                        self.used_today += 1
+                        self.granted[priority] += 1
+                        heapq.heappop(self._waiters)
+                        self._cond.notify_all()
+                        return
+
+                    remaining = deadline - now
+                    ready_in = (1 - self._tokens) / self.rate if first else remaining
+                    if remaining <= 0 or (first and ready_in > remaining):
+                        raise RateLimited(f"rate limited, next slot in {ready_in:.2f}s", 'wait', ready_in)
+                    self._cond.wait(min(remaining, ready_in))
+            except RateLimited:
+                self.rejected[priority] += 1
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+                raise
+
+    async def acquire_async(self, priority: Optional[int] = None) -> None:
+        """
+        acquire for coroutines, sleeps on the event loop instead of blocking it.
+        async callers don't queue among themselves, they retry when a token is
+        due, but they still give way to any waiting thread of higher priority
+        """
+        priority = current_priority() if priority is None else priority
+        deadline = time.monotonic() + self._max_wait(priority)
+
+        while True:
+            with self._cond:
+                try:
+                    self._check_quota(priority)
+                except RateLimited:
+                    self.rejected[priority] += 1
+                    raise
+                now = time.monotonic()
+                self._refill(now)
+                ahead = bool(self._waiters) and self._waiters[0][0] <= priority
+                if not ahead and self._tokens >= 1:
+                    self._tokens -= 1
+                    self.used_today += 1
+                    self.granted[priority] += 1
+                    return
+                ready_in = max((1 - self._tokens) / self.rate, 1 / self.rate if ahead else 0.0, 0.001)
+                if now + ready_in > deadline:
+                    self.rejected[priority] += 1
+                    raise RateLimited(f"rate limited, next slot in {ready_in:.2f}s", 'wait', ready_in)
+            await asyncio.sleep(ready_in)
+
+    def try_acquire(self, priority: Optional[int] = None) -> bool:
+        """take a token only if one is free right now and nobody is waiting ahead"""
+        priority = current_priority() if priority is None else priority
+        with self._cond:
+            if self.daily_quota:
+                self._roll_day()
+                budget = self.daily_quota if priority == INTERACTIVE else int(self.daily_quota * self.background_share)
+                if self.used_today >= budget:
+                    return False
+            self._refill(time.monotonic())
+            if self._waiters or self._tokens < 1:
+                return False
+            self._tokens -= 1
+            self.used_today += 1
+            self.granted[priority] += 1
+            return True
+
+    def quota_remaining(self) -> Optional[int]:
+        if not self.daily_quota:
+            return None
+        with self._cond:
+            self._roll_day()
+            return max(0, self.daily_quota - self.used_today)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            self._refill(time.monotonic())
+            return {
+                "rate": self.rate,
+                "tokens": round(self._tokens, 2),
+                "waiting": len(self._waiters),
+                "used_today": self.used_today,
+                "daily_quota": self.daily_quota or None,
+                "granted": dict(zip(PRIORITY_NAMES, self.granted)),
+                "rejected": dict(zip(PRIORITY_NAMES, self.rejected))
+            }
+
+    def _max_wait(self, priority: int) -> float:
+        left = remaining()
+        return self.max_wait[priority] if left is None else max(0.0, min(self.max_wait[priority], left))
+
+    def _check_quota(self, priority: int) -> None:
+        if not self.daily_quota:
+            return
+        self._roll_day()
+        budget = self.daily_quota if priority == INTERACTIVE else int(self.daily_quota * self.background_share)
+        if self.used_today >= budget:
+            raise RateLimited("daily quota spent", 'quota', 86400 - time.time() % 86400)
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def _roll_day(self) -> None:
+        today = self._today()
+        if today != self._day:
+            self._day = today
+            self.used_today = 0
+
+    @staticmethod
+    def _today() -> int:
+        return int(time.time() // 86400)
+
+
+class _RetryingClient:
+    """configuration, retry and hedging policy and counters shared by the sync and async clients"""
+
+    def __init__(self, name: str, connect_timeout: float = 3.05, read_timeout: float = 10, max_retries: int = 2,
+                 backoff_base: float = 0.25, backoff_max: float = 4.0, max_retry_after: float = 10.0,
+                 limiter: Optional[RateLimiter] = None, hedge_percentile: Optional[float] = None,
+                 hedge_min_samples: int = 20, hedge_min_delay: float = 0.05):
+        self.name = name
+        self.limiter = limiter
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+
+        # an attempt still running at this percentile of recent latencies gets a duplicate
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_min_delay = hedge_min_delay
+        self._latencies = collections.deque(maxlen=256)
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def stats(self) -> Dict:
+        stats = {
+            "requests": self.requests,
+            "retries": self.retries,
+            "failures": self.failures,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins
+        }
+        if self.limiter is not None:
+            stats["limiter"] = self.limiter.stats()
+        return stats
+
+    def hedge_delay(self) -> Optional[float]:
+        """seconds to wait on an attempt before sending a duplicate, None when hedging is off or still warming up"""
+        if not self.hedge_percentile:
+            return None
+        with self._lock:
+            if len(self._latencies) < self.hedge_min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        threshold = latencies[min(len(latencies) - 1, int(self.hedge_percentile * len(latencies)))]
+        return max(self.hedge_min_delay, threshold)
+
+    def _record_latency(self, seconds: float) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def _timeouts(self, read_timeout: float) -> Tuple[float, float, bool]:
+        """(connect, read) timeouts cut to the request's budget, and whether the budget is what bounds them"""
+        left = remaining()
+        if left is None:
+            return self.connect_timeout, read_timeout, False
+        if left <= 0:
+            raise DeadlineExceeded(f"{self.name}: latency budget spent")
+        return min(self.connect_timeout, left), min(read_timeout, left), left < max(self.connect_timeout, read_timeout)
+
+    def _can_wait(self, delay: float) -> bool:
+        # no retry the budget can't fit
+        left = remaining()
+        return left is None or delay < left
+
+    def _throttled(self, error: RateLimited) -> None:
+        metrics.upstream_throttled.inc(upstream=self.name, reason=error.reason,
+                                       priority=PRIORITY_NAMES[current_priority()])
+
+    def _hedged(self, won: bool) -> None:
+        self._count('hedges')
+        if won:
+            self._count('hedge_wins')
+        metrics.upstream_hedges.inc(upstream=self.name, winner='hedge' if won else 'original')
+
+    def _backoff(self, attempt: int) -> float:
+        # full jitter keeps a burst of failing callers from retrying in lockstep
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _retry_after(self, response) -> Optional[float]:
+        # None means the server asked us to wait longer than we are willing to
+        header = response.headers.get('Retry-After')
+        if not header:
+            return self._backoff(0 if response.status_code != 429 else 1)
+
+        try:
+            delay = float(header)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(header).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return self._backoff(1)
+
+        delay = max(0.0, delay)
+        return delay if delay <= self.max_retry_after else None
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+
+class UpstreamClient(_RetryingClient):
+    """
+    pooled HTTP client for one upstream API
+
+    wraps a requests.Session so connections are kept alive and reused per host,
+    applies (connect, read) timeouts to every call and retries connection errors
+    and 429/5xx responses with jittered exponential backoff. a Retry-After header
+    is honoured as long as it is no longer than max_retry_after. read timeouts are
+    not retried, so a slow upstream costs at most one read timeout. with a
+    limiter every attempt, retries included, first takes a token from it.
+
+    inside a deadline() block timeouts are cut to the time left and retries
+    that wouldn't fit are skipped, DeadlineExceeded is raised once it runs out.
+    with hedge_percentile set, an attempt slower than that percentile of recent
+    ones gets a duplicate on another thread and the first answer wins.
+    """
+
+    def __init__(self, name: str, pool_size: int = 10, **options):
+        super().__init__(name, **options)
+        self.pool_size = pool_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._attempts = None
+
+    def get(self, url: str, params: Optional[Dict] = None, timeout: Optional[float] = None,
+            slots: Optional[threading.Semaphore] = None) -> requests.Response:
+        """
+        GET with retries, raises requests.RequestException once retries run out
+
+        slots is an optional semaphore held for each attempt only, never while
+        sleeping between attempts
+        """
+        read_timeout = self.read_timeout if timeout is None else timeout
+        attempt = 0
+
+        while True:
+            if self.limiter is not None:
+                try:
+                    self.limiter.acquire()
+                except RateLimited as e:
+                    self._throttled(e)
+                    raise
+            self._count('requests')
+            try:
+                response = self._send(url, params, read_timeout, slots)
+            except (requests.ReadTimeout, DeadlineExceeded) as e:
+                metrics.upstream_errors.inc(upstream=self.name, error=type(e).__name__)
+                self._count('failures')
+                raise
+            except requests.ConnectionError as e:
+                # includes connect timeouts, the request never reached the upstream
+                metrics.upstream_errors.inc(upstream=self.name, error=type(e).__name__)
+                delay = self._backoff(attempt)
+                if attempt >= self.max_retries or not self._can_wait(delay):
+                    self._count('failures')
+                    raise
+            else:
+                metrics.upstream_responses.inc(upstream=self.name, status=str(response.status_code))
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+
+                delay = self._retry_after(response)
+                if attempt >= self.max_retries or delay is None or not self._can_wait(delay):
+                    self._count('failures')
+                    return response
+                response.close()
+
+            attempt += 1
+            self._count('retries')
+            time.sleep(delay)
+
+    def close(self) -> None:
+        self.session.close()
+        if self._attempts is not None:
+            self._attempts.shutdown(wait=False)
+
+    def _send(self, url: str, params: Optional[Dict], read_timeout: float,
+              slots: Optional[threading.Semaphore]) -> requests.Response:
+        hedge_after = self.hedge_delay()
+        if hedge_after is None:
+            return self._attempt(url, params, read_timeout, slots)
+
+        pool = self._attempt_pool()
+        first = pool.submit(contextvars.copy_context().run, self._attempt, url, params, read_timeout, slots)
+        try:
+            return first.result(timeout=hedge_after)
+        except FutureTimeout:
+            pass
+
+        # the duplicate only goes out when the rate limiter has a token to spare right now
+        if self.limiter is not None and not self.limiter.try_acquire():
+            return first.result()
+        second = pool.submit(contextvars.copy_context().run, self._attempt, url, params, read_timeout, slots)
+
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winners = [future for future in done if future.exception() is None]
+            if winners:
+                self._hedged(winners[0] is second)
+                for future in winners[1:]:
+                    future.result().close()
+                for future in pending:
+                    future.add_done_callback(_close_response)
+                return winners[0].result()
+            error = error or next(iter(done)).exception()
+        raise error
+
+    def _attempt(self, url: str, params: Optional[Dict], read_timeout: float,
+                 slots: Optional[threading.Semaphore]) -> requests.Response:
+        with slots if slots is not None else nullcontext():
+            # timeouts are worked out once the slot is ours, waiting for it used up budget
+            connect_timeout, read_timeout, bounded = self._timeouts(read_timeout)
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params, timeout=(connect_timeout, read_timeout))
+            except requests.Timeout as e:
+                if bounded:
+                    raise DeadlineExceeded(f"{self.name}: latency budget spent") from e
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                metrics.upstream_seconds.observe(elapsed, upstream=self.name)
+        self._record_latency(elapsed)
+        return response
+
+    def _attempt_pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._attempts is None:
+                self._attempts = ThreadPoolExecutor(max_workers=self.pool_size * 4,
+                                                    thread_name_prefix=f"{self.name}-attempt")
+            return self._attempts
+
+
+def _close_response(future) -> None:
+    # the losing attempt of a hedged pair, its connection goes back to the pool
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+class AsyncUpstreamClient(_RetryingClient):
+    """
+    non-blocking counterpart of UpstreamClient on httpx.AsyncClient
+
+    same timeouts, retry policy, rate limiter and metrics. httpx errors are
+    raised as their requests equivalents so callers handle both clients the
+    same way. the connection pool belongs to the event loop the first request
+    runs on, make one client per loop and aclose() it when the loop ends.
+    """
+
+    def __init__(self, name: str, pool_size: int = 100, transport=None, **options):
+        super().__init__(name, **options)
+        if httpx is None:
+            raise RuntimeError("the async client needs httpx installed")
+        self.session = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            transport=transport
+        )
+
+    @classmethod
+    def like(cls, client: UpstreamClient, **options) -> 'AsyncUpstreamClient':
+        """async client with a sync client's name, timeouts, retry policy and rate limiter"""
+        settings = {
+            'connect_timeout': client.connect_timeout,
+            'read_timeout': client.read_timeout,
+            'max_retries': client.max_retries,
+            'backoff_base': client.backoff_base,
+            'backoff_max': client.backoff_max,
+            'max_retry_after': client.max_retry_after,
+            'limiter': client.limiter,
+            'hedge_percentile': client.hedge_percentile,
+            'hedge_min_samples': client.hedge_min_samples,
+            'hedge_min_delay': client.hedge_min_delay
+        }
+        settings.update(options)
+        return cls(client.name, **settings)
+
+    async def get(self, url: str, params: Optional[Dict] = None, timeout: Optional[float] = None,
+                  slots: Optional[asyncio.Semaphore] = None):
+        """
+        GET with retries, returns an httpx.Response and raises requests.RequestException like UpstreamClient
+
+        slots is an optional semaphore of the running loop, held for each attempt like UpstreamClient's
+        """
+        read_timeout = self.read_timeout if timeout is None else timeout
+        attempt = 0
+
+        while True:
+            if self.limiter is not None:
+                try:
+                    await self.limiter.acquire_async()
+                except RateLimited as e:
+                    self._throttled(e)
+                    raise
+            self._count('requests')
+            try:
+                response = await self._send(url, params, read_timeout, slots)
+            except (requests.ReadTimeout, DeadlineExceeded) as e:
+                metrics.upstream_errors.inc(upstream=self.name, error=type(e).__name__)
+                self._count('failures')
+                raise
+            except requests.ConnectionError as e:
+                metrics.upstream_errors.inc(upstream=self.name, error=type(e).__name__)
+                delay = self._backoff(attempt)
+                if attempt >= self.max_retries or not self._can_wait(delay):
+                    self._count('failures')
+                    raise
+            else:
+                metrics.upstream_responses.inc(upstream=self.name, status=str(response.status_code))
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+
+                delay = self._retry_after(response)
+                if attempt >= self.max_retries or delay is None or not self._can_wait(delay):
+                    self._count('failures')
+                    return response
+                await response.aclose()
+
+            attempt += 1
+            self._count('retries')
+            await asyncio.sleep(delay)
+
+    async def _send(self, url: str, params: Optional[Dict], read_timeout: float,
+                    slots: Optional[asyncio.Semaphore]):
+        hedge_after = self.hedge_delay()
+        first = asyncio.ensure_future(self._attempt(url, params, read_timeout, slots))
+        if hedge_after is None:
+            return await first
+
+        tasks = [first]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if done:
+                return first.result()
+            if self.limiter is not None and not self.limiter.try_acquire():
+                return await first
+            second = asyncio.ensure_future(self._attempt(url, params, read_timeout, slots))
+            tasks.append(second)
+
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winners = [task for task in done if task.exception() is None]
+                if winners:
+                    self._hedged(winners[0] is second)
+                    for task in winners[1:]:
+                        await task.result().aclose()
+                    return winners[0].result()
+                error = error or next(iter(done)).exception()
+            raise error
+        finally:
+            # the loser, or everything when the caller was cancelled
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def _attempt(self, url: str, params: Optional[Dict], read_timeout: float,
+                       slots: Optional[asyncio.Semaphore]):
+        async with slots if slots is not None else nullcontext():
+            # timeouts are worked out once the slot is ours, waiting for it used up budget
+            connect_timeout, read_timeout, bounded = self._timeouts(read_timeout)
+            start = time.perf_counter()
+            try:
+                response = await self.session.get(
+                    url, params=params, timeout=httpx.Timeout(read_timeout, connect=connect_timeout)
+                )
+            except httpx.TimeoutException as e:
+                if bounded:
+                    raise DeadlineExceeded(f"{self.name}: latency budget spent") from e
+                if isinstance(e, httpx.ReadTimeout):
+                    raise requests.ReadTimeout(str(e)) from e
+                raise requests.ConnectTimeout(str(e)) from e
+            except httpx.TransportError as e:
+                raise requests.ConnectionError(str(e)) from e
+            finally:
+                elapsed = time.perf_counter() - start
+                metrics.upstream_seconds.observe(elapsed, upstream=self.name)
+        self._record_latency(elapsed)
+        return response
+
+    async def aclose(self) -> None:
+        await self.session.aclose()
+
+
+def raise_for_status(response) -> None:
+    """requests.HTTPError for a 4xx/5xx response from either client"""
+    if response.status_code >= 400:
+        raise requests.HTTPError(f"{response.status_code} error from {response.url}")
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(name: str, **options) -> UpstreamClient:
+    """shared client for an upstream, options only apply when it is first created"""
+    with _clients_lock:
+        client = _clients.get(name)
+        if client is None:
+            client = UpstreamClient(name, **options)
+            _clients[name] = client
+        return client
+
+
+def all_stats() -> Dict:
+    with _clients_lock:
+        return {name: client.stats() for name, client in _clients.items()}
@@ -0,0 +1,234 @@
+import sys
+import gzip
+import json
+import struct
+from array import array
+from collections.abc import Sequence
+from typing import Dict, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# formats a client can ask for with ?format= or the matching Accept type
+JSON = 'json'
+COLUMNAR = 'columnar'
+BINARY = 'binary'
+
+MIMETYPES = {
+    JSON: 'application/json',
+    COLUMNAR: 'application/vnd.citypulse.columnar+json',
+    BINARY: 'application/vnd.citypulse.binary'
+}
+
+BINARY_MAGIC = b'CPW1'
+_BINARY_HEADER = struct.Struct('<4sII')  # magic, header length, number of coordinate doubles
+
+# properties with few distinct values, sent as an index into a lookup table
+TABLE_COLUMNS = ('category', 'subcategory', 'type', 'marker_color', 'marker_icon', 'marker_size')
+
+# bodies smaller than this aren't worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+
+def dumps(data) -> bytes:
+    """JSON bytes, through orjson when it is installed. sequences other than lists are written as arrays"""
+    if orjson is not None:
+        return orjson.dumps(data, default=json_default)
+    return json.dumps(data, separators=(',', ':'), default=json_default).encode('utf-8')
+
+
+def json_default(value):
+    """JSON encoder fallback writing lazily built sequences (arena.FeatureList) as arrays"""
+    if isinstance(value, Sequence) and not isinstance(value, (str, bytes)):
+        return list(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def to_columnar(collection: Dict) -> Dict:
+    """
+    FeatureCollection -> column layout
+
+    coordinates become one flat [lng, lat, lng, lat, ...] array, each property
+    becomes a column (a list with one value per feature), and the low
+    cardinality string columns are indices into tables. the collection's own
+    properties are carried over unchanged
+    """
+    features = collection.get('features', [])
+    properties = [feature.get('properties', {}) for feature in features]
+    coordinates = []
+    for feature in features:
+        coordinates.extend(feature['geometry']['coordinates'][:2])
+
+    keys = {}
+    for props in properties:
+        for key in props:
+            keys[key] = keys.get(key, 0) + 1
+
+    columns = {}
+    tables = {}
+    missing = {}
+    for key, present in keys.items():
+        values = [props.get(key) for props in properties]
+        if present < len(features):
+            # the event marker doesn't have the place keys, keep absent apart from null
+            missing[key] = [i for i, props in enumerate(properties) if key not in props]
+        if key in TABLE_COLUMNS:
+            table = list(dict.fromkeys(values))
+            lookup = {value: i for i, value in enumerate(table)}
+            tables[key] = table
+            values = [lookup[value] for value in values]
+        columns[key] = values
+
+    result = {
+        'type': 'ColumnarFeatureCollection',
+        'count': len(features),
+        'coordinates': coordinates,
+        'tables': tables,
+        'columns': columns
+    }
+    if missing:
+        result['missing'] = missing
+    if 'properties' in collection:
+        result['properties'] = collection['properties']
+    return result
+
+
+def from_columnar(columnar: Dict) -> Dict:
+    """column layout back into a FeatureCollection"""
+    coordinates = columnar['coordinates']
+    tables = columnar.get('tables', {})
+    columns = columnar.get('columns', {})
+    missing = {key: set(indices) for key, indices in columnar.get('missing', {}).items()}
+
+    features = []
+    for i in range(columnar['count']):
+        properties = {}
+        for key, values in columns.items():
+            if key in missing and i in missing[key]:
+                continue
+            properties[key] = tables[key][values[i]] if key in tables else values[i]
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [coordinates[2 * i], coordinates[2 * i + 1]]},
+            'properties': properties
+        })
+
+    collection = {'type': 'FeatureCollection', 'features': features}
+    if 'properties' in columnar:
+        collection['properties'] = columnar['properties']
+    return collection
+
+
+def encode(data, fmt: str = JSON) -> bytes:
+    """
+    serialize a response payload. every FeatureCollection in it (at the top or
+    nested, like places_data) is converted for the columnar and binary formats,
+    anything else is sent as is
+    """
+    if fmt == JSON:
+        return dumps(data)
+    if fmt == COLUMNAR:
+        return dumps(_map_collections(data, to_columnar))
+
+    # binary: the columnar payload as a JSON header, with every coordinate
+    # array moved out into one packed little endian float64 block after it
+    packed = array('d')
+
+    def pack(collection):
+        columnar = to_columnar(collection)
+        coordinates = columnar['coordinates']
+        columnar['coordinates'] = {'offset': len(packed), 'length': len(coordinates)}
+        packed.extend(coordinates)
+        return columnar
+
+    header = dumps(_map_collections(data, pack))
+    if sys.byteorder != 'little':
+        packed.byteswap()
+    return _BINARY_HEADER.pack(BINARY_MAGIC, len(header), len(packed)) + header + packed.tobytes()
+
+
+def decode(body: bytes, fmt: str = JSON):
+    """inverse of encode, columnar collections come back as plain FeatureCollections"""
+    if fmt == JSON:
+        return loads(body)
+    if fmt == COLUMNAR:
+        return _map_columnar(loads(body), from_columnar)
+
+    magic, header_length, count = _BINARY_HEADER.unpack_from(body)
+    if magic != BINARY_MAGIC:
+        raise ValueError("not a binary map payload")
+    start = _BINARY_HEADER.size
+    header = loads(body[start:start + header_length])
+    packed = array('d')
+    packed.frombytes(body[start + header_length:start + header_length + count * 8])
+    if sys.byteorder != 'little':
+        packed.byteswap()
+
+    def unpack(columnar):
+        span = columnar['coordinates']
+        columnar['coordinates'] = packed[span['offset']:span['offset'] + span['length']].tolist()
+        return from_columnar(columnar)
+
+    return _map_columnar(header, unpack)
+
+
+def negotiate_format(format_arg: Optional[str], accept: str) -> str:
+    """pick the payload format from ?format= first, then the Accept header"""
+    if format_arg:
+        format_arg = format_arg.strip().lower()
+        return format_arg if format_arg in MIMETYPES else JSON
+    for fmt in (BINARY, COLUMNAR):
+        if MIMETYPES[fmt] in (accept or ''):
+            return fmt
+    return JSON
+
+
+def compress(body: bytes, accept_encoding: str) -> Tuple[bytes, Optional[str]]:
+    """(body, content-encoding) using brotli when both sides have it, else gzip"""
+    if len(body) < MIN_COMPRESS_SIZE:
+        return body, None
+
+    encodings = {part.split(';')[0].strip().lower() for part in (accept_encoding or '').split(',')}
+    if brotli is not None and 'br' in encodings:
+        return brotli.compress(body, quality=5), 'br'
+    if 'gzip' in encodings:
+        return gzip.compress(body, compresslevel=6), 'gzip'
+    return body, None
+
+
+def _is_collection(value) -> bool:
+    return isinstance(value, dict) and value.get('type') == 'FeatureCollection'
+
+
+def _map_collections(data, fn):
+    if _is_collection(data):
+        return fn(data)
+    if isinstance(data, dict):
+        return {key: _map_collections(value, fn) for key, value in data.items()}
+    if isinstance(data, list):
+        return [_map_collections(value, fn) for value in data]
+    return data
+
+
+def _map_columnar(data, fn):
+    if isinstance(data, dict) and data.get('type') == 'ColumnarFeatureCollection':
+        return fn(data)
+    if isinstance(data, dict):
+        return {key: _map_columnar(value, fn) for key, value in data.items()}
+    if isinstance(data, list):
+        return [_map_columnar(value, fn) for value in data]
+    return data